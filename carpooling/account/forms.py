@@ -20,12 +20,7 @@ class SignupForm(UserCreationForm):
         if commit:
             instance.save()
         user = get_object_or_404(Member, email=self.cleaned_data["email"])
-        index.index_profile({
-            "id": user.id,
-            "username": user.username,
-            "first_name": user.first_name,
-            "last_name": user.last_name
-        }, schedule=1)
+        index.index_profile(index.get_profile_document(user))
         return instance
 
 
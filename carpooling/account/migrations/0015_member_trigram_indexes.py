@@ -0,0 +1,27 @@
+# Generated by Django 2.2.2 on 2026-10-18 19:40
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0014_auto_20190818_1251'),
+    ]
+
+    # The expressions match the UPPER(...) LIKE UPPER(...) queries of icontains lookups
+    operations = [
+        TrigramExtension(),
+        migrations.RunSQL(
+            'CREATE INDEX account_member_username_trgm_idx ON account_member '
+            'USING GIN ((UPPER(username::text)) gin_trgm_ops);'
+            'CREATE INDEX account_member_first_name_trgm_idx ON account_member '
+            'USING GIN ((UPPER(first_name::text)) gin_trgm_ops);'
+            'CREATE INDEX account_member_last_name_trgm_idx ON account_member '
+            'USING GIN ((UPPER(last_name::text)) gin_trgm_ops);',
+            'DROP INDEX account_member_username_trgm_idx;'
+            'DROP INDEX account_member_first_name_trgm_idx;'
+            'DROP INDEX account_member_last_name_trgm_idx;',
+        ),
+    ]
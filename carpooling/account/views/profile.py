@@ -139,8 +139,4 @@ class UserProfileManager(View):
 
     @staticmethod
     def update_in_elastic(request):
-        INDEX.update_profile({"doc": {
-            "id": request.user.id,
-            "first_name": request.POST.get('first_name'),
-            "last_name": request.POST.get('last_name')
-        }}, request.user.id, schedule=1)
+        INDEX.update_profile({"doc": INDEX.get_profile_document(request.user)}, request.user.id)
@@ -0,0 +1,152 @@
+from datetime import timedelta
+
+import numpy as np
+from django.contrib.gis.geos import Point, LineString
+from django.utils import timezone
+
+from account.models import Member
+from carpooling.settings.base import SCORING_ORIGIN
+from group.models import Group, Membership
+from trip.accessibility import refresh_trip_accessibility
+from trip.models import Trip, TripGroups, Companionship, TripRequestSet, TripRequest, AutomaticJoinRequest
+
+# Degrees, roughly 15 km and 1 km around Tehran
+CITY_RADIUS = 0.15
+HOTSPOT_RADIUS = 0.01
+
+
+class SyntheticDataGenerator:
+    """
+    Creates members, groups, trips, companionships and requests clustered around hotspots of a city, the way people
+    commute between a few neighborhoods and offices. Rows are bulk created, so the denormalized fields that the models
+    compute on save and the accessibility of trips are filled explicitly.
+    """
+
+    def __init__(self, trips_count, seed=0, center=SCORING_ORIGIN, hotspots_count=30, routes_ratio=0.2,
+                 private_ratio=0.3, batch_size=2000):
+        self.trips_count = trips_count
+        self.center = center
+        self.routes_ratio = routes_ratio
+        self.private_ratio = private_ratio
+        self.batch_size = batch_size
+        self.random = np.random.RandomState(seed)
+        self.prefix = 'benchmark{}_'.format(seed)
+        self.hotspots = np.array(center) + self.random.normal(scale=CITY_RADIUS / 2, size=(hotspots_count, 2))
+        self.start_time = timezone.now() + timedelta(hours=1)
+
+    @property
+    def members_count(self):
+        return max(self.trips_count // 2, 10)
+
+    @property
+    def groups_count(self):
+        return max(self.trips_count // 100, 2)
+
+    def generate(self):
+        members = self.create_members()
+        groups = self.create_groups()
+        self.create_memberships(members, groups)
+        trips = self.create_trips(members)
+        self.create_trip_groups(trips, groups)
+        self.create_companionships(trips, members)
+        self.create_trip_requests(trips, members)
+        self.create_automatic_join_requests(members)
+        refresh_trip_accessibility()
+        return members, trips
+
+    def get_point(self):
+        hotspot = self.hotspots[self.random.randint(len(self.hotspots))]
+        return Point(*(hotspot + self.random.normal(scale=HOTSPOT_RADIUS, size=2)))
+
+    def get_route(self, source, destination):
+        """
+        A polyline from source to destination bending away from the straight line, like streets do.
+        """
+        fractions = np.linspace(0, 1, 6)[:, np.newaxis]
+        points = np.array(source.coords) + fractions * (np.array(destination.coords) - np.array(source.coords))
+        points[1:-1] += self.random.normal(scale=HOTSPOT_RADIUS, size=(4, 2))
+        return LineString([tuple(point) for point in points])
+
+    def get_time_window(self):
+        start_estimation = self.start_time + timedelta(minutes=int(self.random.randint(0, 24 * 60)))
+        return start_estimation, start_estimation + timedelta(minutes=int(self.random.randint(15, 120)))
+
+    def create_members(self):
+        return Member.objects.bulk_create([
+            Member(username='{}{}'.format(self.prefix, index), email='{}{}@example.com'.format(self.prefix, index),
+                   password='!', phone_number='09120000000')
+            for index in range(self.members_count)
+        ], batch_size=self.batch_size)
+
+    def create_groups(self):
+        return Group.objects.bulk_create([
+            Group(code='{}{}'.format(self.prefix, index), title='Group {}'.format(index),
+                  is_private=self.random.rand() < self.private_ratio, source=self.get_point())
+            for index in range(self.groups_count)
+        ], batch_size=self.batch_size)
+
+    def create_memberships(self, members, groups):
+        memberships = {(member.id, groups[self.random.randint(len(groups))].id)
+                       for member in members for _ in range(self.random.randint(0, 3))}
+        Membership.objects.bulk_create([Membership(member_id=member_id, group_id=group_id, role=Membership.MEMBER)
+                                        for member_id, group_id in memberships], batch_size=self.batch_size)
+
+    def create_trips(self, members):
+        trips = []
+        for _ in range(self.trips_count):
+            source, destination = self.get_point(), self.get_point()
+            start_estimation, end_estimation = self.get_time_window()
+            trip = Trip(source=source, destination=destination, car_provider=members[self.random.randint(len(members))],
+                        status=Trip.WAITING_STATUS, capacity=int(self.random.randint(1, 5)),
+                        is_private=self.random.rand() < self.private_ratio,
+                        people_can_join_automatically=self.random.rand() < 0.5,
+                        start_estimation=start_estimation, end_estimation=end_estimation,
+                        route=self.get_route(source, destination) if self.random.rand() < self.routes_ratio else None)
+            trip.update_time_window()
+            trip.update_route_geometry()
+            trips.append(trip)
+        return Trip.objects.bulk_create(trips, batch_size=self.batch_size)
+
+    def create_trip_groups(self, trips, groups):
+        trip_groups = {(trip.id, groups[self.random.randint(len(groups))].id)
+                       for trip in trips if trip.is_private}
+        TripGroups.objects.bulk_create([TripGroups(trip_id=trip_id, group_id=group_id)
+                                        for trip_id, group_id in trip_groups], batch_size=self.batch_size)
+
+    def create_companionships(self, trips, members):
+        companionships = []
+        for trip in trips:
+            passengers = {members[index] for index in self.random.randint(len(members), size=trip.capacity)
+                          if members[index].id != trip.car_provider_id}
+            trip.seats_taken = int(self.random.randint(0, len(passengers) + 1))
+            for passenger in list(passengers)[:trip.seats_taken]:
+                companionship = Companionship(trip=trip, member=passenger, source=trip.source,
+                                              destination=trip.destination)
+                companionship.update_route_geometry()
+                companionships.append(companionship)
+        Companionship.objects.bulk_create(companionships, batch_size=self.batch_size)
+        Trip.objects.bulk_update(trips, ['seats_taken'], batch_size=self.batch_size)
+
+    def create_trip_requests(self, trips, members):
+        request_sets = TripRequestSet.objects.bulk_create([
+            TripRequestSet(applicant=member, title='Commute') for member in members[:len(members) // 4]
+        ], batch_size=self.batch_size)
+        trip_requests = []
+        for request_set in request_sets:
+            trip = trips[self.random.randint(len(trips))]
+            trip_request = TripRequest(containing_set=request_set, trip=trip, source=self.get_point(),
+                                       destination=self.get_point())
+            trip_request.update_route_geometry()
+            trip_requests.append(trip_request)
+        TripRequest.objects.bulk_create(trip_requests, batch_size=self.batch_size)
+
+    def create_automatic_join_requests(self, members, count=100):
+        requests = []
+        for _ in range(count):
+            start_estimation, end_estimation = self.get_time_window()
+            request = AutomaticJoinRequest(member=members[self.random.randint(len(members))], source=self.get_point(),
+                                           destination=self.get_point(), start_estimation=start_estimation,
+                                           end_estimation=end_estimation)
+            request.update_route_geometry()
+            requests.append(request)
+        AutomaticJoinRequest.objects.bulk_create(requests, batch_size=self.batch_size)
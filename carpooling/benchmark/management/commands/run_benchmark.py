@@ -0,0 +1,24 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from benchmark.runner import BenchmarkRunner
+
+
+class Command(BaseCommand):
+    help = 'Measures trip search and matching on synthetic data of each size and prints the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                            help='Numbers of generated trips')
+        parser.add_argument('--runs', type=int, default=20, help='Runs of each measured case')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Writes the results to this file instead of the standard output')
+
+    def handle(self, *args, **options):
+        results = BenchmarkRunner(options['sizes'], runs=options['runs'], seed=options['seed']).run()
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+        else:
+            self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,145 @@
+import time
+
+import numpy as np
+from django.db import connection
+from django.db.transaction import atomic, set_rollback
+from django.test import RequestFactory
+from django.urls import reverse
+
+from benchmark.generator import SyntheticDataGenerator
+from trip.forms import AutomaticJoinTripForm
+from trip.matching import match_automatic_join_requests, TRIP_SCORE_THRESHOLD
+from trip.models import Trip
+from trip.search_cache import trip_search_cache
+from trip.spatial_index import waiting_trips_index, filter_trips_along_route
+from trip.utils import get_trip_score, get_trips_scores
+from trip.views import SearchTripsManager
+
+
+def measure(function, runs):
+    """
+    Calls function runs times and returns statistics of its durations in milliseconds.
+    """
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        durations.append((time.perf_counter() - start) * 1000)
+    return {
+        'runs': runs,
+        'min_ms': float(np.min(durations)),
+        'median_ms': float(np.median(durations)),
+        'p95_ms': float(np.percentile(durations, 95)),
+        'mean_ms': float(np.mean(durations)),
+    }
+
+
+def measure_each(function, arguments_list):
+    """
+    Calls function once with each of the arguments and returns statistics of its durations.
+    """
+    arguments_iterator = iter(arguments_list)
+    return measure(lambda: function(*next(arguments_iterator)), len(arguments_list))
+
+
+def rolled_back(function):
+    """
+    Runs function in a savepoint which is rolled back, for benchmarks that write.
+    """
+    def wrapper(*args):
+        with atomic():
+            function(*args)
+            set_rollback(True)
+    return wrapper
+
+
+class BenchmarkRunner:
+    """
+    Generates synthetic data of each size and measures the trip search and matching paths on it. Everything runs in
+    a transaction which is rolled back, so the benchmark can run against a local database holding real data.
+    """
+
+    def __init__(self, sizes, runs=20, seed=0):
+        self.sizes = sizes
+        self.runs = runs
+        self.seed = seed
+        self.request_factory = RequestFactory()
+
+    def run(self):
+        return {
+            'database': connection.vendor,
+            'runs': self.runs,
+            'seed': self.seed,
+            'results': [self.run_size(size) for size in self.sizes],
+        }
+
+    def run_size(self, trips_count):
+        with atomic():
+            generator = SyntheticDataGenerator(trips_count, seed=self.seed)
+            start = time.perf_counter()
+            members, trips = generator.generate()
+            generation_seconds = time.perf_counter() - start
+            try:
+                waiting_trips_index.rebuild()
+                index_stats = waiting_trips_index.get_stats()
+                cases = self.run_cases(generator, members, trips)
+            finally:
+                set_rollback(True)
+                waiting_trips_index.reset()
+        return {
+            'trips': trips_count,
+            'members': len(members),
+            'generation_seconds': generation_seconds,
+            'index': index_stats,
+            'cases': cases,
+        }
+
+    def run_cases(self, generator, members, trips):
+        random = np.random.RandomState(self.seed)
+        searches = [(members[random.randint(len(members))], generator.get_point(), generator.get_point(),
+                     *generator.get_time_window()) for _ in range(self.runs)]
+        source, destination = searches[0][1:3]
+        scored_trips = trips[:1000]
+
+        def search(member, source, destination, *_):
+            self.search(member, source, destination)
+
+        def join(member, source, destination, start_estimation, end_estimation):
+            form = AutomaticJoinTripForm(user=member, trip_score_threshold=TRIP_SCORE_THRESHOLD, data={
+                'source_lat': source.x, 'source_lng': source.y,
+                'destination_lat': destination.x, 'destination_lng': destination.y,
+                'start_estimation': start_estimation, 'end_estimation': end_estimation})
+            form.is_valid()
+            form.join_a_trip_automatically()
+
+        def get_accessible_trips(member, *_):
+            Trip.get_accessible_trips_for(member).filter(status=Trip.WAITING_STATUS).count()
+
+        cases = {
+            'get_trip_score': measure(lambda: get_trip_score(trips[0], source, destination), self.runs),
+            'get_trips_scores_1000': measure(lambda: get_trips_scores(scored_trips, source, destination), self.runs),
+            'filter_trips_along_route': measure(
+                lambda: list(filter_trips_along_route(Trip.objects.all(), source, destination)), self.runs),
+        }
+        trip_search_cache.enabled = False
+        try:
+            cases['search'] = measure_each(search, searches)
+        finally:
+            trip_search_cache.enabled = True
+        trip_search_cache.cache.clear()
+        for arguments in searches:
+            search(*arguments)
+        cases['search_cached'] = measure_each(search, searches)
+        cases['join_a_trip_automatically'] = measure_each(rolled_back(join), searches)
+        cases['get_accessible_trips_for'] = measure_each(get_accessible_trips, searches)
+        cases['match_automatic_join_requests'] = measure(rolled_back(match_automatic_join_requests), 1)
+        return cases
+
+    def search(self, member, source, destination):
+        request = self.request_factory.get(reverse('trip:search_trips'), {
+            'source_lat': source.x, 'source_lng': source.y,
+            'destination_lat': destination.x, 'destination_lng': destination.y,
+            'start_time': '-1', 'end_time': '-1',
+        })
+        request.user = member
+        return SearchTripsManager.do_search(request)
@@ -0,0 +1,25 @@
+from django.test import TestCase
+
+from benchmark.generator import SyntheticDataGenerator
+from benchmark.runner import BenchmarkRunner
+from trip.models import Trip, Companionship, TripAccessibility
+
+
+class SyntheticDataGeneratorTest(TestCase):
+    def test_generate(self):
+        members, trips = SyntheticDataGenerator(50).generate()
+        self.assertEqual(50, Trip.objects.count())
+        self.assertEqual(25, len(members))
+        trip = Trip.objects.get(id=trips[0].id)
+        self.assertIsNotNone(trip.time_window)
+        self.assertIsNotNone(trip.heading)
+        self.assertEqual(Companionship.objects.filter(trip=trip).count(), trip.seats_taken)
+        self.assertTrue(TripAccessibility.objects.filter(trip=trip, member_id=trip.car_provider_id).exists())
+
+
+class BenchmarkRunnerTest(TestCase):
+    def test_run(self):
+        results = BenchmarkRunner([30], runs=2).run()
+        self.assertEqual(30, results['results'][0]['trips'])
+        self.assertEqual(2, results['results'][0]['cases']['search']['runs'])
+        self.assertFalse(Trip.objects.exists())
@@ -15,7 +15,6 @@ import os
 import django.contrib.staticfiles.finders
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 from django.urls import reverse_lazy
-from elasticsearch import Elasticsearch
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 LOGIN_REDIRECT_URL = '/'
@@ -37,10 +36,13 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.gis',
+    'django.contrib.postgres',
     'root.apps.RootConfig',
     'account.apps.AccountConfig',
     'group.apps.GroupConfig',
     'trip.apps.TripConfig',
+    'benchmark.apps.BenchmarkConfig',
+    'search.apps.SearchConfig',
     'semanticuiforms',
 ]
 
@@ -162,6 +164,96 @@ USER_TZ = True
 
 DISTANCE_THRESHOLD = 100
 
+# Trips whose source and destination are farther than this (in degrees) from the searched ones are not scored
+TRIP_SEARCH_RADIUS = 0.5
+# Trips with a route also match when both searched points are closer than this (in degrees) to the route, in order
+TRIP_ROUTE_BUFFER = 0.01
+
+# Trips are scored in meters on a local projection centered on SCORING_ORIGIN (lat, lng) when TRIP_SCORE_IN_METERS is
+# set, and in raw degrees otherwise. The projected points of routes are stored for this origin: after changing it, run
+# the backfill_route_geometry command, which detects the stale projections and recomputes them
+TRIP_SCORE_IN_METERS = True
+SCORING_ORIGIN = (35.7, 51.4)
+TRIP_SCORE_THRESHOLD_METERS = 5000
+TRIP_SCORE_THRESHOLD_DEGREES = 0.05
+
+# Process-local grid index of waiting trips used to find search and automatic join candidates
+TRIP_SPATIAL_INDEX_ENABLED = True
+TRIP_INDEX_CELL_SIZE = 0.1
+TRIP_INDEX_MAX_AGE = 60  # Seconds before the index is rebuilt to catch changes made by other workers
+
+# Ranked trip search results are cached by the cells (in degrees) of the searched points and the buckets (in seconds)
+# of the searched time window
+TRIP_SEARCH_CACHE_ENABLED = True
+TRIP_SEARCH_CACHE = 'trip_search'
+TRIP_SEARCH_CACHE_CELL_SIZE = 0.005
+# Saving a trip invalidates the cached searches around the version cells (in degrees) its end points and route cross
+TRIP_SEARCH_CACHE_VERSION_CELL_SIZE = 0.1
+TRIP_SEARCH_CACHE_TIME_BUCKET = 15 * 60
+
+# Groups of a user near a trip, shared by all workers when NEARBY_GROUPS_CACHE_BACKEND points to a shared cache server
+NEARBY_GROUPS_CACHE = 'nearby_groups'
+NEARBY_GROUPS_CACHE_BACKEND = os.environ.get('NEARBY_GROUPS_CACHE_BACKEND',
+                                             'django.core.cache.backends.locmem.LocMemCache')
+NEARBY_GROUPS_CACHE_LOCATION = os.environ.get('NEARBY_GROUPS_CACHE_LOCATION', 'nearby-groups')
+NEARBY_GROUPS_CACHE_TIMEOUT = int(os.environ.get('NEARBY_GROUPS_CACHE_TIMEOUT', 5 * 60))
+NEARBY_GROUPS_CACHE_MAX_ENTRIES = int(os.environ.get('NEARBY_GROUPS_CACHE_MAX_ENTRIES', 10000))
+
+# People autocomplete answers from the completion suggester of Elasticsearch within PEOPLE_AUTOCOMPLETE_TIMEOUT
+# seconds, or from a process-local prefix trie of members rebuilt every PEOPLE_AUTOCOMPLETE_TRIE_MAX_AGE seconds.
+# Its circuit breaker is separate from the one of searches and counts suggestions slower than the timeout as failures.
+# Responses are cached for PEOPLE_AUTOCOMPLETE_CACHE_TIMEOUT seconds.
+PEOPLE_AUTOCOMPLETE_CACHE = 'people_autocomplete'
+PEOPLE_AUTOCOMPLETE_CACHE_TIMEOUT = 30
+PEOPLE_AUTOCOMPLETE_TIMEOUT = 0.2
+PEOPLE_AUTOCOMPLETE_TRIE_MAX_AGE = 5 * 60
+PEOPLE_AUTOCOMPLETE_SIZE = 8
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    TRIP_SEARCH_CACHE: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'trip-search',
+        'TIMEOUT': 60,  # Bounds the staleness caused by trips changed in other worker processes
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    NEARBY_GROUPS_CACHE: {
+        'BACKEND': NEARBY_GROUPS_CACHE_BACKEND,
+        'LOCATION': NEARBY_GROUPS_CACHE_LOCATION,
+        'TIMEOUT': NEARBY_GROUPS_CACHE_TIMEOUT,
+        'OPTIONS': {
+            'MAX_ENTRIES': NEARBY_GROUPS_CACHE_MAX_ENTRIES,
+        },
+    },
+    PEOPLE_AUTOCOMPLETE_CACHE: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'people-autocomplete',
+        'TIMEOUT': PEOPLE_AUTOCOMPLETE_CACHE_TIMEOUT,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+# When enabled, automatic join requests are queued and assigned to trips together by a worker job that runs
+# AUTOMATIC_JOIN_BATCH_WINDOW seconds after a request is queued, instead of greedily joining the best trip right away
+AUTOMATIC_JOIN_BATCH_ENABLED = False
+AUTOMATIC_JOIN_BATCH_WINDOW = 30
+
+# Changed search documents are queued and sent to Elasticsearch in bulk requests of SEARCH_INDEX_BATCH_SIZE documents
+# by a worker job running SEARCH_INDEX_FLUSH_INTERVAL seconds after the first change. Failed documents are retried
+# after SEARCH_INDEX_RETRY_DELAY seconds, doubled on every attempt, and kept as dead letters after
+# SEARCH_INDEX_MAX_ATTEMPTS attempts
+SEARCH_INDEX_BATCH_SIZE = 500
+SEARCH_INDEX_FLUSH_INTERVAL = 5
+SEARCH_INDEX_MAX_ATTEMPTS = 8
+SEARCH_INDEX_RETRY_DELAY = 10
+SEARCH_INDEX_MAX_RETRY_DELAY = 60 * 60
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -271,4 +363,16 @@ LOGGING = {
     }
 }
 
-ELASTIC_SEARCH = Elasticsearch([{'host': 'elasticsearch', 'port': 9200}])
+# The Elasticsearch client is created by search.client on first use, so processes start without waiting for
+# Elasticsearch. Searches give up after ELASTIC_SEARCH_TIMEOUT seconds, and each process keeps up to
+# ELASTIC_SEARCH_POOL_SIZE connections open to each host.
+ELASTIC_SEARCH_HOSTS = os.environ.get('ELASTIC_SEARCH_HOSTS', 'elasticsearch:9200').split(',')
+ELASTIC_SEARCH_TIMEOUT = 2
+ELASTIC_SEARCH_MAX_RETRIES = 1
+ELASTIC_SEARCH_POOL_SIZE = 10
+
+# Searches go to PostgreSQL for SEARCH_CIRCUIT_RESET_TIMEOUT seconds after SEARCH_CIRCUIT_FAILURE_THRESHOLD
+# consecutive Elasticsearch searches failed or took longer than SEARCH_SLOW_QUERY_THRESHOLD seconds
+SEARCH_CIRCUIT_FAILURE_THRESHOLD = 5
+SEARCH_CIRCUIT_RESET_TIMEOUT = 30
+SEARCH_SLOW_QUERY_THRESHOLD = 1
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.2 on 2026-10-18 18:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('group', '0004_auto_20190731_0803'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX group_group_source_geography_idx ON group_group '
+            'USING GIST ((ST_FlipCoordinates(source)::geography));',
+            'DROP INDEX group_group_source_geography_idx;',
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.2 on 2026-10-18 19:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0015_member_trigram_indexes'),
+        ('group', '0005_group_source_geography_index'),
+    ]
+
+    # The expressions match the UPPER(...) LIKE UPPER(...) queries of icontains lookups
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX group_group_title_trgm_idx ON group_group USING GIN ((UPPER(title::text)) gin_trgm_ops);'
+            'CREATE INDEX group_group_code_trgm_idx ON group_group USING GIN ((UPPER(code::text)) gin_trgm_ops);'
+            'CREATE INDEX group_group_description_trgm_idx ON group_group '
+            'USING GIN ((UPPER(description::text)) gin_trgm_ops);',
+            'DROP INDEX group_group_title_trgm_idx;'
+            'DROP INDEX group_group_code_trgm_idx;'
+            'DROP INDEX group_group_description_trgm_idx;',
+        ),
+    ]
@@ -1,5 +1,8 @@
 from django.db import models
 from django.contrib.gis.db import models as gis_models
+from django.contrib.gis.geos import Point
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
 
 from account.models import Member
 
@@ -12,6 +15,20 @@ class Group(models.Model):
     members = models.ManyToManyField(Member, through='Membership')
     source = gis_models.PointField(null=True)
 
+    # Points are stored as (lat, lng), so they are flipped to (lng, lat) before being cast to geography. The
+    # expression matches the GiST index of group.0005_group_source_geography_index.
+    SOURCE_WITHIN_SQL = 'ST_DWithin(ST_FlipCoordinates("group_group"."source")::geography, %s::geography, %s)'
+
+    @classmethod
+    def filter_near(cls, groups_query_set, points, distance):
+        """
+        Keeps the groups without a source or whose source is within distance meters of one of the points.
+        """
+        near_groups = RawSQL('SELECT "group_group"."id" FROM "group_group" WHERE {}'.format(
+            ' OR '.join([cls.SOURCE_WITHIN_SQL] * len(points))),
+            [param for point in points for param in (Point(point.y, point.x, srid=4326).ewkt, distance)])
+        return groups_query_set.filter(Q(source__isnull=True) | Q(id__in=near_groups))
+
 
 class Membership(models.Model):
     OWNER = 'ow'
@@ -1,4 +1,5 @@
 import json
+from unittest.mock import patch
 
 from django.test import TestCase, Client
 
@@ -8,6 +9,8 @@ from model_mommy import mommy
 from account.models import Member
 from group.forms import GroupForm
 from group.models import Group, Membership
+from group.utils import get_visible_groups
+from search.circuit_breaker import elasticsearch_circuit_breaker
 
 
 class GroupViewTest(TestCase):
@@ -207,6 +210,32 @@ class AddMemberToGroupTest(TestCase):
         member = mommy.make(Member, _fill_optional=['email'])
         return member, group
 
+
+class GroupSearchHydrationTest(TestCase):
+    def setUp(self):
+        elasticsearch_circuit_breaker.record_success()
+        self.user = Member.objects.create_user(username='test_user', password='1234')
+        self.public_group = mommy.make(Group, is_private=False, description='')
+        self.joined_group = mommy.make(Group, is_private=True, description='')
+        self.private_group = mommy.make(Group, is_private=True, description='')
+        mommy.make(Membership, member=self.user, group=self.joined_group, role='me')
+
+    def test_get_visible_groups_keeps_order_in_two_queries(self):
+        group_ids = [self.private_group.id, self.joined_group.id, 0, self.public_group.id]
+        with self.assertNumQueries(2):
+            groups = get_visible_groups(group_ids, self.user)
+        self.assertEqual([self.joined_group, self.public_group], groups)
+
+    @patch('search.backends.search_query.group_search_with_out_map')
+    def test_search_group_view(self, group_search):
+        group_search.return_value = {'hits': {'hits': [
+            {'_id': str(group.id)} for group in [self.public_group, self.private_group, self.joined_group]]}}
+        self.client.login(username='test_user', password='1234')
+        response = self.client.get(reverse('group:group_search', kwargs={'query': 'bazaar'}))
+        titles = [group['title'] for group in json.loads(response.content)['groups']]
+        self.assertEqual([self.public_group.title, self.joined_group.title], titles)
+        group_search.assert_called_once_with('bazaar', self.user.id)
+
 # TODO: need to create users in elasticsearch database
 
 # class SearchGroupsTest(TestCase):
@@ -13,6 +13,19 @@ def get_group_membership(user, group_id):
     return group, membership
 
 
+def get_visible_groups(group_ids, user):
+    """
+    Returns the groups of group_ids in the same order, leaving out the missing ones and the private ones which user
+    is not a member of, in two queries.
+    """
+    groups = Group.objects.in_bulk(group_ids)
+    private_group_ids = [group.id for group in groups.values() if group.is_private]
+    joined_group_ids = set(Membership.objects.filter(member=user, group_id__in=private_group_ids).values_list(
+        'group_id', flat=True)) if private_group_ids else set()
+    return [groups[group_id] for group_id in group_ids
+            if group_id in groups and (not groups[group_id].is_private or group_id in joined_group_ids)]
+
+
 def manage_group_authorization(membership):
     is_owner = False
     has_joined = False
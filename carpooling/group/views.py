@@ -9,11 +9,13 @@ from django.utils.decorators import method_decorator
 from django.views.generic.base import View
 from math import radians, sin, cos, sqrt, atan2
 
-from search import queries as search_query, index as INDEX
+from search import index as INDEX
+from search.backends import search_backend
 from account.models import Member
 from group.forms import GroupForm
 from group.models import Group, Membership
-from group.utils import get_group_membership, add_to_group, join_group, manage_group_authorization
+from group.utils import get_group_membership, add_to_group, join_group, manage_group_authorization, \
+    get_visible_groups
 from root.decorators import only_get_allowed, check_request_type
 
 log = logging.getLogger(__name__)
@@ -55,24 +57,7 @@ class CreateGroupManager(View):
 
     @staticmethod
     def index_goup(group, request):
-        if 'source_lat' in request.POST:
-            data_map = {
-                "pin": {
-                    "location": {
-                        'lat': request.POST['source_lat'],
-                        'lon': request.POST['source_lon']
-                    }
-                },
-            }
-            INDEX.index_group_map(data_map, group.id, schedule=1)
-
-        data = {
-            "id": group.id,
-            "code": group.code,
-            "title": group.title,
-            "description": group.description
-        }
-        INDEX.index_group(data, schedule=1)
+        INDEX.index_group_documents(group)
         log.info("group:{} was added to elastic search".format(request.user.id, group.id))
 
 
@@ -167,12 +152,8 @@ class SearchGroupManager:
     @method_decorator(login_required)
     def search_group_view(cls, request, query):
         log.info("user {} searched for groups with containing:{}".format(request.user.id, query))
-        result = {'groups': []}
-        for group in search_query.group_search_with_out_map(query)['hits']['hits']:
-
-            instance = get_object_or_404(Group, id=group["_source"]["id"])
-            if not instance.is_private or Membership.objects.filter(member=request.user, group_id=instance.id).exists():
-                result['groups'].append(SearchGroupManager.get_group_json(instance))
+        groups = get_visible_groups(search_backend.search_groups(query, request.user), request.user)
+        result = {'groups': [SearchGroupManager.get_group_json(group) for group in groups]}
         return HttpResponse(json.dumps(result))
 
     @staticmethod
@@ -189,9 +170,6 @@ def sort(request):
         "lon": float(request.GET['source_lon'])
     }
     log.info("user {} searched near by groups to lat:{} lon:{}".format(request.user.id, data["lat"], data["lon"]))
-    group_list = []
-    for group in search_query.group_search_with_map(data)['hits']['hits']:
-        instance = get_object_or_404(Group, id=group['_id'])
-        if not instance.is_private or Membership.objects.filter(member=request.user, group=instance).exists():
-            group_list.append(instance)
+    group_ids = search_backend.search_nearby_groups(data["lat"], data["lon"], request.user)
+    group_list = get_visible_groups(group_ids, request.user)
     return render(request, "sorted_group_list.html", {"group_list": group_list})
@@ -0,0 +1,68 @@
+import time
+
+from django.core.cache import caches
+
+
+class CacheStats:
+    """
+    Hit and miss counters of a cache, kept in the cache itself so that every user of the cache adds up to the same
+    counters. Every created instance is reported by get_all_cache_stats.
+    """
+    instances = []
+
+    def __init__(self, name, cache_alias):
+        self.name = name
+        self.cache_alias = cache_alias
+        self.hits_key, self.misses_key = '{}:stats:hits'.format(name), '{}:stats:misses'.format(name)
+        CacheStats.instances.append(self)
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def hit(self):
+        increment(self.cache, self.hits_key)
+
+    def miss(self):
+        increment(self.cache, self.misses_key)
+
+    def reset(self):
+        self.cache.delete_many([self.hits_key, self.misses_key])
+
+    def get(self):
+        counters = self.cache.get_many([self.hits_key, self.misses_key])
+        hits, misses = counters.get(self.hits_key, 0), counters.get(self.misses_key, 0)
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else None,
+        }
+
+
+def get_all_cache_stats():
+    return {stats.name: stats.get() for stats in CacheStats.instances}
+
+
+def increment(cache, key, initial_value=1):
+    if not cache.add(key, initial_value, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, initial_value, timeout=None)
+
+
+def get_versions(cache, keys):
+    """
+    Returns the versions stored under keys, 0 for missing ones.
+    """
+    versions = cache.get_many(keys)
+    return [versions.get(key, 0) for key in keys]
+
+
+def increment_versions(cache, keys):
+    """
+    Invalidates the entries built on the versions stored under keys. Missing versions start from the current time so
+    that a version evicted from the cache can not start over and match the entries built on its former values.
+    """
+    for key in keys:
+        increment(cache, key, initial_value=int(time.time() * 1000))
@@ -1,8 +1,11 @@
 from django.urls import path
-from .views import HomeManager, SearchPeopleManager
+from .views import HomeManager, SearchPeopleManager, CacheStatsManager
 
 app_name = "root"
 urlpatterns = [
     path("", HomeManager.as_view(), name='home'),
+    path("search/people/autocomplete/<prefix>", SearchPeopleManager.autocomplete_people_view,
+         name='autocomplete_people'),
     path("search/people/<query>", SearchPeopleManager.search_people_view, name='search_people'),
+    path("cache/stats", CacheStatsManager.as_view(), name='cache_stats'),
 ]
@@ -1,12 +1,14 @@
 import json
 
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponseNotAllowed, HttpResponse
+from django.http import HttpResponseNotAllowed, HttpResponse, HttpResponseForbidden
 from django.shortcuts import render
 from django.urls import reverse
 from django.views.generic.base import View
-from search import queries as search_query
 from account.models import Mail
+from root.cache import get_all_cache_stats
+from search.autocomplete import people_autocomplete
+from search.backends import search_backend
 
 
 class HomeManager(View):
@@ -27,12 +29,26 @@ class SearchPeopleManager:
     @staticmethod
     @login_required
     def search_people_view(request, query):
-        result = {'people': []}
-        for member in search_query.profile_username_name_search(data=query)["hits"]["hits"]:
-            result['people'].append(SearchPeopleManager.get_member_json(member["_source"]))
+        people = search_backend.search_people(query)
+        result = {'people': [SearchPeopleManager.get_member_json(member) for member in people]}
+        return HttpResponse(json.dumps(result))
+
+    @staticmethod
+    @login_required
+    def autocomplete_people_view(request, prefix):
+        people = people_autocomplete.suggest(prefix)
+        result = {'people': [SearchPeopleManager.get_member_json(member) for member in people]}
         return HttpResponse(json.dumps(result))
 
     @staticmethod
     def get_member_json(member):
         return {'description': member["first_name"] + ' ' + member["last_name"], 'user_name': member["username"], 'url':
             reverse('account:user_profile', kwargs={'user_id': member["id"]})}
+
+
+class CacheStatsManager(View):
+    @staticmethod
+    def get(request):
+        if not request.user.is_staff:
+            return HttpResponseForbidden()
+        return HttpResponse(json.dumps(get_all_cache_stats()), content_type='application/json')
@@ -0,0 +1,147 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from django.core.cache import caches
+
+from account.models import Member
+from carpooling.settings.base import PEOPLE_AUTOCOMPLETE_CACHE, PEOPLE_AUTOCOMPLETE_TIMEOUT, \
+    PEOPLE_AUTOCOMPLETE_TRIE_MAX_AGE, PEOPLE_AUTOCOMPLETE_SIZE
+from root.cache import CacheStats
+from search import queries as search_query
+from search.circuit_breaker import CircuitBreaker
+from search.index import get_profile_suggestions
+
+log = logging.getLogger(__name__)
+
+people_autocomplete_cache_stats = CacheStats('people_autocomplete', PEOPLE_AUTOCOMPLETE_CACHE)
+
+
+class PrefixTrie:
+    """
+    Maps lowercased keys to values, and finds the values of the keys starting with a prefix, shortest keys first.
+    """
+
+    def __init__(self):
+        self.root = {}
+
+    def insert(self, key, value):
+        node = self.root
+        for character in key.lower():
+            node = node.setdefault(character, {})
+        node.setdefault(None, []).append(value)
+
+    def find(self, prefix, limit):
+        node = self.root
+        for character in prefix.lower():
+            node = node.get(character)
+            if node is None:
+                return []
+        values = []
+        nodes = deque([node])
+        while nodes and len(values) < limit:
+            node = nodes.popleft()
+            for character, child in node.items():
+                if character is None:
+                    values.extend(child)
+                else:
+                    nodes.append(child)
+        return values
+
+
+class PeopleTrie:
+    """
+    Process-local prefix trie of the usernames and names of all members, used when Elasticsearch does not answer. It
+    is built on first use and rebuilt from the database when it gets older than max_age. Only one thread builds it,
+    the others wait for the first build and then keep reading the former trie while it is rebuilt.
+    """
+
+    def __init__(self, max_age=PEOPLE_AUTOCOMPLETE_TRIE_MAX_AGE):
+        self.max_age = max_age
+        self.built_at = None
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self._trie = PrefixTrie()
+        self._people = {}
+
+    def rebuild(self):
+        with self._rebuild_lock:
+            self._rebuild()
+
+    def refresh(self):
+        if not self._rebuild_lock.acquire(blocking=self.built_at is None):
+            return
+        try:
+            if self.is_stale():
+                self._rebuild()
+        finally:
+            self._rebuild_lock.release()
+
+    def _rebuild(self):
+        trie, people = PrefixTrie(), {}
+        for member in Member.objects.only('id', 'username', 'first_name', 'last_name').iterator():
+            people[member.id] = get_person_json(member.id, member.username, member.first_name, member.last_name)
+            for text in get_profile_suggestions(member):
+                trie.insert(text, member.id)
+        with self._lock:
+            self._trie, self._people = trie, people
+            self.built_at = time.monotonic()
+        log.info("People trie rebuilt with {} members".format(len(people)))
+
+    def is_stale(self):
+        return self.built_at is None or time.monotonic() - self.built_at > self.max_age
+
+    def suggest(self, prefix, size):
+        self.refresh()
+        with self._lock:
+            member_ids = self._trie.find(prefix, size * 4)
+            return [self._people[member_id] for member_id in dict.fromkeys(member_ids)][:size]
+
+
+class PeopleAutocomplete:
+    """
+    Completes a prefix to people, from the completion suggester of Elasticsearch or from the people trie when
+    Elasticsearch fails or takes longer than timeout. Responses are cached for a short time by lowercased prefix.
+    Suggestions have their own circuit breaker, so that their tight timeout does not send full searches to the
+    database.
+    """
+
+    def __init__(self, cache_alias=PEOPLE_AUTOCOMPLETE_CACHE, timeout=PEOPLE_AUTOCOMPLETE_TIMEOUT,
+                 size=PEOPLE_AUTOCOMPLETE_SIZE):
+        self.cache_alias = cache_alias
+        self.timeout = timeout
+        self.size = size
+        self.trie = PeopleTrie()
+        self.circuit_breaker = CircuitBreaker('Elasticsearch autocomplete', slow_call_threshold=timeout)
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def suggest(self, prefix):
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        key = 'people_autocomplete:{}'.format(prefix)
+        people = self.cache.get(key)
+        if people is None:
+            people_autocomplete_cache_stats.miss()
+            people = self.circuit_breaker.call(lambda: self.suggest_from_index(prefix),
+                                               lambda: self.trie.suggest(prefix, self.size))
+            self.cache.set(key, people)
+        else:
+            people_autocomplete_cache_stats.hit()
+        return people
+
+    def suggest_from_index(self, prefix):
+        result = search_query.profile_suggest(prefix, self.size, self.timeout)
+        return [get_person_json(option['_id'], option['_source']['username'], option['_source']['first_name'],
+                                option['_source']['last_name']) for option in result['suggest']['people'][0]['options']]
+
+
+def get_person_json(member_id, username, first_name, last_name):
+    return {'id': int(member_id), 'username': username, 'first_name': first_name, 'last_name': last_name}
+
+
+people_autocomplete = PeopleAutocomplete()
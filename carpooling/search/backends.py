@@ -0,0 +1,107 @@
+from abc import ABC, abstractmethod
+
+from django.contrib.gis.geos import Point
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db.models import Q
+from django.db.models.functions import Greatest
+
+from account.models import Member
+from group.models import Group, Membership
+from search import queries as search_query
+from search.circuit_breaker import elasticsearch_circuit_breaker
+
+PEOPLE_SEARCH_SIZE = 10
+GROUPS_SEARCH_SIZE = 20
+
+
+class SearchBackend(ABC):
+    """
+    People are found as dicts of their id, username, first name and last name, and groups as their ids, best
+    matches first. Groups are only left out by privacy when the backend knows it; the caller filters them anyway.
+    """
+
+    @abstractmethod
+    def search_people(self, query, size=PEOPLE_SEARCH_SIZE):
+        pass
+
+    @abstractmethod
+    def search_groups(self, query, user, size=GROUPS_SEARCH_SIZE):
+        pass
+
+    @abstractmethod
+    def search_nearby_groups(self, lat, lon, user, size=GROUPS_SEARCH_SIZE):
+        pass
+
+
+class ElasticsearchBackend(SearchBackend):
+    def search_people(self, query, size=PEOPLE_SEARCH_SIZE):
+        return [hit['_source'] for hit in search_query.profile_username_name_search(query)['hits']['hits']][:size]
+
+    def search_groups(self, query, user, size=GROUPS_SEARCH_SIZE):
+        hits = search_query.group_search_with_out_map(query, user.id)['hits']['hits']
+        return [int(hit['_id']) for hit in hits][:size]
+
+    def search_nearby_groups(self, lat, lon, user, size=GROUPS_SEARCH_SIZE):
+        hits = search_query.group_search_with_map({'lat': lat, 'lon': lon}, user.id)['hits']['hits']
+        return [int(hit['_id']) for hit in hits][:size]
+
+
+class PostgresBackend(SearchBackend):
+    """
+    Searches the database with icontains lookups, which use the pg_trgm GIN indexes of account and group, ranked by
+    trigram similarity.
+    """
+
+    def search_people(self, query, size=PEOPLE_SEARCH_SIZE):
+        people = Member.objects.filter(
+            Q(username__icontains=query) | Q(first_name__icontains=query) | Q(last_name__icontains=query))
+        people = self.order_by_similarity(people, query, ['username', 'first_name', 'last_name'])
+        return list(people.values('id', 'username', 'first_name', 'last_name')[:size])
+
+    def search_groups(self, query, user, size=GROUPS_SEARCH_SIZE):
+        groups = self.get_visible_groups(user).filter(
+            Q(title__icontains=query) | Q(code__icontains=query) | Q(description__icontains=query))
+        groups = self.order_by_similarity(groups, query, ['title', 'code', 'description'])
+        return list(groups.values_list('id', flat=True)[:size])
+
+    def search_nearby_groups(self, lat, lon, user, size=GROUPS_SEARCH_SIZE):
+        groups = Group.filter_near(self.get_visible_groups(user).filter(source__isnull=False), [Point(lat, lon)],
+                                   search_query.NEARBY_GROUPS_DISTANCE * 1000)
+        return list(groups.order_by('id').values_list('id', flat=True)[:size])
+
+    @staticmethod
+    def get_visible_groups(user):
+        return Group.objects.filter(
+            Q(is_private=False) | Q(id__in=Membership.objects.filter(member=user).values('group_id')))
+
+    @staticmethod
+    def order_by_similarity(query_set, query, fields):
+        similarity = Greatest(*[TrigramSimilarity(field, query) for field in fields])
+        return query_set.annotate(similarity=similarity).order_by('-similarity', 'id')
+
+
+class RoutedSearchBackend(SearchBackend):
+    """
+    Sends searches to the primary backend, and to the fallback one when the primary one fails or while the circuit
+    breaker keeps it out after failing or slow searches.
+    """
+
+    def __init__(self, primary, fallback, circuit_breaker):
+        self.primary = primary
+        self.fallback = fallback
+        self.circuit_breaker = circuit_breaker
+
+    def search_people(self, query, size=PEOPLE_SEARCH_SIZE):
+        return self.circuit_breaker.call(lambda: self.primary.search_people(query, size),
+                                         lambda: self.fallback.search_people(query, size))
+
+    def search_groups(self, query, user, size=GROUPS_SEARCH_SIZE):
+        return self.circuit_breaker.call(lambda: self.primary.search_groups(query, user, size),
+                                         lambda: self.fallback.search_groups(query, user, size))
+
+    def search_nearby_groups(self, lat, lon, user, size=GROUPS_SEARCH_SIZE):
+        return self.circuit_breaker.call(lambda: self.primary.search_nearby_groups(lat, lon, user, size),
+                                         lambda: self.fallback.search_nearby_groups(lat, lon, user, size))
+
+
+search_backend = RoutedSearchBackend(ElasticsearchBackend(), PostgresBackend(), elasticsearch_circuit_breaker)
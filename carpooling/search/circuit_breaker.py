@@ -0,0 +1,73 @@
+import logging
+import threading
+import time
+
+from carpooling.settings.base import SEARCH_CIRCUIT_FAILURE_THRESHOLD, SEARCH_CIRCUIT_RESET_TIMEOUT, \
+    SEARCH_SLOW_QUERY_THRESHOLD
+
+log = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Process-local circuit breaker of a dependency. After failure_threshold consecutive calls failed or took longer
+    than slow_call_threshold seconds, the circuit opens and calls go straight to their fallback for reset_timeout
+    seconds. Then one call is let through: the circuit closes if it succeeds and opens again otherwise.
+    """
+
+    def __init__(self, name, failure_threshold=SEARCH_CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout=SEARCH_CIRCUIT_RESET_TIMEOUT, slow_call_threshold=SEARCH_SLOW_QUERY_THRESHOLD):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_call_threshold = slow_call_threshold
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def call(self, function, fallback):
+        if not self.allow_call():
+            return fallback()
+        start = time.monotonic()
+        try:
+            result = function()
+        except Exception as e:
+            log.warning("{} call failed: {!r}".format(self.name, e))
+            self.record_failure()
+            return fallback()
+        if time.monotonic() - start > self.slow_call_threshold:
+            self.record_failure()
+        else:
+            self.record_success()
+        return result
+
+    def allow_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            # Half open: later calls wait for this one to close or open the circuit again
+            self.opened_at = time.monotonic()
+            return True
+
+    def is_open(self):
+        return self.opened_at is not None
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                log.info("{} circuit closed".format(self.name))
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    log.error("{} circuit opened after {} failures".format(self.name, self.failures))
+                self.opened_at = time.monotonic()
+
+
+elasticsearch_circuit_breaker = CircuitBreaker('Elasticsearch')
@@ -0,0 +1,16 @@
+from functools import lru_cache
+
+from elasticsearch import Elasticsearch
+
+from carpooling.settings.base import ELASTIC_SEARCH_HOSTS, ELASTIC_SEARCH_TIMEOUT, ELASTIC_SEARCH_MAX_RETRIES, \
+    ELASTIC_SEARCH_POOL_SIZE
+
+
+@lru_cache(maxsize=None)
+def get_client():
+    """
+    The Elasticsearch client of the process, created on first use. Creating it does not connect, and it is not
+    created before gunicorn forks its workers, so the workers do not share its connections.
+    """
+    return Elasticsearch(ELASTIC_SEARCH_HOSTS, timeout=ELASTIC_SEARCH_TIMEOUT, max_retries=ELASTIC_SEARCH_MAX_RETRIES,
+                         retry_on_timeout=False, maxsize=ELASTIC_SEARCH_POOL_SIZE)
@@ -1,41 +1,311 @@
-from background_task import background
-from django.conf import settings
-Elastic_search = getattr(settings, "ELASTIC_SEARCH", None)
+from django.utils import timezone
+from elasticsearch.helpers import bulk, scan
 
+from search.client import get_client
+from search.models import PendingDocument
+from search.pipeline import enqueue
 
-mappings = {
-    "mappings": {
-        "properties": {
-            "pin": {
-                "properties": {
-                    "location": {
-                        "type": "geo_point"
+PROFILE_INDEX = 'prof'
+GROUP_INDEX = 'group'
+GROUP_MAP_INDEX = 'group_map'
+TRIP_INDEX = 'trip'
 
+# Text fields are indexed whole, by edge n-grams for prefix matching and by trigrams for matching any part of them,
+# so searches are plain term lookups instead of wildcard scans of the term dictionary
+analysis = {
+    "analyzer": {
+        "prefix": {
+            "tokenizer": "prefix",
+            "filter": ["lowercase", "asciifolding"]
+        },
+        "prefix_search": {
+            "tokenizer": "standard",
+            "filter": ["lowercase", "asciifolding"]
+        },
+        "trigram": {
+            "tokenizer": "trigram",
+            "filter": ["lowercase", "asciifolding"]
+        },
+    },
+    "tokenizer": {
+        "prefix": {
+            "type": "edge_ngram",
+            "min_gram": 1,
+            "max_gram": 20,
+            "token_chars": ["letter", "digit"]
+        },
+        "trigram": {
+            "type": "ngram",
+            "min_gram": 3,
+            "max_gram": 3,
+            "token_chars": ["letter", "digit"]
+        },
+    },
+}
+
+searchable_text = {
+    "type": "text",
+    "fields": {
+        "prefix": {
+            "type": "text",
+            "analyzer": "prefix",
+            "search_analyzer": "prefix_search"
+        },
+        "trigram": {
+            "type": "text",
+            "analyzer": "trigram"
+        },
+    }
+}
+
+index_templates = {
+    PROFILE_INDEX: {
+        "index_patterns": [PROFILE_INDEX, PROFILE_INDEX + "-*"],
+        "settings": {"analysis": analysis},
+        "mappings": {
+            "properties": {
+                "id": {"type": "integer"},
+                "username": searchable_text,
+                "first_name": searchable_text,
+                "last_name": searchable_text,
+                "suggest": {
+                    "type": "completion",
+                    "analyzer": "prefix_search"
+                },
+            }
+        }
+    },
+    GROUP_INDEX: {
+        "index_patterns": [GROUP_INDEX, GROUP_INDEX + "-*"],
+        "settings": {"analysis": analysis},
+        "mappings": {
+            "properties": {
+                "id": {"type": "integer"},
+                "code": searchable_text,
+                "title": searchable_text,
+                "description": searchable_text,
+                "is_private": {"type": "boolean"},
+                "member_ids": {"type": "integer"},
+            }
+        }
+    },
+    GROUP_MAP_INDEX: {
+        "index_patterns": [GROUP_MAP_INDEX, GROUP_MAP_INDEX + "-*"],
+        "mappings": {
+            "properties": {
+                "id": {"type": "integer"},
+                "is_private": {"type": "boolean"},
+                "member_ids": {"type": "integer"},
+                "pin": {
+                    "properties": {
+                        "location": {
+                            "type": "geo_point"
+                        }
                     }
-                }
-            },
+                },
+            }
         }
-    }
+    },
+    TRIP_INDEX: {
+        "index_patterns": [TRIP_INDEX, TRIP_INDEX + "-*"],
+        "mappings": {
+            "properties": {
+                "id": {"type": "integer"},
+                "source": {"type": "geo_point"},
+                "destination": {"type": "geo_point"},
+                "start_estimation": {"type": "date"},
+                "end_estimation": {"type": "date"},
+                "status": {"type": "keyword"},
+                "is_private": {"type": "boolean"},
+                "capacity": {"type": "integer"},
+                "seats_left": {"type": "integer"},
+                "car_provider_id": {"type": "integer"},
+                "group_ids": {"type": "integer"},
+                "passenger_ids": {"type": "integer"},
+            }
+        }
+    },
 }
-if not Elastic_search.indices.exists(index="group_map"):
-    Elastic_search.indices.create(index='group_map', body=mappings)
 
 
-@background
+def get_profile_document(member):
+    return {
+        "id": member.id,
+        "username": member.username,
+        "first_name": member.first_name,
+        "last_name": member.last_name,
+        "suggest": {
+            "input": get_profile_suggestions(member)
+        }
+    }
+
+
+def get_profile_suggestions(member):
+    """
+    The texts whose prefixes complete to the member: the username, each name and the full name.
+    """
+    full_name = '{} {}'.format(member.first_name or '', member.last_name or '').strip()
+    return [text for text in dict.fromkeys([member.username, member.first_name, member.last_name, full_name]) if text]
+
+
+def get_group_member_ids(group):
+    return list(group.membership_set.values_list('member_id', flat=True))
+
+
+def get_group_document(group, member_ids=None):
+    """
+    The privacy of the group and its member ids are indexed so that searches can leave out the private groups of
+    others.
+    """
+    return {
+        "id": group.id,
+        "code": group.code,
+        "title": group.title,
+        "description": group.description,
+        "is_private": group.is_private,
+        "member_ids": get_group_member_ids(group) if member_ids is None else member_ids
+    }
+
+
+def get_group_map_document(group, member_ids=None):
+    return {
+        "id": group.id,
+        "is_private": group.is_private,
+        "member_ids": get_group_member_ids(group) if member_ids is None else member_ids,
+        "pin": {
+            "location": {
+                "lat": group.source.x,
+                "lon": group.source.y
+            }
+        },
+    }
+
+
+def get_trip_document(trip, group_ids, passenger_ids):
+    """
+    The groups, car provider and passengers of the trip are indexed so that searches can leave out the private trips
+    which are not accessible.
+    """
+    return {
+        "id": trip.id,
+        "source": {"lat": trip.source.x, "lon": trip.source.y},
+        "destination": {"lat": trip.destination.x, "lon": trip.destination.y},
+        "start_estimation": trip.start_estimation.isoformat(),
+        "end_estimation": trip.end_estimation.isoformat(),
+        "status": trip.status,
+        "is_private": trip.is_private,
+        "capacity": trip.capacity,
+        "seats_left": trip.seats_left,
+        "car_provider_id": trip.car_provider_id,
+        "group_ids": group_ids,
+        "passenger_ids": passenger_ids,
+    }
+
+
 def index_profile(data):
-    Elastic_search.index(index='prof', id=data["id"], doc_type='people', body=data, request_timeout=30)
+    enqueue(PROFILE_INDEX, data["id"], data)
 
 
-@background
 def update_profile(data, user_id):
-    Elastic_search.update(index='prof', id=user_id, doc_type='people', body=data, request_timeout=30)
+    enqueue(PROFILE_INDEX, user_id, data, operation=PendingDocument.UPDATE_OPERATION)
 
 
-@background
 def index_group_map(data, group_id):
-    Elastic_search.index(index='group_map', id=group_id, doc_type='_doc', body=data, request_timeout=30)
+    enqueue(GROUP_MAP_INDEX, group_id, data)
 
 
-@background
 def index_group(data):
-    Elastic_search.index(index='group', id=data["id"], doc_type='groups', body=data, request_timeout=30)
+    enqueue(GROUP_INDEX, data["id"], data)
+
+
+def index_group_documents(group):
+    member_ids = get_group_member_ids(group)
+    index_group(get_group_document(group, member_ids))
+    if group.source is not None:
+        index_group_map(get_group_map_document(group, member_ids), group.id)
+
+
+def update_group_members(group):
+    data = {"doc": {"member_ids": get_group_member_ids(group)}}
+    enqueue(GROUP_INDEX, group.id, data, operation=PendingDocument.UPDATE_OPERATION)
+    if group.source is not None:
+        enqueue(GROUP_MAP_INDEX, group.id, data, operation=PendingDocument.UPDATE_OPERATION)
+
+
+def delete_group_documents(group):
+    enqueue(GROUP_INDEX, group.id, None, operation=PendingDocument.DELETE_OPERATION)
+    if group.source is not None:
+        enqueue(GROUP_MAP_INDEX, group.id, None, operation=PendingDocument.DELETE_OPERATION)
+
+
+def index_trip(data):
+    enqueue(TRIP_INDEX, data["id"], data)
+
+
+def delete_trip(trip_id):
+    enqueue(TRIP_INDEX, trip_id, None, operation=PendingDocument.DELETE_OPERATION)
+
+
+def put_index_templates(client=None):
+    client = client or get_client()
+    for name, template in index_templates.items():
+        client.indices.put_template(name=name, body=template)
+
+
+def ensure_indices(client=None):
+    """
+    Puts the index templates and creates the missing indices, as versioned indices behind their alias. Runs once at
+    deploy instead of at the start of every process.
+    """
+    client = client or get_client()
+    put_index_templates(client)
+    created_indices = []
+    for alias in index_templates:
+        if not client.indices.exists(index=alias):
+            index = create_versioned_index(alias, client)
+            swap_alias(alias, index, client)
+            created_indices.append(index)
+    return created_indices
+
+
+def create_versioned_index(alias, client=None):
+    """
+    Creates an empty index named after alias and the current time, which gets the settings of the template of alias.
+    """
+    client = client or get_client()
+    index = '{}-{}'.format(alias, timezone.now().strftime('%Y%m%d%H%M%S'))
+    client.indices.create(index=index)
+    return index
+
+
+def swap_alias(alias, index, client=None):
+    """
+    Points alias to index alone in one atomic step. The indices it pointed to, or the former index named like alias,
+    are deleted.
+    """
+    client = client or get_client()
+    actions = [{"add": {"index": index, "alias": alias}}]
+    if client.indices.exists_alias(name=alias):
+        actions.extend({"remove_index": {"index": old_index}} for old_index in client.indices.get_alias(name=alias)
+                       if old_index != index)
+    elif client.indices.exists(index=alias):
+        actions.append({"remove_index": {"index": alias}})
+    client.indices.update_aliases(body={"actions": actions})
+
+
+def migrate_index(alias, client=None):
+    """
+    Copies the documents of alias to a new index analyzed by the current template of alias, then swaps alias to it.
+    Documents flushed during the copy may be lost, so this runs while the background tasks worker is stopped; the
+    documents queued meanwhile are sent to the new index once it is back.
+    """
+    client = client or get_client()
+    put_index_templates(client)
+    index = create_versioned_index(alias, client)
+    documents_count = 0
+    if client.indices.exists(index=alias):
+        documents_count, _ = bulk(client, ({"_index": index, "_id": hit["_id"], "_source": hit["_source"]}
+                                           for hit in scan(client, index=alias)), request_timeout=30)
+    client.indices.refresh(index=index)
+    swap_alias(alias, index, client)
+    return index, documents_count
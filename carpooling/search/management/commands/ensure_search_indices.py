@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from search.client import get_client
+from search.index import ensure_indices
+
+
+class Command(BaseCommand):
+    help = 'Puts the search index templates and creates the missing indices, once at deploy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wait', type=float, default=0,
+                            help='Seconds to wait for Elasticsearch to come up before giving up')
+
+    def handle(self, *args, **options):
+        deadline = time.monotonic() + options['wait']
+        while not get_client().ping():
+            if time.monotonic() >= deadline:
+                raise CommandError('Elasticsearch is not reachable')
+            time.sleep(0.5)
+        created_indices = ensure_indices()
+        self.stdout.write(self.style.SUCCESS('Search indices are ready, created: {}'.format(
+            ', '.join(created_indices) or 'none')))
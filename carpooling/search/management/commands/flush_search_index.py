@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from search.pipeline import flush, retry_dead_documents
+
+
+class Command(BaseCommand):
+    help = 'Sends the queued search documents to Elasticsearch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-dead', action='store_true', help='Retry the documents kept as dead letters')
+
+    def handle(self, *args, **options):
+        if options['retry_dead']:
+            self.stdout.write('{} dead documents queued again'.format(retry_dead_documents()))
+        stats = flush()
+        self.stdout.write(self.style.SUCCESS(
+            '{sent} documents sent, {failed} failed and {dead} moved to dead letters'.format(**stats)))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from search.index import migrate_index, PROFILE_INDEX, GROUP_INDEX
+
+
+class Command(BaseCommand):
+    help = 'Moves the profile and group indices to new indices analyzed by the current index templates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('indices', nargs='*', default=[PROFILE_INDEX, GROUP_INDEX],
+                            help='Aliases of the indices to migrate')
+
+    def handle(self, *args, **options):
+        for alias in options['indices']:
+            index, documents_count = migrate_index(alias)
+            self.stdout.write(self.style.SUCCESS('{} now points to {} with {} documents'.format(
+                alias, index, documents_count)))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from search.rebuild import SearchIndexRebuilder, SOURCES
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds search indices from the database into new indices, then swaps their aliases to them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('indices', nargs='*', default=list(SOURCES),
+                            help='Aliases of the indices to rebuild, among {}'.format(', '.join(SOURCES)))
+        parser.add_argument('--chunk-size', type=int, default=500, help='Documents per bulk request')
+        parser.add_argument('--workers', type=int, default=1, help='Bulk requests sent in parallel')
+        parser.add_argument('--resume', action='store_true',
+                            help='Continue the unfinished rebuild of each index instead of starting over')
+
+    def handle(self, *args, **options):
+        unknown_indices = set(options['indices']) - set(SOURCES)
+        if unknown_indices:
+            raise CommandError('Unknown indices: {}'.format(', '.join(unknown_indices)))
+        for alias in options['indices']:
+            stats = SearchIndexRebuilder(alias, chunk_size=options['chunk_size'], workers=options['workers'],
+                                         resume=options['resume'], report=self.stdout.write).run()
+            self.stdout.write(self.style.SUCCESS(
+                '{} now points to {index} with {documents} documents written in {seconds:.1f}s '
+                '({documents_per_second:.0f} documents/s)'.format(alias, **stats)))
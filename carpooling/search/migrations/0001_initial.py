@@ -0,0 +1,36 @@
+# Generated by Django 2.2.2 on 2026-10-18 17:33
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.CharField(max_length=50)),
+                ('doc_type', models.CharField(default='_doc', max_length=50)),
+                ('doc_id', models.CharField(max_length=50)),
+                ('operation', models.CharField(choices=[('index', 'index'), ('update', 'update'), ('delete', 'delete')], default='index', max_length=6)),
+                ('body', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('creation_time', models.DateTimeField(auto_now_add=True)),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('last_error', models.TextField(null=True)),
+                ('dead', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='pendingdocument',
+            index=models.Index(fields=['dead', 'next_attempt'], name='search_pend_dead_e9cc2b_idx'),
+        ),
+    ]
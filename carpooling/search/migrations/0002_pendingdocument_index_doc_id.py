@@ -0,0 +1,17 @@
+# Generated by Django 2.2.2 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pendingdocument',
+            index=models.Index(fields=['index', 'doc_id'], name='search_pend_index_062a69_idx'),
+        ),
+    ]
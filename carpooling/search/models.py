@@ -0,0 +1,54 @@
+from django.contrib.postgres.fields import JSONField
+from django.db import models
+from django.utils import timezone
+
+
+class PendingDocument(models.Model):
+    """
+    A change of an Elasticsearch document waiting to be sent in a bulk request by search.pipeline. Documents which
+    failed too many times are kept as dead letters until they are retried by hand.
+    """
+    INDEX_OPERATION = 'index'
+    UPDATE_OPERATION = 'update'
+    DELETE_OPERATION = 'delete'
+    OPERATION_CHOICES = [
+        (INDEX_OPERATION, 'index'),
+        (UPDATE_OPERATION, 'update'),
+        (DELETE_OPERATION, 'delete'),
+    ]
+    index = models.CharField(max_length=50)
+    doc_type = models.CharField(max_length=50, default='_doc')
+    doc_id = models.CharField(max_length=50)
+    operation = models.CharField(max_length=6, choices=OPERATION_CHOICES, default=INDEX_OPERATION)
+    body = JSONField(null=True)
+    creation_time = models.DateTimeField(auto_now_add=True)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(null=True)
+    dead = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['dead', 'next_attempt']),
+            models.Index(fields=['index', 'doc_id']),
+        ]
+
+    def get_action(self):
+        action = {'_op_type': self.operation, '_index': self.index, '_type': self.doc_type, '_id': self.doc_id}
+        if self.operation == self.INDEX_OPERATION:
+            action['_source'] = self.body
+        elif self.operation == self.UPDATE_OPERATION:
+            action.update(self.body)
+        return action
+
+    def merge(self, document):
+        """
+        Applies a later change of the same document to this one. Indexing or deleting replaces every former change,
+        and partial updates are merged into the document or the former update.
+        """
+        if document.operation != self.UPDATE_OPERATION:
+            self.operation, self.body = document.operation, document.body
+        elif self.operation == self.INDEX_OPERATION:
+            self.body = dict(self.body, **document.body['doc'])
+        elif self.operation == self.UPDATE_OPERATION:
+            self.body = {'doc': dict(self.body['doc'], **document.body['doc'])}
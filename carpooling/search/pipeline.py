@@ -0,0 +1,121 @@
+import logging
+from datetime import timedelta
+
+from background_task import background
+from background_task.models import Task
+from django.db.models import Min, Exists, OuterRef, Q
+from django.db.transaction import atomic, on_commit
+from django.utils import timezone
+from elasticsearch.helpers import streaming_bulk
+
+from carpooling.settings.base import SEARCH_INDEX_BATCH_SIZE, SEARCH_INDEX_FLUSH_INTERVAL, SEARCH_INDEX_MAX_ATTEMPTS, \
+    SEARCH_INDEX_RETRY_DELAY, SEARCH_INDEX_MAX_RETRY_DELAY
+from search.client import get_client
+from search.models import PendingDocument
+
+log = logging.getLogger(__name__)
+
+
+def enqueue(index, doc_id, body, operation=PendingDocument.INDEX_OPERATION, doc_type='_doc'):
+    """
+    Queues a document change. A flush is scheduled SEARCH_INDEX_FLUSH_INTERVAL seconds later unless one is already
+    waiting, so the documents changed meanwhile go in the same bulk request.
+    """
+    PendingDocument.objects.create(index=index, doc_type=doc_type, doc_id=str(doc_id), operation=operation, body=body)
+    on_commit(schedule_flush)
+
+
+def schedule_flush(run_at=None):
+    if not Task.objects.filter(task_name=flush_pending_documents.name, locked_by__isnull=True).exists():
+        flush_pending_documents(schedule=run_at or SEARCH_INDEX_FLUSH_INTERVAL)
+
+
+@background
+def flush_pending_documents():
+    flush()
+    next_attempt = PendingDocument.objects.filter(dead=False).aggregate(Min('next_attempt'))['next_attempt__min']
+    if next_attempt is not None:
+        schedule_flush(max(next_attempt, timezone.now()))
+
+
+def flush(batch_size=SEARCH_INDEX_BATCH_SIZE, client=None):
+    """
+    Sends the due documents in bulk requests of batch_size until none is left. The pending changes of a document are
+    merged and sent as one action, and a document is only taken by one worker at a time, from its oldest change, so
+    its changes reach Elasticsearch in order. Sent changes are removed from the queue, failed ones are retried with
+    an exponential backoff and become dead letters after SEARCH_INDEX_MAX_ATTEMPTS attempts. Returns the number of
+    sent, failed and dead changes.
+    """
+    client = client or get_client()
+    stats = {'sent': 0, 'failed': 0, 'dead': 0}
+    while True:
+        with atomic():
+            documents = get_due_documents(batch_size)
+            if not documents:
+                break
+            later_changes = merge_later_changes(documents)
+            sent_ids = []
+            for document, (ok, result) in zip(documents, send(client, documents)):
+                if ok:
+                    sent_ids.append(document.id)
+                else:
+                    mark_failed(document, result)
+                    stats['dead' if document.dead else 'failed'] += 1
+            PendingDocument.objects.filter(id__in=sent_ids + later_changes).delete()
+            stats['sent'] += len(sent_ids) + len(later_changes)
+    if stats['failed'] or stats['dead']:
+        log.warning("Search documents flushed with failures: {}".format(stats))
+    return stats
+
+
+def get_due_documents(batch_size):
+    """
+    Locks the due oldest changes of batch_size documents, skipping the ones locked by other workers.
+    """
+    older_changes = PendingDocument.objects.filter(index=OuterRef('index'), doc_id=OuterRef('doc_id'), dead=False,
+                                                   id__lt=OuterRef('id'))
+    return list(PendingDocument.objects.select_for_update(skip_locked=True).annotate(
+        has_older_changes=Exists(older_changes)).filter(
+        has_older_changes=False, dead=False, next_attempt__lte=timezone.now()).order_by('id')[:batch_size])
+
+
+def merge_later_changes(documents):
+    """
+    Locks the later changes of the documents and merges them into their oldest change, in order. Returns the ids of
+    the merged changes, which are removed whether the document is sent or retried.
+    """
+    documents_by_key = {(document.index, document.doc_id): document for document in documents}
+    later_changes = Q()
+    for document in documents:
+        later_changes |= Q(index=document.index, doc_id=document.doc_id, id__gt=document.id)
+    merged_ids = []
+    for change in PendingDocument.objects.select_for_update().filter(later_changes, dead=False).order_by('id'):
+        documents_by_key[change.index, change.doc_id].merge(change)
+        merged_ids.append(change.id)
+    return merged_ids
+
+
+def send(client, documents):
+    """
+    Yields an (ok, result) pair for each document, in order. Errors of the whole request, like a connection error,
+    are reported as failures of all its documents.
+    """
+    return streaming_bulk(client, (document.get_action() for document in documents), chunk_size=len(documents),
+                          raise_on_error=False, raise_on_exception=False, request_timeout=30)
+
+
+def mark_failed(document, error):
+    document.attempts += 1
+    document.last_error = str(error)[:2000]
+    if document.attempts >= SEARCH_INDEX_MAX_ATTEMPTS:
+        document.dead = True
+        log.error("Search document {} of {} moved to dead letters: {}".format(
+            document.doc_id, document.index, document.last_error))
+    else:
+        delay = min(SEARCH_INDEX_RETRY_DELAY * 2 ** (document.attempts - 1), SEARCH_INDEX_MAX_RETRY_DELAY)
+        document.next_attempt = timezone.now() + timedelta(seconds=delay)
+    document.save()
+
+
+def retry_dead_documents():
+    return PendingDocument.objects.filter(dead=True).update(dead=False, attempts=0, next_attempt=timezone.now())
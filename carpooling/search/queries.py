@@ -1,52 +1,119 @@
-from search.index import Elastic_search
+from search.client import get_client
+from search.index import PROFILE_INDEX, GROUP_INDEX, GROUP_MAP_INDEX, TRIP_INDEX
 
+NEARBY_GROUPS_DISTANCE = 12  # Kilometers
 
-def profile_username_name_search(data):
-    query = {"bool": {"should": [
-        {"wildcard": {'username': {"value": "*" + data + "*"}}},
-        {"wildcard": {'first_name': {"value": "*" + data + "*"}}},
-        {"wildcard": {'last_name': {"value": "*" + data + "*"}}},
+
+def text_search_query(data, fields):
+    """
+    Matches documents having a field which starts with, or contains, every word of data. Prefix matches and exact
+    ones rank first.
+    """
+    return {"bool": {"should": [
+        {"multi_match": {"query": data, "fields": fields, "boost": 3}},
+        {"multi_match": {"query": data, "fields": [field + ".prefix" for field in fields], "operator": "and",
+                         "boost": 2}},
+        {"multi_match": {"query": data, "fields": [field + ".trigram" for field in fields], "operator": "and"}},
     ]
     }
     }
-    try:
-        return Elastic_search.search(index="prof", body={"query": query}, size=10)
-    except:
-        return None
 
 
-def group_search_with_out_map(data):
-    query = {"bool": {"should": [
-        {"wildcard": {'title': {"value": "*" + data + "*"}}},
-        {"wildcard": {'code': {"value": "*" + data + "*"}}},
-        {"wildcard": {'description': {"value": "*" + data + "*"}}},
+def profile_username_name_search(data):
+    query = text_search_query(data, ["username", "first_name", "last_name"])
+    return get_client().search(index=PROFILE_INDEX, body={"query": query}, size=10)
+
+
+def visible_groups_filter(user_id):
+    """
+    Leaves out the private groups which the user is not a member of. Documents indexed without the privacy of their
+    group are kept, for the caller to filter.
+    """
+    return {"bool": {"should": [
+        {"term": {"is_private": False}},
+        {"term": {"member_ids": user_id}},
+        {"bool": {"must_not": {"exists": {"field": "is_private"}}}},
     ]
     }
     }
-    try:
-        return Elastic_search.search(index="group", body={"query": query}, size=20)
-    except:
-        return None
 
 
-def group_search_with_map(data):
+def profile_suggest(prefix, size, timeout):
+    body = {
+        "_source": ["username", "first_name", "last_name"],
+        "suggest": {
+            "people": {
+                "prefix": prefix,
+                "completion": {"field": "suggest", "size": size, "skip_duplicates": True}
+            }
+        }
+    }
+    return get_client().search(index=PROFILE_INDEX, body=body, request_timeout=timeout)
+
+
+def group_search_with_out_map(data, user_id):
+    query = text_search_query(data, ["title", "code", "description"])
+    query["bool"]["minimum_should_match"] = 1
+    query["bool"]["filter"] = visible_groups_filter(user_id)
+    return get_client().search(index=GROUP_INDEX, body={"query": query}, size=20)
+
+
+def group_search_with_map(data, user_id):
     query = {
         "bool": {
             "must": {
                 "match_all": {}
             },
-            "filter": {
-                "geo_distance": {
-                    "distance": "12km",
-                    "pin.location": {
-                        "lat": data["lat"],
-                        "lon": data["lon"]
+            "filter": [
+                {
+                    "geo_distance": {
+                        "distance": "{}km".format(NEARBY_GROUPS_DISTANCE),
+                        "pin.location": {
+                            "lat": data["lat"],
+                            "lon": data["lon"]
+                        }
                     }
-                }
-            }
+                },
+                visible_groups_filter(user_id),
+            ]
         }
     }
-    try:
-        return Elastic_search.search(index="group_map", body={"query": query}, size=20)
-    except:
-        return None
+    return get_client().search(index=GROUP_MAP_INDEX, body={"query": query}, size=20)
+
+
+def geo_distance_filter(field, lat, lon, distance):
+    return {"geo_distance": {"distance": "{}km".format(distance), field: {"lat": lat, "lon": lon}}}
+
+
+def geo_bounding_box_filter(field, top, left, bottom, right):
+    return {"geo_bounding_box": {field: {"top_left": {"lat": top, "lon": left},
+                                         "bottom_right": {"lat": bottom, "lon": right}}}}
+
+
+def accessible_trips_filter(user_id, group_ids):
+    return {"bool": {"should": [
+        {"term": {"is_private": False}},
+        {"term": {"car_provider_id": user_id}},
+        {"term": {"passenger_ids": user_id}},
+        {"terms": {"group_ids": group_ids}},
+    ]
+    }
+    }
+
+
+def trip_map_search(user_id, group_ids, geo_filter, status, time_range=None, near=None, size=100):
+    """
+    Finds the trips with the status matching geo_filter and accessible for the user, which start and end inside
+    time_range when given. Trips are sorted by the distance of their source to near, a (lat, lon) pair, when given and
+    by their start otherwise.
+    """
+    filters = [geo_filter, {"term": {"status": status}}, accessible_trips_filter(user_id, group_ids)]
+    if time_range is not None:
+        filters.append({"range": {"start_estimation": {"gt": time_range[0].isoformat()}}})
+        filters.append({"range": {"end_estimation": {"lt": time_range[1].isoformat()}}})
+    if near is not None:
+        sort = [{"_geo_distance": {"source": {"lat": near[0], "lon": near[1]}, "order": "asc"}}]
+    else:
+        sort = [{"start_estimation": "asc"}]
+    query = {"bool": {"filter": filters}}
+    return get_client().search(index=TRIP_INDEX, body={"query": query, "sort": sort}, size=size)
@@ -0,0 +1,124 @@
+import logging
+import time
+
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db.models import Q
+from elasticsearch.helpers import streaming_bulk, parallel_bulk
+
+from account.models import Member
+from group.models import Group
+from search.client import get_client
+from search.index import PROFILE_INDEX, GROUP_INDEX, GROUP_MAP_INDEX, TRIP_INDEX, get_profile_document, \
+    get_group_document, get_group_map_document, put_index_templates, create_versioned_index, swap_alias
+from search.trips import get_trips, get_trip_document
+
+log = logging.getLogger(__name__)
+
+
+def with_member_ids(groups):
+    return groups.annotate(member_ids=ArrayAgg('membership__member_id', filter=Q(membership__isnull=False)))
+
+
+def get_groups():
+    return with_member_ids(Group.objects.defer('source'))
+
+
+def get_located_groups():
+    return with_member_ids(Group.objects.filter(source__isnull=False).only('id', 'is_private', 'source'))
+
+
+# The rows each index is built from, and the builder of their documents
+SOURCES = {
+    PROFILE_INDEX: (lambda: Member.objects.only('id', 'username', 'first_name', 'last_name'), get_profile_document),
+    GROUP_INDEX: (get_groups, lambda group: get_group_document(group, group.member_ids or [])),
+    GROUP_MAP_INDEX: (get_located_groups, lambda group: get_group_map_document(group, group.member_ids or [])),
+    TRIP_INDEX: (get_trips, get_trip_document),
+}
+
+
+class SearchIndexRebuilder:
+    """
+    Streams the rows behind an index from the database, in id order, into a new versioned index in bulk requests of
+    chunk_size documents sent by workers threads, then atomically points the alias of the index to it. A rebuild
+    which stopped can be resumed in the versioned index it left unfinished.
+
+    Rows created during the rebuild are caught up before the swap, but documents of rows updated after they were
+    streamed keep their former version until they change again.
+    """
+
+    def __init__(self, alias, chunk_size=500, workers=1, resume=False, report=None, client=None):
+        self.alias = alias
+        self.get_queryset, self.get_document = SOURCES[alias]
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.resume = resume
+        self.report = report or log.info
+        self.client = client or get_client()
+        self.documents_count = 0
+        self.start = None
+
+    def run(self):
+        put_index_templates(self.client)
+        index = self.get_unfinished_index() if self.resume else None
+        if index is None:
+            index, last_id = create_versioned_index(self.alias, self.client), 0
+        else:
+            last_id = self.get_resume_id(index)
+            self.report('Resuming {} after id {}'.format(index, last_id))
+        self.start = time.perf_counter()
+        last_id = self.write(index, last_id)
+        self.write(index, last_id)
+        self.client.indices.refresh(index=index)
+        swap_alias(self.alias, index, self.client)
+        seconds = time.perf_counter() - self.start
+        return {
+            'index': index,
+            'documents': self.documents_count,
+            'seconds': seconds,
+            'documents_per_second': self.documents_count / seconds if seconds else None,
+        }
+
+    def write(self, index, last_id):
+        """
+        Writes the documents of the rows after last_id and returns the id of the last written one.
+        """
+        rows = self.get_queryset().filter(id__gt=last_id).order_by('id').iterator(chunk_size=self.chunk_size)
+        actions = ({'_index': index, '_id': row.id, '_source': self.get_document(row)} for row in rows)
+        if self.workers > 1:
+            results = parallel_bulk(self.client, actions, thread_count=self.workers, queue_size=self.workers,
+                                    chunk_size=self.chunk_size, request_timeout=60)
+        else:
+            results = streaming_bulk(self.client, actions, chunk_size=self.chunk_size, request_timeout=60)
+        for _, result in results:
+            last_id = int(result['index']['_id'])
+            self.documents_count += 1
+            if self.documents_count % (self.chunk_size * 10) == 0:
+                self.report_progress()
+        return last_id
+
+    def report_progress(self):
+        seconds = time.perf_counter() - self.start
+        self.report('{}: {} documents, {:.0f} documents/s'.format(
+            self.alias, self.documents_count, self.documents_count / seconds if seconds else 0))
+
+    def get_unfinished_index(self):
+        """
+        The latest versioned index of the alias which the alias does not point to yet.
+        """
+        indices = set(self.client.indices.get(index='{}-*'.format(self.alias)))
+        if self.client.indices.exists_alias(name=self.alias):
+            indices -= set(self.client.indices.get_alias(name=self.alias))
+        return max(indices, default=None)
+
+    def get_resume_id(self, index):
+        """
+        The id after which the rows are written again. Workers write chunks out of order, so the written documents
+        with the highest id may follow a chunk which was not written, among the chunks which were in flight.
+        """
+        hits = self.client.search(index=index, body={'sort': [{'id': 'desc'}], 'size': 1, '_source': False})
+        if not hits['hits']['hits']:
+            return 0
+        max_id = int(hits['hits']['hits'][0]['_id'])
+        in_flight_rows = self.chunk_size * 2 * self.workers  # Chunks being sent and chunks queued for the workers
+        resume_ids = self.get_queryset().filter(id__lte=max_id).order_by('-id').values_list('id', flat=True)
+        return next(iter(resume_ids[in_flight_rows:in_flight_rows + 1]), 0)
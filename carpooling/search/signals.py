@@ -0,0 +1,44 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from group.models import Group, Membership
+from search import index
+from search.trips import reindex_trips
+from trip.models import Trip, TripGroups, Companionship
+
+
+@receiver(post_save, sender=Group)
+def reindex_group(sender, instance, created, **kwargs):
+    if not created:
+        index.index_group_documents(instance)
+
+
+@receiver(post_delete, sender=Group)
+def delete_group_documents(sender, instance, **kwargs):
+    index.delete_group_documents(instance)
+
+
+@receiver(post_save, sender=Membership)
+@receiver(post_delete, sender=Membership)
+def update_group_members(sender, instance, **kwargs):
+    group = Group.objects.filter(id=instance.group_id).only('id', 'source').first()
+    if group is not None:
+        index.update_group_members(group)
+
+
+@receiver(post_save, sender=Trip)
+def reindex_trip(sender, instance, **kwargs):
+    reindex_trips([instance.id])
+
+
+@receiver(post_delete, sender=Trip)
+def delete_trip_document(sender, instance, **kwargs):
+    index.delete_trip(instance.id)
+
+
+@receiver(post_save, sender=TripGroups)
+@receiver(post_delete, sender=TripGroups)
+@receiver(post_save, sender=Companionship)
+@receiver(post_delete, sender=Companionship)
+def reindex_changed_trip(sender, instance, **kwargs):
+    reindex_trips([instance.trip_id])
@@ -0,0 +1,347 @@
+from unittest.mock import patch, MagicMock
+
+from django.contrib.gis.geos import Point
+from django.test import TestCase
+from django.utils import timezone
+from model_mommy import mommy
+
+from account.models import Member
+from carpooling.settings.base import SEARCH_INDEX_MAX_ATTEMPTS
+from search.autocomplete import PrefixTrie, PeopleTrie, PeopleAutocomplete
+from search.backends import SearchBackend, PostgresBackend, RoutedSearchBackend
+from search.circuit_breaker import CircuitBreaker, elasticsearch_circuit_breaker
+from group.models import Group, Membership
+from search.index import index_profile, update_profile, swap_alias, migrate_index, ensure_indices
+from search.models import PendingDocument
+from search.pipeline import flush, retry_dead_documents
+from search.queries import text_search_query
+from search.rebuild import SearchIndexRebuilder
+from trip.models import Trip, TripGroups, Companionship
+
+
+def bulk_results(*results, sent_actions=None):
+    def streaming_bulk(client, actions, **kwargs):
+        actions = list(actions)
+        if sent_actions is not None:
+            sent_actions.extend(actions)
+        return zip(results, [{'index': {'_id': action['_id']}} for action in actions])
+    return streaming_bulk
+
+
+@patch('search.pipeline.streaming_bulk')
+class PipelineTest(TestCase):
+    def setUp(self):
+        index_profile({'id': 1, 'username': 'alice'})
+        update_profile({'doc': {'id': 2, 'first_name': 'Bob'}}, 2)
+
+    def test_enqueue(self, streaming_bulk):
+        self.assertEqual(2, PendingDocument.objects.count())
+        action = PendingDocument.objects.get(doc_id='2').get_action()
+        self.assertEqual('update', action['_op_type'])
+        self.assertEqual({'id': 2, 'first_name': 'Bob'}, action['doc'])
+
+    def test_flush_sends_documents_in_batches(self, streaming_bulk):
+        streaming_bulk.side_effect = bulk_results(True)
+        stats = flush(batch_size=1)
+        self.assertEqual(2, stats['sent'])
+        self.assertEqual(2, streaming_bulk.call_count)
+        self.assertFalse(PendingDocument.objects.exists())
+
+    def test_failed_documents_are_retried_later(self, streaming_bulk):
+        streaming_bulk.side_effect = bulk_results(True, False)
+        stats = flush()
+        self.assertEqual({'sent': 1, 'failed': 1, 'dead': 0}, stats)
+        document = PendingDocument.objects.get()
+        self.assertEqual('2', document.doc_id)
+        self.assertEqual(1, document.attempts)
+        self.assertGreater(document.next_attempt, timezone.now())
+        self.assertEqual(0, flush()['sent'])
+
+    def test_documents_failing_too_many_times_are_dead(self, streaming_bulk):
+        streaming_bulk.side_effect = bulk_results(False, False)
+        PendingDocument.objects.update(attempts=SEARCH_INDEX_MAX_ATTEMPTS - 1)
+        self.assertEqual(2, flush()['dead'])
+        self.assertEqual(2, PendingDocument.objects.filter(dead=True).count())
+        self.assertEqual(2, retry_dead_documents())
+        streaming_bulk.side_effect = bulk_results(True, True)
+        self.assertEqual(2, flush()['sent'])
+
+    def test_changes_of_a_document_are_merged(self, streaming_bulk):
+        update_profile({'doc': {'first_name': 'Alice'}}, 1)
+        actions = []
+        streaming_bulk.side_effect = bulk_results(True, True, sent_actions=actions)
+        self.assertEqual(3, flush()['sent'])
+        self.assertEqual(2, len(actions))
+        self.assertEqual({'id': 1, 'username': 'alice', 'first_name': 'Alice'}, actions[0]['_source'])
+
+    def test_failed_change_is_sent_with_later_changes(self, streaming_bulk):
+        streaming_bulk.side_effect = bulk_results(False, True)
+        flush()
+        index_profile({'id': 1, 'username': 'alicia'})
+        PendingDocument.objects.update(next_attempt=timezone.now())
+        actions = []
+        streaming_bulk.side_effect = bulk_results(True, sent_actions=actions)
+        self.assertEqual(2, flush()['sent'])
+        self.assertEqual([{'id': 1, 'username': 'alicia'}], [action['_source'] for action in actions])
+        self.assertFalse(PendingDocument.objects.exists())
+
+
+class IndexMigrationTest(TestCase):
+    def setUp(self):
+        self.client = MagicMock()
+
+    def test_swap_alias_replaces_former_index(self):
+        self.client.indices.exists_alias.return_value = False
+        self.client.indices.exists.return_value = True
+        swap_alias('prof', 'prof-1', self.client)
+        self.client.indices.update_aliases.assert_called_once_with(body={'actions': [
+            {'add': {'index': 'prof-1', 'alias': 'prof'}},
+            {'remove_index': {'index': 'prof'}},
+        ]})
+
+    def test_swap_alias_removes_former_versions(self):
+        self.client.indices.exists_alias.return_value = True
+        self.client.indices.get_alias.return_value = {'prof-0': {'aliases': {'prof': {}}}}
+        swap_alias('prof', 'prof-1', self.client)
+        self.client.indices.update_aliases.assert_called_once_with(body={'actions': [
+            {'add': {'index': 'prof-1', 'alias': 'prof'}},
+            {'remove_index': {'index': 'prof-0'}},
+        ]})
+
+    @patch('search.index.scan')
+    def test_migrate_index_copies_documents(self, scan):
+        self.client.indices.exists.return_value = True
+        self.client.indices.exists_alias.return_value = False
+        scan.return_value = [{'_id': '1', '_source': {'id': 1, 'username': 'alice'}}]
+        with patch('search.index.bulk', return_value=(1, [])) as bulk:
+            index, documents_count = migrate_index('prof', self.client)
+            actions = list(bulk.call_args[0][1])
+        self.assertTrue(index.startswith('prof-'))
+        self.assertEqual(1, documents_count)
+        self.assertEqual([{'_index': index, '_id': '1', '_source': {'id': 1, 'username': 'alice'}}], actions)
+        self.assertTrue(self.client.indices.put_template.called)
+
+    def test_ensure_indices_creates_missing_indices(self):
+        self.client.indices.exists.side_effect = lambda index: index == 'prof'
+        self.client.indices.exists_alias.return_value = False
+        created_indices = ensure_indices(self.client)
+        self.assertEqual(['group', 'group_map'], [index.rsplit('-', 1)[0] for index in created_indices])
+        self.assertEqual(3, self.client.indices.put_template.call_count)
+
+    def test_text_search_query_uses_analyzed_fields(self):
+        query = text_search_query('ali', ['username', 'first_name'])
+        fields = [field for clause in query['bool']['should'] for field in clause['multi_match']['fields']]
+        self.assertIn('username.prefix', fields)
+        self.assertIn('first_name.trigram', fields)
+        self.assertNotIn('wildcard', str(query))
+
+
+def written_bulk(written_ids):
+    def streaming_bulk(client, actions, **kwargs):
+        for action in actions:
+            written_ids.append(action['_id'])
+            yield True, {'index': {'_id': str(action['_id'])}}
+    return streaming_bulk
+
+
+class SearchIndexRebuilderTest(TestCase):
+    def setUp(self):
+        self.client = MagicMock()
+        self.client.indices.exists_alias.return_value = True
+        self.client.indices.get_alias.return_value = {'prof-1': {}}
+        self.members = sorted(mommy.make(Member, _quantity=6), key=lambda member: member.id)
+        self.written_ids = []
+
+    @patch('search.rebuild.streaming_bulk')
+    def test_rebuild_writes_every_member_and_swaps_alias(self, streaming_bulk):
+        streaming_bulk.side_effect = written_bulk(self.written_ids)
+        stats = SearchIndexRebuilder('prof', chunk_size=2, client=self.client).run()
+        self.assertEqual([member.id for member in self.members], self.written_ids)
+        self.assertEqual(6, stats['documents'])
+        actions = self.client.indices.update_aliases.call_args[1]['body']['actions']
+        self.assertIn({'add': {'index': stats['index'], 'alias': 'prof'}}, actions)
+        self.assertIn({'remove_index': {'index': 'prof-1'}}, actions)
+
+    @patch('search.rebuild.streaming_bulk')
+    def test_resume_rewrites_chunks_in_flight(self, streaming_bulk):
+        streaming_bulk.side_effect = written_bulk(self.written_ids)
+        self.client.indices.get.return_value = {'prof-1': {}, 'prof-2': {}}
+        self.client.search.return_value = {'hits': {'hits': [{'_id': str(self.members[4].id)}]}}
+        stats = SearchIndexRebuilder('prof', chunk_size=1, resume=True, client=self.client).run()
+        self.assertEqual('prof-2', stats['index'])
+        self.assertEqual([member.id for member in self.members[3:]], self.written_ids)
+        self.assertFalse(self.client.indices.create.called)
+
+
+class GroupDocumentsTest(TestCase):
+    def test_membership_changes_update_member_ids(self):
+        group = mommy.make(Group, is_private=True)
+        member = mommy.make(Member)
+        PendingDocument.objects.all().delete()
+        mommy.make(Membership, group=group, member=member, role='me')
+        document = PendingDocument.objects.get(index='group')
+        self.assertEqual(PendingDocument.UPDATE_OPERATION, document.operation)
+        self.assertEqual({'doc': {'member_ids': [member.id]}}, document.body)
+
+    def test_group_changes_reindex_documents(self):
+        group = mommy.make(Group, is_private=False, source=Point(35.7, 51.4))
+        group.is_private = True
+        group.save()
+        document = PendingDocument.objects.get(index='group_map')
+        self.assertTrue(document.body['is_private'])
+        self.assertEqual({'lat': 35.7, 'lon': 51.4}, document.body['pin']['location'])
+        group.delete()
+        self.assertEqual(2, PendingDocument.objects.filter(operation=PendingDocument.DELETE_OPERATION).count())
+
+
+class TripDocumentsTest(TestCase):
+    def setUp(self):
+        self.trip = mommy.make(Trip, is_private=True, status=Trip.WAITING_STATUS, capacity=3,
+                               source=Point(35.7, 51.4), destination=Point(35.75, 51.3))
+
+    def get_last_document(self):
+        return PendingDocument.objects.filter(index='trip').latest('id')
+
+    def test_trip_changes_update_document(self):
+        group = mommy.make(Group)
+        passenger = mommy.make(Member)
+        mommy.make(TripGroups, trip=self.trip, group=group)
+        mommy.make(Companionship, trip=self.trip, member=passenger)
+        document = self.get_last_document().body
+        self.assertEqual({'lat': 35.7, 'lon': 51.4}, document['source'])
+        self.assertTrue(document['is_private'])
+        self.assertEqual(2, document['seats_left'])
+        self.assertEqual([group.id], document['group_ids'])
+        self.assertEqual([passenger.id], document['passenger_ids'])
+
+    def test_deleted_trip_document_is_deleted(self):
+        trip_id = self.trip.id
+        self.trip.delete()
+        document = self.get_last_document()
+        self.assertEqual(str(trip_id), document.doc_id)
+        self.assertEqual(PendingDocument.DELETE_OPERATION, document.operation)
+
+
+class PeopleAutocompleteTest(TestCase):
+    def setUp(self):
+        self.autocomplete = PeopleAutocomplete()
+        self.autocomplete.cache.clear()
+        elasticsearch_circuit_breaker.record_success()
+        self.sepehr = mommy.make(Member, username='sepehr', first_name='Sepehr', last_name='Alavi')
+        self.sepi = mommy.make(Member, username='sepi', first_name='Ali', last_name='Sepanlou')
+        mommy.make(Member, username='sajjad', first_name='Sajjad', last_name='Karimi')
+
+    def test_prefix_trie_finds_shortest_keys_first(self):
+        trie = PrefixTrie()
+        for key, value in [('sepehr', 1), ('Sepi', 2), ('sajjad', 3), ('sep', 4)]:
+            trie.insert(key, value)
+        self.assertEqual([4, 2, 1], trie.find('SEP', 10))
+        self.assertEqual([4], trie.find('sep', 1))
+        self.assertEqual([], trie.find('x', 10))
+
+    @patch('search.autocomplete.search_query.profile_suggest')
+    def test_suggestions_from_index(self, profile_suggest):
+        profile_suggest.return_value = {'suggest': {'people': [{'options': [
+            {'_id': str(self.sepehr.id),
+             '_source': {'username': 'sepehr', 'first_name': 'Sepehr', 'last_name': 'Alavi'}}]}]}}
+        self.assertEqual(['sepehr'], [person['username'] for person in self.autocomplete.suggest('Se')])
+        self.assertEqual(['sepehr'], [person['username'] for person in self.autocomplete.suggest('se')])
+        profile_suggest.assert_called_once_with('se', self.autocomplete.size, self.autocomplete.timeout)
+
+    @patch('search.autocomplete.search_query.profile_suggest', side_effect=ConnectionError)
+    def test_trie_fallback(self, profile_suggest):
+        people = self.autocomplete.suggest('sep')
+        self.assertEqual({self.sepehr.id, self.sepi.id}, {person['id'] for person in people})
+        self.assertEqual([self.sepi.id], [person['id'] for person in self.autocomplete.suggest('ali')])
+
+    @patch('search.autocomplete.search_query.profile_suggest', side_effect=ConnectionError)
+    def test_autocomplete_failures_do_not_open_search_circuit(self, profile_suggest):
+        for prefix in ['a', 'b', 'c', 'd', 'e', 'f']:
+            self.autocomplete.suggest(prefix)
+        self.assertTrue(self.autocomplete.circuit_breaker.is_open())
+        self.assertFalse(elasticsearch_circuit_breaker.is_open())
+
+    def test_stale_trie_is_served_while_another_thread_rebuilds_it(self):
+        trie = PeopleTrie(max_age=0)
+        trie.rebuild()
+        mommy.make(Member, username='sepideh')
+        with trie._rebuild_lock:
+            self.assertEqual(2, len(trie.suggest('sep', 10)))
+        self.assertEqual(3, len(trie.suggest('sep', 10)))
+
+
+class CircuitBreakerTest(TestCase):
+    def setUp(self):
+        self.circuit_breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=60, slow_call_threshold=60)
+        self.primary = MagicMock(side_effect=ConnectionError)
+
+    def call(self):
+        return self.circuit_breaker.call(self.primary, lambda: 'fallback')
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        self.assertEqual('fallback', self.call())
+        self.assertFalse(self.circuit_breaker.is_open())
+        self.assertEqual('fallback', self.call())
+        self.assertTrue(self.circuit_breaker.is_open())
+        self.primary.side_effect = None
+        self.primary.return_value = 'primary'
+        self.assertEqual('fallback', self.call())
+        self.assertEqual(2, self.primary.call_count)
+
+    def test_circuit_closes_after_successful_trial(self):
+        self.call()
+        self.call()
+        self.circuit_breaker.opened_at -= 60
+        self.primary.side_effect = None
+        self.primary.return_value = 'primary'
+        self.assertEqual('primary', self.call())
+        self.assertFalse(self.circuit_breaker.is_open())
+
+    def test_slow_calls_count_as_failures(self):
+        self.circuit_breaker.slow_call_threshold = -1
+        self.primary.side_effect = None
+        self.primary.return_value = 'primary'
+        self.assertEqual('primary', self.call())
+        self.assertEqual('primary', self.call())
+        self.assertTrue(self.circuit_breaker.is_open())
+
+
+class PostgresBackendTest(TestCase):
+    def setUp(self):
+        self.user = mommy.make(Member, username='moein')
+        self.sepehr = mommy.make(Member, username='sepehr', first_name='Sepehr', last_name='Alavi')
+        mommy.make(Member, username='sajjad', first_name='Sajjad', last_name='Karimi')
+        self.public_group = mommy.make(Group, title='bazaar', code='bazaar', is_private=False,
+                                       source=Point(35.7, 51.4))
+        self.joined_group = mommy.make(Group, title='cafebazaar', code='cafebazaar', is_private=True)
+        mommy.make(Group, title='private bazaar', code='private_bazaar', is_private=True, source=Point(35.7, 51.4))
+        mommy.make(Group, title='divar', code='divar', is_private=False)
+        mommy.make(Membership, member=self.user, group=self.joined_group, role='me')
+        self.backend = PostgresBackend()
+
+    def test_search_people(self):
+        people = self.backend.search_people('SEP')
+        self.assertEqual([self.sepehr.id], [person['id'] for person in people])
+        self.assertEqual('Alavi', people[0]['last_name'])
+
+    def test_search_groups(self):
+        group_ids = self.backend.search_groups('bazaar', self.user)
+        self.assertEqual({self.public_group.id, self.joined_group.id}, set(group_ids))
+        self.assertEqual(self.public_group.id, group_ids[0])
+
+    def test_search_nearby_groups(self):
+        self.assertEqual([self.public_group.id], self.backend.search_nearby_groups(35.705, 51.4, self.user))
+
+    def test_routed_backend_falls_back_when_primary_fails(self):
+        primary = MagicMock()
+        primary.search_people.side_effect = ConnectionError
+        backend = RoutedSearchBackend(primary, self.backend, CircuitBreaker('test'))
+        self.assertEqual([self.sepehr.id], [person['id'] for person in backend.search_people('sep')])
+
+    def test_backend_must_implement_every_search(self):
+        class PeopleBackend(SearchBackend):
+            def search_people(self, query, size=10):
+                return []
+
+        with self.assertRaises(TypeError):
+            PeopleBackend()
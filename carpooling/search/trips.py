@@ -0,0 +1,24 @@
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db.models import Q
+
+from search import index
+from trip.models import Trip
+
+
+def get_trips():
+    return Trip.objects.defer('route', 'trip_description', 'playlist_id').annotate(
+        group_ids=ArrayAgg('tripgroups__group_id', distinct=True, filter=Q(tripgroups__isnull=False)),
+        passenger_ids=ArrayAgg('companionship__member_id', distinct=True, filter=Q(companionship__isnull=False)))
+
+
+def get_trip_document(trip):
+    return index.get_trip_document(trip, trip.group_ids or [], trip.passenger_ids or [])
+
+
+def reindex_trips(trip_ids):
+    """
+    Queues the current documents of the trips, read again from the database since seats and groups are changed by
+    updates which do not go through the trip instances.
+    """
+    for trip in get_trips().filter(id__in=trip_ids):
+        index.index_trip(get_trip_document(trip))
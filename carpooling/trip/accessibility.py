@@ -0,0 +1,38 @@
+from django.db.transaction import atomic
+
+from group.models import Membership
+from trip.models import Trip, TripAccessibility, Companionship
+
+
+def refresh_trip_accessibility(trip_ids=None, member_ids=None):
+    """
+    Recomputes the materialized accessibility of the given trips for the given members, None meaning all of them.
+    """
+    with atomic():
+        filter_scope(TripAccessibility.objects.all(), 'member_id', 'trip_id', trip_ids, member_ids).delete()
+        TripAccessibility.objects.bulk_create([
+            TripAccessibility(member_id=member_id, trip_id=trip_id)
+            for member_id, trip_id in get_accessibility_pairs(trip_ids, member_ids)
+        ], ignore_conflicts=True)
+
+
+def get_accessibility_pairs(trip_ids=None, member_ids=None):
+    sources = [
+        (Membership.objects.all(), 'member_id', 'group__tripgroups__trip_id'),
+        (Trip.objects.all(), 'car_provider_id', 'id'),
+        (Companionship.objects.all(), 'member_id', 'trip_id'),
+    ]
+    pairs = set()
+    for query_set, member_field, trip_field in sources:
+        query_set = filter_scope(query_set, member_field, trip_field, trip_ids, member_ids)
+        pairs.update((member_id, trip_id) for member_id, trip_id in query_set.values_list(member_field, trip_field)
+                     if member_id is not None and trip_id is not None)
+    return pairs
+
+
+def filter_scope(query_set, member_field, trip_field, trip_ids, member_ids):
+    if trip_ids is not None:
+        query_set = query_set.filter(**{trip_field + '__in': trip_ids})
+    if member_ids is not None:
+        query_set = query_set.filter(**{member_field + '__in': member_ids})
+    return query_set
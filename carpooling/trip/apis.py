@@ -1,13 +1,22 @@
 import json
 
-from django.http import HttpResponseBadRequest, HttpResponse
-from django.shortcuts import redirect
+from django.contrib.auth.decorators import login_required
+from django.http import HttpResponseBadRequest, HttpResponse, HttpResponseForbidden
+from django.shortcuts import redirect, get_object_or_404
 from django.urls import reverse
 from .utils import ItemType
 
-from trip.models import Trip
+from search import queries as search_query
+from search.circuit_breaker import elasticsearch_circuit_breaker
+from trip.models import Trip, make_aware
+from trip.views import TripGroupsManager, SearchTripsManager
 from .utils import SpotifyAgent
 
+MAP_TRIPS_DEFAULT_LIMIT = 100
+MAP_TRIPS_MAX_LIMIT = 500
+MAP_TRIPS_DEFAULT_DISTANCE = 5  # Kilometers
+MAP_TRIPS_MAX_DISTANCE = 50
+
 
 def spotify_search(request, trip_id, query):
     if request.method == "GET":
@@ -40,3 +49,80 @@ def append_add_to_playlist_url(items, trip_id):
     for item in items:
         item['url'] = reverse('trip:add_to_playlist', kwargs={'trip_id': trip_id, 'item_id': item['id'],
                                                               'item_type': item['type']})
+
+
+@login_required
+def add_trip_to_groups(request, trip_id):
+    """
+    Attaches a trip to the groups of the car provider whose codes are posted as {"groups": [...]}, among the groups
+    near the trip. Responds with the added and the rejected codes.
+    """
+    if request.method != "POST":
+        return HttpResponseBadRequest('Method not implemented')
+    trip = get_object_or_404(Trip, id=trip_id)
+    if request.user != trip.car_provider:
+        return HttpResponseForbidden()
+    try:
+        codes = set(json.loads(request.body)['groups'])
+    except (ValueError, KeyError, TypeError):
+        return HttpResponseBadRequest('Invalid groups')
+    groups = list(TripGroupsManager.find_nearby_groups(request.user, trip).filter(code__in=codes))
+    TripGroupsManager.add_trip_to_groups(trip, groups)
+    added_codes = {group.code for group in groups}
+    result = {'added': sorted(added_codes), 'rejected': sorted(codes - added_codes)}
+    return HttpResponse(json.dumps(result), content_type='application/json')
+
+
+@login_required
+def get_map_trips(request):
+    """
+    Finds the accessible trips of a status, waiting by default, whose source is within distance kilometers of
+    (lat, lng), nearest first, or inside the box bounded by north, west, south and east. start_time and end_time filter
+    them like the trip search does. Trips are read from the search index, without loading them from the database.
+    """
+    if request.method != "GET":
+        return HttpResponseBadRequest('Method not implemented')
+    try:
+        geo_filter, near = extract_map_area(request.GET)
+        time_range = SearchTripsManager.extract_time_range(request.GET)
+        status = request.GET.get('status', Trip.WAITING_STATUS)
+        limit = int(request.GET.get('limit', MAP_TRIPS_DEFAULT_LIMIT))
+        if status not in dict(Trip.STATUS_CHOICES) or not 0 < limit <= MAP_TRIPS_MAX_LIMIT:
+            raise ValueError()
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest('Bad Request')
+    if time_range is not None:
+        time_range = tuple(make_aware(time) for time in time_range)
+    group_ids = list(request.user.group_set.values_list('id', flat=True))
+    result = elasticsearch_circuit_breaker.call(lambda: search_query.trip_map_search(
+        request.user.id, group_ids, geo_filter, status, time_range, near, limit), lambda: None)
+    if result is None:
+        return HttpResponse('Search is not available', status=503)
+    result = {'trips': [get_map_trip_json(hit['_source']) for hit in result['hits']['hits']]}
+    return HttpResponse(json.dumps(result), content_type='application/json')
+
+
+def extract_map_area(data):
+    """
+    Returns the geo filter of the area and the point to sort trips by their distance to, if any.
+    """
+    if 'lat' in data:
+        lat, lng = float(data['lat']), float(data['lng'])
+        distance = float(data.get('distance', MAP_TRIPS_DEFAULT_DISTANCE))
+        if not 0 < distance <= MAP_TRIPS_MAX_DISTANCE:
+            raise ValueError()
+        return search_query.geo_distance_filter('source', lat, lng, distance), (lat, lng)
+    return search_query.geo_bounding_box_filter('source', float(data['north']), float(data['west']),
+                                                float(data['south']), float(data['east'])), None
+
+
+def get_map_trip_json(trip):
+    return {
+        'id': trip['id'],
+        'source': trip['source'],
+        'destination': trip['destination'],
+        'start_estimation': trip['start_estimation'],
+        'end_estimation': trip['end_estimation'],
+        'seats_left': trip['seats_left'],
+        'url': reverse('trip:trip', kwargs={'pk': trip['id']}),
+    }
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class TripConfig(AppConfig):
     name = 'trip'
+
+    def ready(self):
+        import trip.signals  # noqa
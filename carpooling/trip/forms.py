@@ -1,11 +1,13 @@
+import numpy as np
 from dateutil.parser import parse
 from django import forms
 from django.contrib.gis.geos import Point
 from django.db.transaction import atomic
 
 from account.models import Mail
-from trip.models import Trip, TripRequest, Companionship
-from trip.utils import get_trip_score
+from trip.matching import get_automatic_join_candidates
+from trip.models import Trip, TripRequest, Companionship, AutomaticJoinRequest
+from trip.utils import get_trips_scores
 
 
 class TripMapForm(forms.Form):
@@ -129,32 +131,26 @@ class AutomaticJoinTripForm(TripMapForm):
         self.trip_score_threshold = trip_score_threshold
 
     def join_a_trip_automatically(self):
-        trips = Trip.get_accessible_trips_for(self.user).filter(people_can_join_automatically=True,
-                                                                status=Trip.WAITING_STATUS)
-
         source, destination = self.cleaned_data['source'], self.cleaned_data['destination']
-        trips = sorted(trips, key=lambda trip: (get_trip_score(trip, source, destination)))
-        trips = filter(lambda trip: self.__is_ok_to_join(trip), trips)
-        for trip in trips:
-            if self.__join_if_trip_is_not_full(trip):
+        start_estimation, end_estimation = self.cleaned_data['start_estimation'], self.cleaned_data['end_estimation']
+        trips = list(get_automatic_join_candidates(self.user, source, destination, start_estimation, end_estimation))
+        scores = get_trips_scores(trips, source, destination)
+        for index in np.argsort(scores, kind='stable'):
+            trip = trips[index]
+            if scores[index] < self.trip_score_threshold and self.__join_if_trip_is_not_full(trip):
                 return trip
         return None
 
-    def __is_ok_to_join(self, trip):
-        return self.__is_score_under_threshold(trip) and self.__time_has_conflict(trip)
-
-    def __is_score_under_threshold(self, trip):
-        source, destination = self.cleaned_data['source'], self.cleaned_data['destination']
-        return get_trip_score(trip, source, destination) < self.trip_score_threshold
-
-    def __time_has_conflict(self, trip):
-        start_estimation, end_estimation = self.cleaned_data['start_estimation'], self.cleaned_data['end_estimation']
-        return start_estimation < trip.end_estimation and end_estimation > trip.start_estimation
+    def queue_automatic_join_request(self):
+        return AutomaticJoinRequest.objects.create(
+            member=self.user, source=self.cleaned_data['source'], destination=self.cleaned_data['destination'],
+            start_estimation=self.cleaned_data['start_estimation'], end_estimation=self.cleaned_data['end_estimation'])
 
     @atomic
     def __join_if_trip_is_not_full(self, trip):
         source, destination = self.cleaned_data['source'], self.cleaned_data['destination']
-        if trip.capacity > trip.passengers.count():
+        trip = Trip.lock(trip.id, skip_locked=True)
+        if trip is not None and trip.status == Trip.WAITING_STATUS and not trip.is_full():
             Companionship.objects.create(trip=trip, member=self.user, source=source, destination=destination)
             return True
         return False
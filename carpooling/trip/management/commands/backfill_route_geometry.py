@@ -0,0 +1,49 @@
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from trip.models import Trip, Companionship, TripRequest, AutomaticJoinRequest, Route
+from trip.utils import project_to_meters
+
+
+class Command(BaseCommand):
+    help = 'Computes the denormalized route geometry of existing trips, companionships and trip requests. All rows ' \
+           'of a model are recomputed when its stored projection was made around another SCORING_ORIGIN.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--all', action='store_true', help='Recompute rows whose geometry is already filled')
+
+    def handle(self, *args, **options):
+        for model in (Trip, Companionship, TripRequest, AutomaticJoinRequest):
+            recompute_all = options['all']
+            if not recompute_all and self.is_projection_stale(model):
+                self.stdout.write(self.style.WARNING(
+                    '{} projections were computed around another SCORING_ORIGIN, recomputing all rows'.format(
+                        model.__name__)))
+                recompute_all = True
+            count = self.backfill(model, options['batch_size'], recompute_all)
+            self.stdout.write(self.style.SUCCESS('{} {} rows updated'.format(count, model.__name__)))
+
+    @staticmethod
+    def is_projection_stale(model):
+        """
+        Whether the projected source of a row differs from its projection around the current SCORING_ORIGIN.
+        """
+        route = model.objects.filter(projected_source_x__isnull=False).only('source', *Route.ROUTE_FIELDS).first()
+        return route is not None and \
+            not np.allclose(route.get_projected_source(), project_to_meters(route.source.coords), atol=0.01)
+
+    @staticmethod
+    def backfill(model, batch_size, recompute_all):
+        query_set = model.objects.only('source', 'destination', *Route.ROUTE_FIELDS)
+        if not recompute_all:
+            query_set = query_set.filter(length__isnull=True)
+        count, batch = 0, []
+        for route in query_set.iterator(chunk_size=batch_size):
+            route.update_route_geometry()
+            batch.append(route)
+            if len(batch) == batch_size:
+                model.objects.bulk_update(batch, Route.ROUTE_FIELDS)
+                count, batch = count + len(batch), []
+        model.objects.bulk_update(batch, Route.ROUTE_FIELDS)
+        return count + len(batch)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from trip.matching import match_automatic_join_requests
+
+
+class Command(BaseCommand):
+    help = 'Assigns the pending automatic join requests to trips in one batch'
+
+    def handle(self, *args, **options):
+        stats = match_automatic_join_requests()
+        self.stdout.write(self.style.SUCCESS(
+            '{matches} of {requests} requests matched with a total detour of {total_detour:.1f}, '
+            'greedy matching would have matched {greedy_matches} with {greedy_total_detour:.1f}'.format(**stats)))
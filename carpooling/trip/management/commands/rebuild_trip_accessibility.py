@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from trip.accessibility import refresh_trip_accessibility
+from trip.models import TripAccessibility
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the materialized accessibility of all trips'
+
+    def handle(self, *args, **options):
+        refresh_trip_accessibility()
+        self.stdout.write(self.style.SUCCESS(
+            '{} trip accessibilities rebuilt'.format(TripAccessibility.objects.count())))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from trip.models import Trip
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the taken seats of trips from their companionships'
+
+    def handle(self, *args, **options):
+        repaired = Trip.repair_seats_taken()
+        self.stdout.write(self.style.SUCCESS('{} trips repaired'.format(repaired)))
@@ -0,0 +1,188 @@
+import logging
+import time
+
+import numpy as np
+from django.db.models import F
+from django.db.transaction import atomic
+from django.utils import timezone
+
+from carpooling.settings.base import TRIP_SCORE_IN_METERS, TRIP_SCORE_THRESHOLD_METERS, TRIP_SCORE_THRESHOLD_DEGREES
+from trip.models import Trip, Companionship, AutomaticJoinRequest
+from trip.spatial_index import filter_nearby_trips
+from trip.utils import get_trips_scores
+
+log = logging.getLogger(__name__)
+
+TRIP_SCORE_THRESHOLD = TRIP_SCORE_THRESHOLD_METERS if TRIP_SCORE_IN_METERS else TRIP_SCORE_THRESHOLD_DEGREES
+
+
+def get_automatic_join_candidates(user, source, destination, start_estimation, end_estimation):
+    trips = Trip.get_accessible_trips_for(user).filter(
+        people_can_join_automatically=True, seats_taken__lt=F('capacity'),
+        time_window__overlap=Trip.get_time_range(start_estimation, end_estimation))
+    return filter_nearby_trips(trips, source, destination)
+
+
+def solve_assignment(costs):
+    """
+    Hungarian algorithm with potentials. Assigns each row of the cost matrix to a distinct column so that the total
+    cost is minimal, the matrix must not have more rows than columns. Returns the column of each row.
+    """
+    rows, columns = costs.shape
+    row_potentials, column_potentials = np.zeros(rows + 1), np.zeros(columns + 1)
+    column_owners = np.zeros(columns + 1, dtype=int)  # 1-based row assigned to each column, 0 for free columns
+    previous_columns = np.zeros(columns + 1, dtype=int)
+    for row in range(1, rows + 1):
+        column_owners[0] = row
+        current_column = 0
+        min_slacks = np.full(columns + 1, np.inf)
+        used = np.zeros(columns + 1, dtype=bool)
+        while column_owners[current_column] != 0:
+            used[current_column] = True
+            current_row = column_owners[current_column]
+            free = ~used
+            free[0] = False
+            slacks = np.full(columns + 1, np.inf)
+            slacks[1:] = costs[current_row - 1] - row_potentials[current_row] - column_potentials[1:]
+            improved = free & (slacks < min_slacks)
+            min_slacks[improved] = slacks[improved]
+            previous_columns[improved] = current_column
+            candidate_slacks = np.where(free, min_slacks, np.inf)
+            next_column = int(np.argmin(candidate_slacks))
+            delta = candidate_slacks[next_column]
+            row_potentials[column_owners[used]] += delta
+            column_potentials[used] -= delta
+            min_slacks[free] -= delta
+            current_column = next_column
+        while current_column != 0:
+            previous_column = previous_columns[current_column]
+            column_owners[current_column] = column_owners[previous_column]
+            current_column = previous_column
+    assignment = np.full(rows, -1, dtype=int)
+    for column in range(1, columns + 1):
+        if column_owners[column] != 0:
+            assignment[column_owners[column] - 1] = column - 1
+    return assignment
+
+
+def get_optimal_matches(costs, capacities):
+    """
+    Matches requests (rows) to trips (columns) so that the number of matches is maximal and, among those, the total
+    cost is minimal, without exceeding the capacity of any trip. Pairs with an infinite cost can not be matched.
+    Each trip is expanded into one column per seat and every request gets an extra column meaning "not matched",
+    whose cost is higher than any possible sum of finite costs. Returns (request index, trip index) pairs.
+    """
+    requests_count = costs.shape[0]
+    if requests_count == 0:
+        return []
+    slot_trips = np.repeat(np.arange(costs.shape[1]), np.minimum(capacities, requests_count))
+    slot_costs = costs[:, slot_trips]
+    feasible = np.isfinite(slot_costs)
+    unmatched_cost = (np.abs(slot_costs[feasible]).sum() + 1) * 2
+    slot_costs = np.where(feasible, slot_costs, unmatched_cost * 2)
+    slot_costs = np.hstack([slot_costs, np.full((requests_count, requests_count), unmatched_cost)])
+    assignment = solve_assignment(slot_costs)
+    return [(request_index, int(slot_trips[slot])) for request_index, slot in enumerate(assignment)
+            if slot < len(slot_trips) and feasible[request_index, slot]]
+
+
+def get_greedy_matches(costs, capacities):
+    """
+    Matches requests in order, each one to its best trip that still has a seat, like immediate automatic joins do.
+    """
+    seats_left = np.array(capacities)
+    matches = []
+    for request_index, request_costs in enumerate(costs):
+        request_costs = np.where(seats_left > 0, request_costs, np.inf)
+        if request_costs.size and np.isfinite(request_costs.min()):
+            trip_index = int(np.argmin(request_costs))
+            seats_left[trip_index] -= 1
+            matches.append((request_index, trip_index))
+    return matches
+
+
+def get_total_cost(costs, matches):
+    return float(sum(costs[request_index, trip_index] for request_index, trip_index in matches))
+
+
+def build_costs(requests, trip_score_threshold=TRIP_SCORE_THRESHOLD):
+    """
+    Returns the candidate trips of the requests and the matrix of their scores, infinite where a trip is not a
+    candidate of a request or its score is not below the threshold.
+    """
+    trips = {}
+    requests_scores = []
+    for request in requests:
+        candidates = list(get_automatic_join_candidates(request.member, request.source, request.destination,
+                                                        request.start_estimation, request.end_estimation))
+        scores = get_trips_scores(candidates, request.source, request.destination)
+        requests_scores.append({trip.id: score for trip, score in zip(candidates, scores)
+                                if score < trip_score_threshold})
+        trips.update((trip.id, trip) for trip in candidates)
+    trips = list(trips.values())
+    costs = np.full((len(requests), len(trips)), np.inf)
+    for request_index, scores in enumerate(requests_scores):
+        for trip_index, trip in enumerate(trips):
+            costs[request_index, trip_index] = scores.get(trip.id, np.inf)
+    return trips, costs
+
+
+def match_automatic_join_requests(trip_score_threshold=TRIP_SCORE_THRESHOLD):
+    """
+    Assigns the pending automatic join requests to trips all at once and joins the matched members in a single
+    transaction. Requests that are not matched stay pending for the next batch until their end estimation passes.
+    Returns the statistics of the batch, along with the ones the greedy one by one assignment would have achieved.
+    """
+    start = time.perf_counter()
+    expired = AutomaticJoinRequest.objects.filter(status=AutomaticJoinRequest.PENDING_STATUS,
+                                                  end_estimation__lt=timezone.now()).update(
+        status=AutomaticJoinRequest.EXPIRED_STATUS)
+    requests = list(AutomaticJoinRequest.objects.filter(status=AutomaticJoinRequest.PENDING_STATUS).select_related(
+        'member').order_by('creation_time', 'id'))
+    trips, costs = build_costs(requests, trip_score_threshold)
+    capacities = np.array([trip.seats_left for trip in trips], dtype=int)
+    matches = get_optimal_matches(costs, capacities)
+    greedy_matches = get_greedy_matches(costs, capacities)
+    joined = join_matches([(requests[request_index], trips[trip_index]) for request_index, trip_index in matches])
+    stats = {
+        'requests': len(requests),
+        'expired': expired,
+        'matches': len(matches),
+        'joined': joined,
+        'total_detour': get_total_cost(costs, matches),
+        'greedy_matches': len(greedy_matches),
+        'greedy_total_detour': get_total_cost(costs, greedy_matches),
+        'seconds': time.perf_counter() - start,
+    }
+    log.info("Automatic join batch: {}".format(stats))
+    return stats
+
+
+@atomic
+def join_matches(matches):
+    """
+    Locks the matched requests and trips and joins the members of the requests to them, skipping the requests that
+    another batch is handling or has handled, and the trips that were closed or filled in the meantime. Returns the
+    number of joined members.
+    """
+    pending_request_ids = set(AutomaticJoinRequest.objects.select_for_update(skip_locked=True).filter(
+        id__in={request.id for request, _ in matches}, status=AutomaticJoinRequest.PENDING_STATUS).values_list(
+        'id', flat=True))
+    locked_trips = {trip.id: trip for trip in Trip.objects.select_for_update().filter(
+        id__in={trip.id for request, trip in matches if request.id in pending_request_ids}).order_by('id')}
+    joined = 0
+    for request, trip in matches:
+        if request.id not in pending_request_ids:
+            continue
+        trip = locked_trips[trip.id]
+        if trip.status != Trip.WAITING_STATUS or trip.is_full() or \
+                Companionship.objects.filter(trip=trip, member_id=request.member_id).exists():
+            continue
+        Companionship.objects.create(trip=trip, member_id=request.member_id, source=request.source,
+                                     destination=request.destination)
+        trip.seats_taken += 1
+        request.trip = trip
+        request.status = AutomaticJoinRequest.MATCHED_STATUS
+        request.save(update_fields=['trip', 'status'])
+        joined += 1
+    return joined
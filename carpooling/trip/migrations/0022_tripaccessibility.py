@@ -0,0 +1,44 @@
+# Generated by Django 2.2.2 on 2026-10-18 17:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_trip_accessibilities(apps, schema_editor):
+    Trip = apps.get_model('trip', 'Trip')
+    TripGroups = apps.get_model('trip', 'TripGroups')
+    Companionship = apps.get_model('trip', 'Companionship')
+    Membership = apps.get_model('group', 'Membership')
+    TripAccessibility = apps.get_model('trip', 'TripAccessibility')
+    pairs = set(Trip.objects.filter(car_provider__isnull=False).values_list('car_provider_id', 'id'))
+    pairs.update(Companionship.objects.values_list('member_id', 'trip_id'))
+    for group_id, trip_id in TripGroups.objects.values_list('group_id', 'trip_id'):
+        pairs.update((member_id, trip_id) for member_id in
+                     Membership.objects.filter(group_id=group_id).values_list('member_id', flat=True))
+    TripAccessibility.objects.bulk_create(
+        [TripAccessibility(member_id=member_id, trip_id=trip_id) for member_id, trip_id in pairs], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('group', '0004_auto_20190731_0803'),
+        ('trip', '0021_auto_20190901_1706'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripAccessibility',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trip_accessibilities', to=settings.AUTH_USER_MODEL)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='accessibilities', to='trip.Trip')),
+            ],
+            options={
+                'unique_together': {('member', 'trip')},
+            },
+        ),
+        migrations.RunPython(fill_trip_accessibilities, migrations.RunPython.noop),
+    ]
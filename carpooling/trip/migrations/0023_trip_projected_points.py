@@ -0,0 +1,54 @@
+# Generated by Django 2.2.2 on 2026-10-18 17:17
+
+from math import radians, cos
+
+from django.conf import settings
+from django.db import migrations, models
+
+EARTH_RADIUS = 6371008.8
+
+
+def project_to_meters(point):
+    origin_lat, origin_lng = settings.SCORING_ORIGIN
+    return EARTH_RADIUS * radians(point.x - origin_lat), \
+        EARTH_RADIUS * radians(point.y - origin_lng) * cos(radians(origin_lat))
+
+
+def fill_projected_points(apps, schema_editor):
+    Trip = apps.get_model('trip', 'Trip')
+    for trip in Trip.objects.only('source', 'destination').iterator():
+        trip.projected_source_x, trip.projected_source_y = project_to_meters(trip.source)
+        trip.projected_destination_x, trip.projected_destination_y = project_to_meters(trip.destination)
+        trip.save(update_fields=['projected_source_x', 'projected_source_y', 'projected_destination_x',
+                                 'projected_destination_y'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trip', '0022_tripaccessibility'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='projected_destination_x',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='projected_destination_y',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='projected_source_x',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='projected_source_y',
+            field=models.FloatField(null=True),
+        ),
+        migrations.RunPython(fill_projected_points, migrations.RunPython.noop),
+    ]
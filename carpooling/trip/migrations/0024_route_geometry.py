@@ -0,0 +1,129 @@
+# Generated by Django 2.2.2 on 2026-10-18 17:18
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trip', '0023_trip_projected_points'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='companionship',
+            name='bounding_box',
+            field=django.contrib.gis.db.models.fields.PolygonField(null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='companionship',
+            name='direction_x',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='companionship',
+            name='direction_y',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='companionship',
+            name='heading',
+            field=models.FloatField(db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='companionship',
+            name='length',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='companionship',
+            name='projected_destination_x',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='companionship',
+            name='projected_destination_y',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='companionship',
+            name='projected_source_x',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='companionship',
+            name='projected_source_y',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='bounding_box',
+            field=django.contrib.gis.db.models.fields.PolygonField(null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='direction_x',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='direction_y',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='heading',
+            field=models.FloatField(db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='length',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='triprequest',
+            name='bounding_box',
+            field=django.contrib.gis.db.models.fields.PolygonField(null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='triprequest',
+            name='direction_x',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='triprequest',
+            name='direction_y',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='triprequest',
+            name='heading',
+            field=models.FloatField(db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='triprequest',
+            name='length',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='triprequest',
+            name='projected_destination_x',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='triprequest',
+            name='projected_destination_y',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='triprequest',
+            name='projected_source_x',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='triprequest',
+            name='projected_source_y',
+            field=models.FloatField(null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.2 on 2026-10-18 17:19
+
+import django.contrib.postgres.fields.ranges
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trip', '0024_route_geometry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='time_window',
+            field=django.contrib.postgres.fields.ranges.DateTimeRangeField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['time_window'], name='trip_trip_time_wi_9b8764_gist'),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['status', 'start_estimation'], name='trip_trip_status_3865bc_idx'),
+        ),
+        migrations.RunSQL(
+            "UPDATE trip_trip SET time_window = tstzrange(start_estimation, end_estimation, '[]') "
+            "WHERE start_estimation <= end_estimation",
+            migrations.RunSQL.noop,
+        ),
+    ]
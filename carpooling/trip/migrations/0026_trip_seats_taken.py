@@ -0,0 +1,23 @@
+# Generated by Django 2.2.2 on 2026-10-18 17:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trip', '0025_trip_time_window'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='seats_taken',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.RunSQL(
+            "UPDATE trip_trip SET seats_taken = "
+            "(SELECT COUNT(*) FROM trip_companionship WHERE trip_companionship.trip_id = trip_trip.id)",
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 2.2.2 on 2026-10-18 17:23
+
+from django.conf import settings
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('trip', '0026_trip_seats_taken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AutomaticJoinRequest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('projected_source_x', models.FloatField(null=True)),
+                ('projected_source_y', models.FloatField(null=True)),
+                ('projected_destination_x', models.FloatField(null=True)),
+                ('projected_destination_y', models.FloatField(null=True)),
+                ('direction_x', models.FloatField(null=True)),
+                ('direction_y', models.FloatField(null=True)),
+                ('length', models.FloatField(null=True)),
+                ('heading', models.FloatField(db_index=True, null=True)),
+                ('bounding_box', django.contrib.gis.db.models.fields.PolygonField(null=True, srid=4326)),
+                ('source', django.contrib.gis.db.models.fields.PointField(srid=4326)),
+                ('destination', django.contrib.gis.db.models.fields.PointField(srid=4326)),
+                ('start_estimation', models.DateTimeField()),
+                ('end_estimation', models.DateTimeField()),
+                ('creation_time', models.DateTimeField(auto_now_add=True)),
+                ('status', models.CharField(choices=[('p', 'pending'), ('m', 'matched'), ('e', 'expired')], db_index=True, default='p', max_length=1)),
+                ('member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='automatic_join_requests', to=settings.AUTH_USER_MODEL)),
+                ('trip', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='automatic_join_requests', to='trip.Trip')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
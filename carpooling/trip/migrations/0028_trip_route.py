@@ -0,0 +1,19 @@
+# Generated by Django 2.2.2 on 2026-10-18 17:24
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trip', '0027_automaticjoinrequest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='route',
+            field=django.contrib.gis.db.models.fields.LineStringField(null=True, srid=4326),
+        ),
+    ]
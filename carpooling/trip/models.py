@@ -1,13 +1,78 @@
+from math import hypot
+
 from django.contrib.gis.db import models as gis_models
+from django.contrib.gis.geos import Polygon
+from django.contrib.postgres.fields import DateTimeRangeField
+from django.contrib.postgres.indexes import GistIndex
 from django.core.validators import MaxValueValidator
 from django.db import models
-from django.db.models import Q
+from django.db.models import Q, F, OuterRef, Subquery, Count
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from psycopg2.extras import DateTimeTZRange
 
 from account.models import Member
 from group.models import Group
+from trip.utils import project_to_meters, get_heading
+
+
+def make_aware(time):
+    return timezone.make_aware(time) if timezone.is_naive(time) else time
+
+
+class Route(models.Model):
+    """
+    Denormalized geometry of a source to destination segment, computed on save: the end points projected to meters,
+    the direction and length of the segment in meters, its heading and its bounding box.
+    """
+    projected_source_x = models.FloatField(null=True)
+    projected_source_y = models.FloatField(null=True)
+    projected_destination_x = models.FloatField(null=True)
+    projected_destination_y = models.FloatField(null=True)
+    direction_x = models.FloatField(null=True)
+    direction_y = models.FloatField(null=True)
+    length = models.FloatField(null=True)
+    heading = models.FloatField(null=True, db_index=True)
+    bounding_box = gis_models.PolygonField(null=True)
+
+    ROUTE_FIELDS = ['projected_source_x', 'projected_source_y', 'projected_destination_x', 'projected_destination_y',
+                    'direction_x', 'direction_y', 'length', 'heading', 'bounding_box']
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        self.update_route_geometry()
+        super(Route, self).save(*args, **kwargs)
+
+    def update_route_geometry(self):
+        if self.source is None or self.destination is None:
+            return
+        (self.projected_source_x, self.projected_source_y), \
+            (self.projected_destination_x, self.projected_destination_y) = \
+            project_to_meters([self.source.coords, self.destination.coords])
+        self.direction_x = self.projected_destination_x - self.projected_source_x
+        self.direction_y = self.projected_destination_y - self.projected_source_y
+        self.length = hypot(self.direction_x, self.direction_y)
+        self.heading = get_heading(self.direction_x, self.direction_y) if self.length > 0 else None
+        self.bounding_box = Polygon.from_bbox((min(self.source.x, self.destination.x),
+                                               min(self.source.y, self.destination.y),
+                                               max(self.source.x, self.destination.x),
+                                               max(self.source.y, self.destination.y)))
+        self.bounding_box.srid = self.source.srid
+
+    def get_projected_source(self):
+        if self.projected_source_x is None:
+            return project_to_meters(self.source.coords)
+        return self.projected_source_x, self.projected_source_y
+
+    def get_projected_destination(self):
+        if self.projected_destination_x is None:
+            return project_to_meters(self.destination.coords)
+        return self.projected_destination_x, self.projected_destination_y
 
 
-class Trip(models.Model):
+class Trip(Route):
     CANCELED_STATUS = 'ca'
     WAITING_STATUS = 'wa'
     CLOSED_STATUS = 'cl'
@@ -22,6 +87,7 @@ class Trip(models.Model):
     ]
     source = gis_models.PointField()
     destination = gis_models.PointField()
+    route = gis_models.LineStringField(null=True)
     is_private = models.BooleanField(default=False)
     people_can_join_automatically = models.BooleanField(default=False)
     passengers = models.ManyToManyField(Member, through="Companionship", related_name='partaking_trips')
@@ -33,17 +99,83 @@ class Trip(models.Model):
     end_estimation = models.DateTimeField()
     trip_description = models.CharField(max_length=200, null=True)
     playlist_id = models.CharField(max_length=22, null=True)
+    time_window = DateTimeRangeField(null=True)
+    seats_taken = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            GistIndex(fields=['time_window']),
+            models.Index(fields=['status', 'start_estimation']),
+        ]
+
+    def save(self, *args, **kwargs):
+        """
+        Saving a loaded trip writes every field but seats_taken, which is only changed by atomic updates from
+        companionship signals. As for any save with update_fields, saving a trip whose row was deleted meanwhile
+        raises a DatabaseError instead of inserting it again, unless force_insert is given.
+        """
+        self.update_time_window()
+        if not self._state.adding and not args and kwargs.get('update_fields') is None and \
+                not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name != 'seats_taken']
+        super(Trip, self).save(*args, **kwargs)
+
+    def update_route_geometry(self):
+        super(Trip, self).update_route_geometry()
+        if self.route is not None:
+            self.bounding_box = Polygon.from_bbox(self.route.extent)
+
+    @property
+    def seats_left(self):
+        return max(self.capacity - self.seats_taken, 0)
+
+    def is_full(self):
+        return self.seats_taken >= self.capacity
+
+    @classmethod
+    def update_seats_taken(cls, trip_id, change):
+        cls.objects.filter(id=trip_id, seats_taken__gte=-change).update(seats_taken=F('seats_taken') + change)
+
+    @classmethod
+    def repair_seats_taken(cls):
+        seats_taken = Companionship.objects.filter(trip=OuterRef('id')).values('trip').annotate(
+            count=Count('id')).values('count')
+        actual_seats_taken = Coalesce(Subquery(seats_taken, output_field=models.IntegerField()), 0)
+        return cls.objects.exclude(seats_taken=actual_seats_taken).update(seats_taken=actual_seats_taken)
+
+    def update_time_window(self):
+        if self.start_estimation is not None and self.end_estimation is not None and \
+                self.start_estimation <= self.end_estimation:
+            self.time_window = DateTimeTZRange(make_aware(self.start_estimation), make_aware(self.end_estimation), '[]')
+        else:
+            self.time_window = None
+
+    @classmethod
+    def get_time_range(cls, start_time, end_time):
+        return DateTimeTZRange(make_aware(start_time), make_aware(end_time), '()')
 
     @classmethod
     def get_accessible_trips_for(cls, user):
-        return cls.objects.filter(Q(is_private=False) | Q(groups__membership__member=user) | Q(car_provider=user) | Q(
-            companionship__member=user))
+        return cls.objects.filter(Q(is_private=False) | Q(
+            id__in=TripAccessibility.objects.filter(member_id=user.id).values('trip_id')))
+
+    def is_accessible_for(self, user):
+        return not self.is_private or TripAccessibility.objects.filter(member_id=user.id, trip=self).exists()
+
+    @classmethod
+    def lock(cls, trip_id, skip_locked=False):
+        """
+        Locks the trip row until the end of the current transaction. With skip_locked, returns None instead of waiting
+        when another transaction holds the lock.
+        """
+        return cls.objects.select_for_update(skip_locked=skip_locked).filter(id=trip_id).first()
 
     class TripIsFullException(Exception):
         pass
 
 
-class Companionship(models.Model):
+class Companionship(Route):
     member = models.ForeignKey(Member, on_delete=models.CASCADE)
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE)
     source = gis_models.PointField()
@@ -61,6 +193,18 @@ class TripGroups(models.Model):
         unique_together = ['group', 'trip']
 
 
+class TripAccessibility(models.Model):
+    """
+    Materialized (member, trip) pairs for members who can see a trip regardless of its privacy, because they are its
+    car provider, one of its passengers or a member of one of its groups. Kept up to date by trip.accessibility.
+    """
+    member = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='trip_accessibilities')
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='accessibilities')
+
+    class Meta:
+        unique_together = ['member', 'trip']
+
+
 class TripRequestSet(models.Model):
     title = models.CharField(max_length=50, null=True)
     applicant = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='trip_request_sets')
@@ -75,7 +219,7 @@ class TripRequestSet(models.Model):
         return str(self.id) + '' + self.title
 
 
-class TripRequest(models.Model):
+class TripRequest(Route):
     PENDING_STATUS = 'p'
     ACCEPTED_STATUS = 'a'
     CANCELED_STATUS = 'c'
@@ -98,6 +242,32 @@ class TripRequest(models.Model):
         return self.status == TripRequest.PENDING_STATUS
 
 
+class AutomaticJoinRequest(Route):
+    """
+    An automatic join request waiting to be assigned to a trip by the batch matching job of trip.matching.
+    """
+    PENDING_STATUS = 'p'
+    MATCHED_STATUS = 'm'
+    EXPIRED_STATUS = 'e'
+
+    STATUS_CHOICES = [
+        (PENDING_STATUS, 'pending'),
+        (MATCHED_STATUS, 'matched'),
+        (EXPIRED_STATUS, 'expired')
+    ]
+    member = models.ForeignKey(Member, on_delete=models.CASCADE, related_name='automatic_join_requests')
+    trip = models.ForeignKey(Trip, on_delete=models.SET_NULL, related_name='automatic_join_requests', null=True)
+    source = gis_models.PointField()
+    destination = gis_models.PointField()
+    start_estimation = models.DateTimeField()
+    end_estimation = models.DateTimeField()
+    creation_time = models.DateTimeField(auto_now_add=True)
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default=PENDING_STATUS, db_index=True)
+
+    def is_pending(self):
+        return self.status == AutomaticJoinRequest.PENDING_STATUS
+
+
 class Vote(models.Model):
     receiver = models.ForeignKey(Member, on_delete=models.CASCADE, related_name="received_votes")
     sender = models.ForeignKey(Member, on_delete=models.SET_NULL, related_name="sent_votes", null=True)
@@ -0,0 +1,52 @@
+from django.core.cache import caches
+
+from carpooling.settings.base import NEARBY_GROUPS_CACHE
+from group.models import Group, Membership
+from root.cache import CacheStats, get_versions, increment_versions
+
+nearby_groups_cache_stats = CacheStats('nearby_groups', NEARBY_GROUPS_CACHE)
+
+
+class NearbyGroupsCache:
+    """
+    Caches the ids of the groups of a user which are near a trip. Entries depend on a version of the user, which is
+    incremented when the user joins or leaves a group or when one of the user's groups is saved.
+    """
+
+    def __init__(self, cache_alias=NEARBY_GROUPS_CACHE):
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def get_nearby_groups(self, user, trip, find_nearby_groups):
+        """
+        Returns the cached groups, or finds them with find_nearby_groups(user, trip).
+        """
+        key = self.get_key(user.id, trip.id)
+        group_ids = self.cache.get(key)
+        if group_ids is None:
+            nearby_groups_cache_stats.miss()
+            groups = list(find_nearby_groups(user, trip))
+            self.cache.set(key, [group.id for group in groups])
+            return groups
+        nearby_groups_cache_stats.hit()
+        return list(Group.objects.filter(id__in=group_ids))
+
+    def invalidate_members(self, member_ids):
+        increment_versions(self.cache, [get_version_key(member_id) for member_id in member_ids])
+
+    def invalidate_group(self, group_id):
+        self.invalidate_members(Membership.objects.filter(group_id=group_id).values_list('member_id', flat=True))
+
+    def get_key(self, member_id, trip_id):
+        version, = get_versions(self.cache, [get_version_key(member_id)])
+        return 'nearby_groups:{}:{}:{}'.format(member_id, trip_id, version)
+
+
+def get_version_key(member_id):
+    return 'nearby_groups:version:{}'.format(member_id)
+
+
+nearby_groups_cache = NearbyGroupsCache()
@@ -0,0 +1,122 @@
+import hashlib
+from datetime import datetime, timedelta
+from math import floor, ceil, hypot
+
+from django.core.cache import caches
+
+from carpooling.settings.base import TRIP_SEARCH_CACHE, TRIP_SEARCH_CACHE_ENABLED, TRIP_SEARCH_CACHE_CELL_SIZE, \
+    TRIP_SEARCH_CACHE_TIME_BUCKET, TRIP_SEARCH_CACHE_VERSION_CELL_SIZE, TRIP_SEARCH_RADIUS, TRIP_ROUTE_BUFFER
+from root.cache import CacheStats, get_versions, increment_versions
+
+# Trips matching a search have their end points closer than the search radius to the searched points, or their route
+# closer than the route buffer, so they cross the version cells within this distance of the searched points
+MATCH_DISTANCE = max(TRIP_SEARCH_RADIUS, TRIP_ROUTE_BUFFER)
+
+trip_search_cache_stats = CacheStats('trip_search', TRIP_SEARCH_CACHE)
+
+
+class TripSearchCache:
+    """
+    Caches the ranked ids of the trips matching a search, whatever their privacy, under the cells of the searched
+    points and the buckets of the searched time window. Searches in the same cells share the ranking of the first one.
+    Every entry also depends on the versions of the coarse cells within matching distance of the searched points,
+    which are incremented when a trip whose end points or route cross them is saved or deleted.
+    """
+
+    def __init__(self, cache_alias=TRIP_SEARCH_CACHE, enabled=TRIP_SEARCH_CACHE_ENABLED):
+        self.cache_alias = cache_alias
+        self.enabled = enabled
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def get_ranked_trip_ids(self, source, destination, time_range, rank_trips):
+        """
+        Returns the cached ranking of the search, or computes it with rank_trips(source, destination, time_range)
+        called with the time range widened to its buckets.
+        """
+        time_range = get_time_buckets_range(time_range)
+        if not self.enabled:
+            return rank_trips(source, destination, time_range)
+        key = self.get_key(source, destination, time_range)
+        ranked_trip_ids = self.cache.get(key)
+        if ranked_trip_ids is None:
+            trip_search_cache_stats.miss()
+            ranked_trip_ids = rank_trips(source, destination, time_range)
+            self.cache.set(key, ranked_trip_ids)
+        else:
+            trip_search_cache_stats.hit()
+        return ranked_trip_ids
+
+    def invalidate(self, trip):
+        cells = {get_cell(trip.source.coords, TRIP_SEARCH_CACHE_VERSION_CELL_SIZE),
+                 get_cell(trip.destination.coords, TRIP_SEARCH_CACHE_VERSION_CELL_SIZE)}
+        if trip.route is not None:
+            cells.update(get_route_cells(trip.route.coords, TRIP_SEARCH_CACHE_VERSION_CELL_SIZE))
+        increment_versions(self.cache, {get_version_key(cell) for cell in cells})
+
+    def get_key(self, source, destination, time_range):
+        version_keys = [get_version_key(cell) for point in (source, destination)
+                        for cell in get_cells_around(point.coords, MATCH_DISTANCE, TRIP_SEARCH_CACHE_VERSION_CELL_SIZE)]
+        versions = ','.join(str(version) for version in get_versions(self.cache, version_keys))
+        source_cell = get_cell(source.coords, TRIP_SEARCH_CACHE_CELL_SIZE)
+        destination_cell = get_cell(destination.coords, TRIP_SEARCH_CACHE_CELL_SIZE)
+        time_range = '' if time_range is None else '{}/{}'.format(*(time.isoformat() for time in time_range))
+        return 'trip_search:{}:{}:{}:{}:{}:{}'.format(*source_cell, *destination_cell, time_range,
+                                                       hashlib.md5(versions.encode()).hexdigest())
+
+
+def get_cell(point, cell_size):
+    return floor(point[0] / cell_size), floor(point[1] / cell_size)
+
+
+def get_cells_around(point, distance, cell_size):
+    """
+    The cells which have a point within distance of point.
+    """
+    rings = ceil(distance / cell_size)
+    center_x, center_y = get_cell(point, cell_size)
+    return [(x, y) for x in range(center_x - rings, center_x + rings + 1)
+            for y in range(center_y - rings, center_y + rings + 1)
+            if get_distance_to_cell(point, (x, y), cell_size) <= distance]
+
+
+def get_distance_to_cell(point, cell, cell_size):
+    dx = max(cell[0] * cell_size - point[0], 0, point[0] - (cell[0] + 1) * cell_size)
+    dy = max(cell[1] * cell_size - point[1], 0, point[1] - (cell[1] + 1) * cell_size)
+    return hypot(dx, dy)
+
+
+def get_route_cells(coords, cell_size):
+    """
+    The cells of points sampled every half cell along the route. A cell the route only clips is missed, but searches
+    near it also cover the cells of the samples around it, as the search radius exceeds the route buffer by more
+    than half a cell.
+    """
+    cells = {get_cell(coords[0], cell_size)}
+    for (start_x, start_y), (end_x, end_y) in zip(coords, coords[1:]):
+        steps = max(ceil(hypot(end_x - start_x, end_y - start_y) / (cell_size / 2)), 1)
+        cells.update(get_cell((start_x + (end_x - start_x) * step / steps, start_y + (end_y - start_y) * step / steps),
+                              cell_size) for step in range(1, steps + 1))
+    return cells
+
+
+def get_version_key(cell):
+    return 'trip_search:version:{}:{}'.format(*cell)
+
+
+def get_time_buckets_range(time_range):
+    """
+    Widens the time range to the buckets containing its start and its end.
+    """
+    if time_range is None:
+        return None
+    start_time, end_time = time_range
+    bucket = timedelta(seconds=TRIP_SEARCH_CACHE_TIME_BUCKET)
+    start_time -= (start_time - datetime(1970, 1, 1, tzinfo=start_time.tzinfo)) % bucket
+    end_time += (datetime(1970, 1, 1, tzinfo=end_time.tzinfo) - end_time) % bucket
+    return start_time, end_time
+
+
+trip_search_cache = TripSearchCache()
@@ -0,0 +1,110 @@
+import threading
+from collections import defaultdict
+
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.db.transaction import on_commit
+from django.dispatch import receiver
+
+from account.models import Member
+from group.models import Membership, Group
+from trip.accessibility import refresh_trip_accessibility
+from trip.models import Trip, TripGroups, Companionship
+from trip.nearby_groups_cache import nearby_groups_cache
+from trip.search_cache import trip_search_cache
+from trip.spatial_index import waiting_trips_index
+
+
+# The index is only changed once the change of the trip is committed, rolled back changes are not indexed
+@receiver(post_save, sender=Trip)
+def update_waiting_trips_index(sender, instance, **kwargs):
+    on_commit(lambda: waiting_trips_index.update(instance))
+
+
+@receiver(post_delete, sender=Trip)
+def remove_from_waiting_trips_index(sender, instance, **kwargs):
+    trip_id = instance.id
+    on_commit(lambda: waiting_trips_index.remove(trip_id))
+
+
+@receiver(post_save, sender=Trip)
+@receiver(post_delete, sender=Trip)
+def invalidate_trip_search_cache(sender, instance, **kwargs):
+    trip_search_cache.invalidate(instance)
+
+
+# Trips and members being deleted by this thread. Their accessibility rows are removed by the cascade, refreshing
+# the accessibility of their cascaded groups and companionships would insert rows referencing them again.
+deleting = threading.local()
+
+
+def get_deleting_ids(model):
+    if not hasattr(deleting, 'ids'):
+        deleting.ids = defaultdict(set)
+    return deleting.ids[model]
+
+
+@receiver(pre_delete, sender=Trip)
+@receiver(pre_delete, sender=Member)
+def mark_deleting(sender, instance, **kwargs):
+    get_deleting_ids(sender).add(instance.pk)
+
+
+@receiver(post_delete, sender=Trip)
+@receiver(post_delete, sender=Member)
+def unmark_deleting(sender, instance, **kwargs):
+    get_deleting_ids(sender).discard(instance.pk)
+
+
+@receiver(post_save, sender=Trip)
+def update_trip_accessibility(sender, instance, **kwargs):
+    refresh_trip_accessibility(trip_ids=[instance.id])
+
+
+@receiver(post_save, sender=TripGroups)
+@receiver(post_delete, sender=TripGroups)
+def update_group_trip_accessibility(sender, instance, **kwargs):
+    if instance.trip_id in get_deleting_ids(Trip):
+        return
+    refresh_trip_accessibility(trip_ids=[instance.trip_id])
+
+
+@receiver(post_save, sender=Companionship)
+@receiver(post_delete, sender=Companionship)
+def update_passenger_trip_accessibility(sender, instance, **kwargs):
+    if instance.trip_id in get_deleting_ids(Trip) or instance.member_id in get_deleting_ids(Member):
+        return
+    refresh_trip_accessibility(trip_ids=[instance.trip_id], member_ids=[instance.member_id])
+
+
+@receiver(post_save, sender=Membership)
+@receiver(post_delete, sender=Membership)
+def update_member_groups_trips_accessibility(sender, instance, **kwargs):
+    if instance.member_id in get_deleting_ids(Member):
+        return
+    trip_ids = list(TripGroups.objects.filter(group_id=instance.group_id).exclude(
+        trip_id__in=get_deleting_ids(Trip)).values_list('trip_id', flat=True))
+    if trip_ids:
+        refresh_trip_accessibility(trip_ids=trip_ids, member_ids=[instance.member_id])
+
+
+@receiver(post_save, sender=Companionship)
+def take_trip_seat(sender, instance, created, **kwargs):
+    if created:
+        Trip.update_seats_taken(instance.trip_id, 1)
+
+
+@receiver(post_delete, sender=Companionship)
+def free_trip_seat(sender, instance, **kwargs):
+    Trip.update_seats_taken(instance.trip_id, -1)
+
+
+@receiver(post_save, sender=Membership)
+@receiver(post_delete, sender=Membership)
+def invalidate_member_nearby_groups(sender, instance, **kwargs):
+    nearby_groups_cache.invalidate_members([instance.member_id])
+
+
+@receiver(post_save, sender=Group)
+def invalidate_group_nearby_groups(sender, instance, created, **kwargs):
+    if not created:
+        nearby_groups_cache.invalidate_group(instance.id)
@@ -0,0 +1,223 @@
+import logging
+import sys
+import threading
+import time
+from collections import defaultdict
+from math import floor, hypot
+
+import numpy as np
+from django.contrib.gis.db.models.functions import LineLocatePoint
+from django.contrib.gis.geos import Point
+from django.db.models import Q, F
+
+from carpooling.settings.base import TRIP_INDEX_CELL_SIZE, TRIP_INDEX_MAX_AGE, TRIP_SEARCH_RADIUS, \
+    TRIP_SPATIAL_INDEX_ENABLED, TRIP_ROUTE_BUFFER
+from trip.models import Trip
+from trip.utils import project_to_meters, get_heading, get_same_direction_heading_ranges
+
+log = logging.getLogger(__name__)
+
+ROUTE_SRID = Trip._meta.get_field('route').srid
+
+
+class WaitingTripsIndex:
+    """
+    Process-local grid index of waiting trips. Trips are bucketed by the cell of their source and the cell of their
+    destination, so a nearest-neighbour lookup only visits the cells around the searched points.
+    The index is kept up to date from trip signals of this process and rebuilt from the database when it gets older
+    than max_age, which bounds the staleness caused by changes made in other worker processes.
+    """
+
+    def __init__(self, cell_size=TRIP_INDEX_CELL_SIZE, max_age=TRIP_INDEX_MAX_AGE):
+        self.cell_size = cell_size
+        self.max_age = max_age
+        self.built_at = None
+        self.rebuild_time = None
+        self._lock = threading.RLock()
+        self._rebuild_lock = threading.Lock()
+        self._changes = None
+        self._trips = {}
+        self._source_cells = defaultdict(set)
+        self._destination_cells = defaultdict(set)
+
+    def rebuild(self):
+        with self._rebuild_lock:
+            self._rebuild()
+
+    def refresh(self):
+        """
+        Rebuilds the index if it is stale. Only one thread rebuilds it, the others keep reading the former grid, or
+        wait for the first one to be built.
+        """
+        if not self._rebuild_lock.acquire(blocking=self.built_at is None):
+            return
+        try:
+            if self.is_stale():
+                self._rebuild()
+        finally:
+            self._rebuild_lock.release()
+
+    def _rebuild(self):
+        """
+        Builds the new grid without holding the lock, so that readers are not blocked by the database query, then
+        swaps it in and replays the changes this process made to trips meanwhile.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            self._changes = []
+        try:
+            grid = WaitingTripsIndex(self.cell_size, self.max_age)
+            trips = Trip.objects.filter(status=Trip.WAITING_STATUS).values_list('id', 'source', 'destination')
+            for trip_id, source, destination in trips.iterator():
+                grid._add(trip_id, source.coords, destination.coords)
+            with self._lock:
+                self._trips, self._source_cells, self._destination_cells = \
+                    grid._trips, grid._source_cells, grid._destination_cells
+                for trip_id, points in self._changes:
+                    self._remove(trip_id)
+                    if points is not None:
+                        self._add(trip_id, *points)
+                self.built_at = time.monotonic()
+                self.rebuild_time = time.perf_counter() - start
+        finally:
+            with self._lock:
+                self._changes = None
+        log.info("Waiting trips index rebuilt: {}".format(self.get_stats()))
+
+    def reset(self):
+        with self._lock:
+            self._trips = {}
+            self._source_cells = defaultdict(set)
+            self._destination_cells = defaultdict(set)
+            self.built_at = None
+            self.rebuild_time = None
+
+    def is_stale(self):
+        return self.built_at is None or time.monotonic() - self.built_at > self.max_age
+
+    def update(self, trip):
+        points = (trip.source.coords, trip.destination.coords) if trip.status == Trip.WAITING_STATUS else None
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append((trip.id, points))
+            if self.built_at is None:
+                return
+            self._remove(trip.id)
+            if points is not None:
+                self._add(trip.id, *points)
+
+    def remove(self, trip_id):
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append((trip_id, None))
+            self._remove(trip_id)
+
+    def get_nearby_trip_ids(self, source, destination, radius):
+        self.refresh()
+        source, destination = source.coords, destination.coords
+        with self._lock:
+            candidates = self._get_ids_around(self._source_cells, source, radius) & \
+                         self._get_ids_around(self._destination_cells, destination, radius)
+            return [trip_id for trip_id in candidates if
+                    self._distance(self._trips[trip_id][0], source) <= radius and
+                    self._distance(self._trips[trip_id][1], destination) <= radius]
+
+    def get_stats(self):
+        with self._lock:
+            memory = sys.getsizeof(self._trips) + sum(
+                sys.getsizeof(points) + sum(sys.getsizeof(point) for point in points)
+                for points in self._trips.values())
+            for cells in (self._source_cells, self._destination_cells):
+                memory += sys.getsizeof(cells) + sum(sys.getsizeof(ids) for ids in cells.values())
+            return {
+                'trips': len(self._trips),
+                'cells': len(self._source_cells) + len(self._destination_cells),
+                'memory_bytes': memory,
+                'rebuild_seconds': self.rebuild_time,
+                'age_seconds': None if self.built_at is None else time.monotonic() - self.built_at,
+            }
+
+    def _add(self, trip_id, source, destination):
+        self._trips[trip_id] = (source, destination)
+        self._source_cells[self._get_cell(source)].add(trip_id)
+        self._destination_cells[self._get_cell(destination)].add(trip_id)
+
+    def _remove(self, trip_id):
+        points = self._trips.pop(trip_id, None)
+        if points is None:
+            return
+        for cells, point in zip((self._source_cells, self._destination_cells), points):
+            cell = self._get_cell(point)
+            cells[cell].discard(trip_id)
+            if not cells[cell]:
+                del cells[cell]
+
+    def _get_cell(self, point):
+        return floor(point[0] / self.cell_size), floor(point[1] / self.cell_size)
+
+    def _get_ids_around(self, cells, point, radius):
+        (min_x, min_y), (max_x, max_y) = self._get_cell((point[0] - radius, point[1] - radius)), \
+                                         self._get_cell((point[0] + radius, point[1] + radius))
+        ids = set()
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                ids.update(cells.get((x, y), ()))
+        return ids
+
+    @staticmethod
+    def _distance(first_point, second_point):
+        return hypot(first_point[0] - second_point[0], first_point[1] - second_point[1])
+
+
+waiting_trips_index = WaitingTripsIndex()
+
+
+def filter_nearby_trips(trips_query_set, source, destination, radius=TRIP_SEARCH_RADIUS,
+                        route_buffer=TRIP_ROUTE_BUFFER):
+    trips_query_set = filter_same_direction_trips(trips_query_set, source, destination)
+    if TRIP_SPATIAL_INDEX_ENABLED:
+        nearby = Q(id__in=waiting_trips_index.get_nearby_trip_ids(source, destination, radius))
+    else:
+        nearby = Q(source__dwithin=(source, radius), destination__dwithin=(destination, radius))
+    trips_query_set = annotate_route_locations(trips_query_set, source, destination)
+    return trips_query_set.filter(nearby | get_along_route_condition(source, destination, route_buffer),
+                                  status=Trip.WAITING_STATUS)
+
+
+def filter_trips_along_route(trips_query_set, source, destination, route_buffer=TRIP_ROUTE_BUFFER):
+    """
+    Keeps the trips whose route passes within route_buffer of both source and destination, reaching source first.
+    """
+    trips_query_set = annotate_route_locations(trips_query_set, source, destination)
+    return trips_query_set.filter(get_along_route_condition(source, destination, route_buffer))
+
+
+def annotate_route_locations(trips_query_set, source, destination):
+    """
+    Annotates the fractions of the trips routes before their closest points to source and destination,
+    null for trips without a route.
+    """
+    return trips_query_set.annotate(
+        source_route_location=LineLocatePoint('route', Point(source.coords, srid=ROUTE_SRID)),
+        destination_route_location=LineLocatePoint('route', Point(destination.coords, srid=ROUTE_SRID)))
+
+
+def get_along_route_condition(source, destination, route_buffer):
+    # ST_DWithin conditions come first so that they can use the spatial index of routes
+    return Q(route__dwithin=(source, route_buffer)) & Q(route__dwithin=(destination, route_buffer)) & \
+           Q(source_route_location__lte=F('destination_route_location'))
+
+
+def filter_same_direction_trips(trips_query_set, source, destination):
+    """
+    Drops trips going in the opposite direction, the ones whose direction makes an angle of more than 90 degrees
+    with the requested one, using the indexed heading of the trips. Trips with a route are kept, their direction
+    is checked along the route instead.
+    """
+    direction_x, direction_y = np.subtract(project_to_meters(destination.coords), project_to_meters(source.coords))
+    if direction_x == direction_y == 0:
+        return trips_query_set
+    condition = Q(heading__isnull=True) | Q(route__isnull=False)
+    for start, end in get_same_direction_heading_ranges(get_heading(direction_x, direction_y)):
+        condition |= Q(heading__range=(start, end))
+    return trips_query_set.filter(condition)
@@ -1,9 +1,11 @@
 from __future__ import absolute_import, unicode_literals
 from background_task import background
+from background_task.models import Task
 from django.core.mail import send_mail
 
 from celery import shared_task
-from carpooling.settings.base import EMAIL_HOST_USER
+from carpooling.settings.base import EMAIL_HOST_USER, AUTOMATIC_JOIN_BATCH_WINDOW
+from trip.matching import match_automatic_join_requests
 from trip.models import Trip
 
 from .utils import SpotifyAgent
@@ -28,3 +30,17 @@ def notify(trip_id: int):
         receivers,
         fail_silently=False,
     )
+
+
+@background
+def run_automatic_join_batch():
+    match_automatic_join_requests()
+
+
+def schedule_automatic_join_batch():
+    """
+    Schedules a batch AUTOMATIC_JOIN_BATCH_WINDOW seconds later unless one is already waiting, which will match the
+    requests queued meanwhile too.
+    """
+    if not Task.objects.filter(task_name=run_automatic_join_batch.name, locked_by__isnull=True).exists():
+        run_automatic_join_batch(schedule=AUTOMATIC_JOIN_BATCH_WINDOW)
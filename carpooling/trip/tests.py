@@ -1,16 +1,35 @@
+import json
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+import numpy as np
+from background_task.models import Task
 from dateutil.parser import parse
 from django.contrib.gis.geos import Point
-from django.db.models import Q
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.db.models import Q, QuerySet
 from django.http import HttpResponseForbidden, HttpResponseNotFound
 from django.test import TestCase, Client
 from django.urls import reverse
+from django.utils import timezone
 from model_mommy import mommy
 
 from account.models import Member, Mail
 from group.models import Group, Membership
 from root.response import HttpResponseConflict
-from trip.models import Trip, TripGroups, Companionship, TripRequestSet, TripRequest, Vote
-from trip.utils import SpotifyAgent
+from search.circuit_breaker import elasticsearch_circuit_breaker
+from trip.matching import solve_assignment, get_optimal_matches, get_greedy_matches, match_automatic_join_requests, \
+    join_matches
+from trip.models import Trip, TripGroups, Companionship, TripRequestSet, TripRequest, Vote, AutomaticJoinRequest, \
+    TripAccessibility
+from trip.nearby_groups_cache import nearby_groups_cache_stats
+from trip.search_cache import trip_search_cache_stats
+from trip.spatial_index import WaitingTripsIndex, filter_nearby_trips, filter_trips_along_route, waiting_trips_index
+from trip.tasks import schedule_automatic_join_batch, run_automatic_join_batch
+from trip.utils import SpotifyAgent, get_trip_score, get_trips_scores, get_same_direction_heading_ranges
+from trip.views import SearchTripsManager
 
 
 class TripCreationTest(TestCase):
@@ -199,13 +218,44 @@ class GetTripsWithAuthenticatedUserTest(TestCase):
         self.assertEqual(response.status_code, 200)
         trips = response.context['trips']
         user = self.test_user_1
-        self.assertEqual(list(Trip.objects.filter(Q(is_private=False) | Q(groups__membership__member=user) | Q(
+        self.assertEqual(set(Trip.objects.filter(Q(is_private=False) | Q(groups__membership__member=user) | Q(
             car_provider=user) | Q(companionship__member=user)).exclude(
-            Q(status=Trip.DONE_STATUS) | Q(status=Trip.CANCELED_STATUS))), list(trips))
+            Q(status=Trip.DONE_STATUS) | Q(status=Trip.CANCELED_STATUS))), set(trips))
+        self.assertEqual(len(set(trips)), len(trips))
+
+    def test_accessibility_follows_membership(self):
+        private_trip = mommy.make(Trip, is_private=True, car_provider=self.test_user_2, status=Trip.WAITING_STATUS)
+        TripGroups.objects.create(trip=private_trip, group=self.g3)
+        self.assertFalse(private_trip.is_accessible_for(self.test_user_1))
+
+        membership = Membership.objects.create(member=self.test_user_1, group=self.g3, role=Membership.MEMBER)
+        self.assertTrue(private_trip.is_accessible_for(self.test_user_1))
+        self.assertIn(private_trip, Trip.get_accessible_trips_for(self.test_user_1))
+
+        membership.delete()
+        self.assertFalse(private_trip.is_accessible_for(self.test_user_1))
+        self.assertNotIn(private_trip, Trip.get_accessible_trips_for(self.test_user_1))
+
+    def test_delete_trip_with_groups_and_passengers(self):
+        trip = mommy.make(Trip, is_private=True, car_provider=self.test_user_2, status=Trip.WAITING_STATUS)
+        TripGroups.objects.create(trip=trip, group=self.g1)
+        Companionship.objects.create(trip=trip, member=self.test_user_1, source=Point(5, 6), destination=Point(6, 7))
+        trip.delete()
+        self.assertFalse(TripAccessibility.objects.exists())
+
+    def test_delete_member_of_group_riding_in_group_trip(self):
+        trip = mommy.make(Trip, is_private=True, car_provider=self.test_user_2, status=Trip.WAITING_STATUS)
+        TripGroups.objects.create(trip=trip, group=self.g1)
+        Companionship.objects.create(trip=trip, member=self.test_user_1, source=Point(5, 6), destination=Point(6, 7))
+        member_id = self.test_user_1.id
+        self.test_user_1.delete()
+        self.assertFalse(TripAccessibility.objects.filter(member_id=member_id).exists())
+        self.assertTrue(TripAccessibility.objects.filter(trip=trip, member=self.test_user_2).exists())
 
 
 class SearchTripTest(TestCase):
     def setUp(self):
+        waiting_trips_index.reset()
         self.test_user = Member.objects.create_user(username="test_user", password='12345678')
 
     def test_anonymous(self):
@@ -217,6 +267,288 @@ class SearchTripTest(TestCase):
         response = self.client.get(reverse('trip:search_trips'))
         self.assertEqual(response.status_code, 200)
 
+    def test_search_nearby_trips(self):
+        near_trip = mommy.make(Trip, is_private=False, status=Trip.WAITING_STATUS, source=Point(35.7, 51.4),
+                               destination=Point(35.75, 51.3))
+        mommy.make(Trip, is_private=False, status=Trip.WAITING_STATUS, source=Point(29.6, 52.5),
+                   destination=Point(29.65, 52.4))
+        self.client.login(username='test_user', password='12345678')
+        response = self.client.get(reverse('trip:search_trips'), {
+            'source_lat': '35.7',
+            'source_lng': '51.4',
+            'destination_lat': '35.75',
+            'destination_lng': '51.3',
+            'start_time': '-1',
+            'end_time': '-1',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([near_trip], list(response.context['trips']))
+
+    def test_search_pages(self):
+        trips = [mommy.make(Trip, is_private=False, status=Trip.WAITING_STATUS, source=Point(35.7 + i * 0.01, 51.4),
+                            destination=Point(35.75, 51.3)) for i in range(3)]
+        self.client.login(username='test_user', password='12345678')
+        data = {
+            'source_lat': '35.7',
+            'source_lng': '51.4',
+            'destination_lat': '35.75',
+            'destination_lng': '51.3',
+            'start_time': '-1',
+            'end_time': '-1',
+            'limit': '2',
+        }
+        response = self.client.get(reverse('trip:search_trips'), data)
+        self.assertEqual(trips[:2], list(response.context['trips']))
+        self.assertIsNone(response.context['previous_page_url'])
+        self.assertIsNotNone(response.context['next_page_url'])
+
+        response = self.client.get(reverse('trip:search_trips'), dict(data, offset='2'))
+        self.assertEqual(trips[2:], list(response.context['trips']))
+        self.assertIsNotNone(response.context['previous_page_url'])
+        self.assertIsNone(response.context['next_page_url'])
+
+    def test_ranked_trips_are_capped(self):
+        trips = [mommy.make(Trip, is_private=False, status=Trip.WAITING_STATUS, source=Point(35.7 + i * 0.01, 51.4),
+                            destination=Point(35.75, 51.3)) for i in range(3)]
+        with patch.object(SearchTripsManager, 'RANKED_TRIPS_COUNT', 2):
+            ranked_trip_ids = SearchTripsManager.rank_trips(Point(35.7, 51.4), Point(35.75, 51.3), None)
+        self.assertEqual([trip.id for trip in trips[:2]], ranked_trip_ids)
+
+    def test_private_trips_after_ranked_trips(self):
+        for i in range(2):
+            mommy.make(Trip, is_private=False, status=Trip.WAITING_STATUS, source=Point(35.7, 51.4),
+                       destination=Point(35.75, 51.3))
+        private_trip = mommy.make(Trip, is_private=True, status=Trip.WAITING_STATUS, source=Point(35.72, 51.4),
+                                  destination=Point(35.75, 51.3), car_provider=self.test_user)
+        self.client.login(username='test_user', password='12345678')
+        with patch.object(SearchTripsManager, 'RANKED_TRIPS_COUNT', 2):
+            response = self.client.get(reverse('trip:search_trips'), {
+                'source_lat': '35.7',
+                'source_lng': '51.4',
+                'destination_lat': '35.75',
+                'destination_lng': '51.3',
+                'start_time': '-1',
+                'end_time': '-1',
+            })
+        self.assertEqual(3, len(response.context['trips']))
+        self.assertEqual(private_trip, response.context['trips'][2])
+
+    def test_search_by_dates(self):
+        trip_in_range = mommy.make(Trip, is_private=False, status=Trip.WAITING_STATUS, source=Point(35.7, 51.4),
+                                   destination=Point(35.75, 51.3), start_estimation=parse('2006-10-25 13:30:00'),
+                                   end_estimation=parse('2006-10-25 14:30:00'))
+        mommy.make(Trip, is_private=False, status=Trip.WAITING_STATUS, source=Point(35.7, 51.4),
+                   destination=Point(35.75, 51.3), start_estimation=parse('2006-10-25 14:30:00'),
+                   end_estimation=parse('2006-10-25 16:30:00'))
+        self.client.login(username='test_user', password='12345678')
+        response = self.client.get(reverse('trip:search_trips'), {
+            'source_lat': '35.7',
+            'source_lng': '51.4',
+            'destination_lat': '35.75',
+            'destination_lng': '51.3',
+            'start_time': '2006-10-25 13:00:00',
+            'end_time': '2006-10-25 15:00:00',
+        })
+        self.assertEqual([trip_in_range], list(response.context['trips']))
+
+    def test_search_invalid_page(self):
+        self.client.login(username='test_user', password='12345678')
+        response = self.client.get(reverse('trip:search_trips'), {
+            'source_lat': '35.7',
+            'source_lng': '51.4',
+            'destination_lat': '35.75',
+            'destination_lng': '51.3',
+            'start_time': '-1',
+            'end_time': '-1',
+            'limit': '0',
+        })
+        self.assertEqual(response.status_code, 400)
+
+
+class TripSearchCacheTest(TestCase):
+    def setUp(self):
+        waiting_trips_index.reset()
+        self.test_user = Member.objects.create_user(username="test_user", password='12345678')
+        self.car_provider = Member.objects.create_user(username="car_provider", password='12345678')
+        self.trip = mommy.make(Trip, is_private=False, status=Trip.WAITING_STATUS, source=Point(35.7, 51.4),
+                               destination=Point(35.75, 51.3))
+        self.private_trip = mommy.make(Trip, is_private=True, status=Trip.WAITING_STATUS, source=Point(35.7, 51.4),
+                                       destination=Point(35.75, 51.3), car_provider=self.car_provider)
+        self.data = {
+            'source_lat': '35.7',
+            'source_lng': '51.4',
+            'destination_lat': '35.75',
+            'destination_lng': '51.3',
+            'start_time': '-1',
+            'end_time': '-1',
+        }
+
+    def search(self, username):
+        self.client.login(username=username, password='12345678')
+        return set(self.client.get(reverse('trip:search_trips'), self.data).context['trips'])
+
+    def test_accessibility_is_applied_to_cached_results(self):
+        trip_search_cache_stats.reset()
+        self.assertSetEqual({self.trip}, self.search('test_user'))
+        self.assertSetEqual({self.trip, self.private_trip}, self.search('car_provider'))
+        self.assertDictEqual({'hits': 1, 'misses': 1, 'hit_rate': 0.5}, trip_search_cache_stats.get())
+
+    def test_far_trip_change_keeps_results(self):
+        self.search('test_user')
+        mommy.make(Trip, is_private=False, status=Trip.WAITING_STATUS, source=Point(36.5, 51.4),
+                   destination=Point(36.6, 51.3))
+        trip_search_cache_stats.reset()
+        self.assertSetEqual({self.trip}, self.search('test_user'))
+        self.assertEqual(1, trip_search_cache_stats.get()['hits'])
+
+    def test_trip_status_change_invalidates_results(self):
+        self.assertSetEqual({self.trip}, self.search('test_user'))
+        self.trip.status = Trip.CLOSED_STATUS
+        self.trip.save()
+        self.assertSetEqual(set(), self.search('test_user'))
+
+
+class TripScoreTest(TestCase):
+    def setUp(self):
+        self.trips = [
+            Trip(source=Point(34, 44), destination=Point(44, 54)),
+            Trip(source=Point(30, 40), destination=Point(50, 60)),
+            Trip(source=Point(44, 54), destination=Point(34, 44)),
+        ]
+
+    def test_batch_scores_match_single_scores(self):
+        source, destination = Point(35, 44), Point(43, 55)
+        scores = get_trips_scores(self.trips, source, destination)
+        for trip, score in zip(self.trips, scores):
+            self.assertEqual(get_trip_score(trip, source, destination), score)
+
+    def test_on_route_trip_score(self):
+        scores = get_trips_scores(self.trips, Point(34, 44), Point(44, 54))
+        self.assertAlmostEqual(scores[0], 0)
+        self.assertAlmostEqual(scores[1], 0)
+
+    def test_opposite_direction_trip_score(self):
+        scores = get_trips_scores(self.trips, Point(34, 44), Point(44, 54))
+        self.assertEqual(scores[2], np.inf)
+
+    def test_no_trips(self):
+        self.assertEqual(len(get_trips_scores([], Point(34, 44), Point(44, 54))), 0)
+
+    def test_scores_in_meters(self):
+        trip = Trip(source=Point(35.7, 51.4), destination=Point(35.8, 51.4))
+        score = get_trip_score(trip, Point(35.7, 51.41), Point(35.8, 51.41), in_meters=True)
+        self.assertAlmostEqual(2 * 903, score, delta=5)
+
+    def test_route_geometry(self):
+        trip = Trip(source=Point(35.7, 51.4), destination=Point(35.8, 51.5))
+        trip.update_route_geometry()
+        self.assertAlmostEqual(trip.length, np.hypot(trip.direction_x, trip.direction_y))
+        self.assertAlmostEqual(trip.heading, np.degrees(np.arctan2(trip.direction_y, trip.direction_x)))
+        self.assertEqual((35.7, 51.4, 35.8, 51.5), trip.bounding_box.extent)
+
+    def test_same_direction_heading_ranges(self):
+        self.assertEqual([(-90, 90)], get_same_direction_heading_ranges(0))
+        self.assertEqual([(80, 180), (-180, -100)], get_same_direction_heading_ranges(170))
+        self.assertEqual([(-180, 0)], get_same_direction_heading_ranges(-90))
+
+    def test_projected_points_are_cached(self):
+        trip = Trip(source=Point(35.7, 51.4), destination=Point(35.8, 51.4))
+        trip.update_route_geometry()
+        self.assertEqual((0, 0), tuple(trip.get_projected_source()))
+        self.assertAlmostEqual(11119.5, trip.get_projected_destination()[0], delta=1)
+
+    def test_backfill_recomputes_projections_of_another_origin(self):
+        trip = mommy.make(Trip, source=Point(35.7, 51.4), destination=Point(35.8, 51.4))
+        Trip.objects.filter(id=trip.id).update(projected_source_x=1000, projected_destination_x=12119.5)
+        call_command('backfill_route_geometry', stdout=StringIO())
+        trip.refresh_from_db()
+        self.assertAlmostEqual(0, trip.projected_source_x)
+        self.assertAlmostEqual(11119.5, trip.projected_destination_x, delta=1)
+
+
+class CorridorSearchTest(TestCase):
+    fixtures = ['trip_routes']
+
+    def setUp(self):
+        waiting_trips_index.reset()
+        self.source, self.destination = Point(35.75, 51.36), Point(35.75, 51.44)
+
+    def test_trips_along_route(self):
+        trips = filter_trips_along_route(Trip.objects.all(), self.source, self.destination)
+        self.assertListEqual([1], [trip.id for trip in trips])
+
+    def test_nearby_trips_include_trips_along_route(self):
+        trips = filter_nearby_trips(Trip.objects.all(), self.source, self.destination, radius=0.01)
+        self.assertListEqual([1], [trip.id for trip in trips])
+
+    def test_route_score(self):
+        trips = list(Trip.objects.filter(id__in=[1, 2, 4]).order_by('id'))
+        scores = get_trips_scores(trips, self.source, self.destination)
+        self.assertAlmostEqual(0, scores[0], delta=1)
+        self.assertEqual(np.inf, scores[1])
+        self.assertGreater(scores[2], 10000)
+
+
+class WaitingTripsIndexTest(TestCase):
+    def setUp(self):
+        self.index = WaitingTripsIndex(cell_size=0.1, max_age=60)
+        self.near_trip = mommy.make(Trip, status=Trip.WAITING_STATUS, source=Point(35.7, 51.4),
+                                    destination=Point(35.75, 51.3))
+        self.far_trip = mommy.make(Trip, status=Trip.WAITING_STATUS, source=Point(29.6, 52.5),
+                                   destination=Point(29.65, 52.4))
+        mommy.make(Trip, status=Trip.DONE_STATUS, source=Point(35.7, 51.4), destination=Point(35.75, 51.3))
+        self.index.rebuild()
+
+    def test_nearby_trips(self):
+        self.assertEqual([self.near_trip.id],
+                         self.index.get_nearby_trip_ids(Point(35.72, 51.38), Point(35.74, 51.31), 0.1))
+
+    def test_trip_status_change(self):
+        self.near_trip.status = Trip.CLOSED_STATUS
+        self.index.update(self.near_trip)
+        self.assertEqual([], self.index.get_nearby_trip_ids(Point(35.7, 51.4), Point(35.75, 51.3), 0.1))
+
+    def test_new_waiting_trip(self):
+        trip = mommy.make(Trip, status=Trip.WAITING_STATUS, source=Point(29.61, 52.5), destination=Point(29.65, 52.4))
+        self.index.update(trip)
+        self.assertEqual({self.far_trip.id, trip.id},
+                         set(self.index.get_nearby_trip_ids(Point(29.6, 52.5), Point(29.65, 52.4), 0.1)))
+
+    def test_removed_trip(self):
+        self.index.remove(self.far_trip.id)
+        self.assertEqual([], self.index.get_nearby_trip_ids(Point(29.6, 52.5), Point(29.65, 52.4), 0.1))
+
+    def test_changes_during_rebuild_are_kept(self):
+        iterator = QuerySet.iterator
+
+        def remove_during_rebuild(query_set, *args, **kwargs):
+            self.index.remove(self.near_trip.id)
+            return iterator(query_set, *args, **kwargs)
+
+        with patch.object(QuerySet, 'iterator', remove_during_rebuild):
+            self.index.rebuild()
+        self.assertEqual([], self.index.get_nearby_trip_ids(Point(35.7, 51.4), Point(35.75, 51.3), 0.1))
+        self.assertEqual([self.far_trip.id],
+                         self.index.get_nearby_trip_ids(Point(29.6, 52.5), Point(29.65, 52.4), 0.1))
+
+    def test_failed_rebuild_stops_recording_changes(self):
+        with patch.object(QuerySet, 'iterator', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.index.rebuild()
+        self.index.remove(self.far_trip.id)
+        self.assertIsNone(self.index._changes)
+
+    def test_fresh_index_is_not_rebuilt(self):
+        built_at = self.index.built_at
+        self.index.refresh()
+        self.assertEqual(built_at, self.index.built_at)
+
+    def test_stats(self):
+        stats = self.index.get_stats()
+        self.assertEqual(2, stats['trips'])
+        self.assertGreater(stats['memory_bytes'], 0)
+        self.assertIsNotNone(stats['rebuild_seconds'])
+
 
 class CreateTripRequestTest(TestCase):
     c = Client(enforce_csrf_checks=False)
@@ -409,6 +741,7 @@ class ManageTripRequestsTest(TestCase):
         self.assertEqual(dummy_trip_request.status, TripRequest.CANCELED_STATUS)
         self.assertTrue(self.trip_request.containing_set.closed)
         self.assertTrue(Companionship.objects.filter(trip=self.trip, member=self.applicant).exists())
+        self.assertEqual(1, response.context['members_count'])
 
     def test_valid_decline_trip_request(self):
         response = self.c.post(reverse('trip:trip_request', kwargs={'trip_id': self.trip.id}), {
@@ -479,6 +812,7 @@ class AutomaticallyJoinTripTest(TestCase):
     c = Client(enforce_csrf_checks=False)
 
     def setUp(self):
+        waiting_trips_index.reset()
         self.car_provider = mommy.make(Member, username='car_provider', _fill_optional=['email'])
         self.car_provider.set_password('12345678')
         self.car_provider.save()
@@ -533,6 +867,186 @@ class AutomaticallyJoinTripTest(TestCase):
 
         self.assertTemplateUsed(response, 'trip_not_found.html')
 
+    def test_automatically_join_next_trip_when_best_is_full(self):
+        self.trip.capacity = 1
+        self.trip.save()
+        Companionship.objects.create(trip=self.trip, member=self.car_provider, source=Point(34, 44),
+                                     destination=Point(44, 54))
+        next_trip = mommy.make(Trip, car_provider=self.car_provider, people_can_join_automatically=True,
+                               status=Trip.WAITING_STATUS, capacity=2, source=Point(34.01, 44),
+                               destination=Point(44, 54), start_estimation=parse('2006-10-25 13:30:57'),
+                               end_estimation=parse('2006-10-25 14:30:57'))
+        response = self.c.post(reverse('trip:automatically_join_trip'), {
+            'source_lat': '34',
+            'source_lng': '44',
+            'destination_lat': '44',
+            'destination_lng': '54',
+            'start_estimation': '2006-10-25 14:15:57',
+            'end_estimation': '2006-10-25 15:30:58',
+        })
+
+        self.assertRedirects(response, reverse('trip:trip', kwargs={'pk': next_trip.id}))
+
+
+class AutomaticJoinBatchTest(TestCase):
+    def setUp(self):
+        waiting_trips_index.reset()
+        start_estimation = timezone.now() + timedelta(hours=1)
+        end_estimation = start_estimation + timedelta(hours=1)
+        self.trip = mommy.make(Trip, people_can_join_automatically=True, status=Trip.WAITING_STATUS, capacity=1,
+                               source=Point(34, 44), destination=Point(44, 54), start_estimation=start_estimation,
+                               end_estimation=end_estimation)
+        self.parallel_trip = mommy.make(Trip, people_can_join_automatically=True, status=Trip.WAITING_STATUS,
+                                        capacity=1, source=Point(34, 44.03), destination=Point(44, 54.03),
+                                        start_estimation=start_estimation, end_estimation=end_estimation)
+        self.first_request = mommy.make(AutomaticJoinRequest, source=Point(34, 44), destination=Point(44, 54),
+                                        start_estimation=start_estimation, end_estimation=end_estimation)
+        self.second_request = mommy.make(AutomaticJoinRequest, source=Point(34, 43.98), destination=Point(44, 53.98),
+                                         start_estimation=start_estimation, end_estimation=end_estimation)
+
+    def test_solve_assignment(self):
+        costs = np.array([[4, 1, 3], [2, 0, 5], [3, 2, 2]])
+        self.assertListEqual([1, 0, 2], list(solve_assignment(costs)))
+
+    def test_optimal_matches_respect_capacities(self):
+        costs = np.array([[1, 2], [1, np.inf], [1, 3]])
+        matches = get_optimal_matches(costs, np.array([2, 1]))
+        self.assertSetEqual({(0, 1), (1, 0), (2, 0)}, set(matches))
+        self.assertListEqual([(0, 0), (1, 0), (2, 1)], get_greedy_matches(costs, np.array([2, 1])))
+
+    def test_batch_matches_more_requests_than_greedy(self):
+        stats = match_automatic_join_requests()
+        self.assertEqual(2, stats['matches'])
+        self.assertEqual(2, stats['joined'])
+        self.assertEqual(1, stats['greedy_matches'])
+        self.first_request.refresh_from_db()
+        self.second_request.refresh_from_db()
+        self.assertEqual(self.parallel_trip.id, self.first_request.trip_id)
+        self.assertEqual(self.trip.id, self.second_request.trip_id)
+        self.assertEqual(AutomaticJoinRequest.MATCHED_STATUS, self.second_request.status)
+        self.assertTrue(Companionship.objects.filter(trip=self.trip, member=self.second_request.member).exists())
+
+    def test_expired_requests_are_not_matched(self):
+        AutomaticJoinRequest.objects.filter(id=self.first_request.id).update(
+            end_estimation=timezone.now() - timedelta(minutes=1))
+        stats = match_automatic_join_requests()
+        self.assertEqual(1, stats['expired'])
+        self.first_request.refresh_from_db()
+        self.assertEqual(AutomaticJoinRequest.EXPIRED_STATUS, self.first_request.status)
+        self.assertIsNone(self.first_request.trip)
+
+    def test_requests_handled_by_another_batch_are_skipped(self):
+        AutomaticJoinRequest.objects.filter(id=self.first_request.id).update(
+            status=AutomaticJoinRequest.MATCHED_STATUS, trip=self.parallel_trip)
+        self.assertEqual(0, join_matches([(self.first_request, self.trip)]))
+        self.first_request.refresh_from_db()
+        self.assertEqual(self.parallel_trip.id, self.first_request.trip_id)
+        self.assertFalse(Companionship.objects.filter(trip=self.trip).exists())
+
+    def test_one_batch_is_scheduled(self):
+        schedule_automatic_join_batch()
+        schedule_automatic_join_batch()
+        self.assertEqual(1, Task.objects.filter(task_name=run_automatic_join_batch.name).count())
+
+
+class TripGroupsTest(TestCase):
+    def setUp(self):
+        self.car_provider = Member.objects.create_user(username='car_provider', password='12345678')
+        self.trip = mommy.make(Trip, car_provider=self.car_provider, status=Trip.WAITING_STATUS,
+                               source=Point(35.7, 51.4), destination=Point(35.75, 51.3))
+        self.group_without_source = mommy.make(Group, code='everywhere', source=None)
+        self.near_group = mommy.make(Group, code='near', source=Point(35.7005, 51.4))
+        self.far_group = mommy.make(Group, code='far', source=Point(35.8, 51.4))
+        mommy.make(Group, code='not_joined', source=Point(35.75, 51.3))
+        for group in (self.group_without_source, self.near_group, self.far_group):
+            Membership.objects.create(member=self.car_provider, group=group, role=Membership.MEMBER)
+        self.client.login(username='car_provider', password='12345678')
+
+    def test_get_nearby_groups(self):
+        response = self.client.get(reverse('trip:add_to_groups', kwargs={'trip_id': self.trip.id}))
+        self.assertSetEqual({self.group_without_source, self.near_group}, set(response.context['groups']))
+
+    def test_nearby_groups_are_cached_until_membership_changes(self):
+        nearby_groups_cache_stats.reset()
+        url = reverse('trip:add_to_groups', kwargs={'trip_id': self.trip.id})
+        self.client.get(url)
+        self.client.get(url)
+        self.assertEqual(1, nearby_groups_cache_stats.get()['hits'])
+
+        Membership.objects.filter(member=self.car_provider, group=self.near_group).delete()
+        response = self.client.get(url)
+        self.assertSetEqual({self.group_without_source}, set(response.context['groups']))
+
+    def test_group_source_change_invalidates_nearby_groups(self):
+        url = reverse('trip:add_to_groups', kwargs={'trip_id': self.trip.id})
+        self.client.get(url)
+        self.far_group.source = Point(35.75, 51.3)
+        self.far_group.save()
+        response = self.client.get(url)
+        self.assertIn(self.far_group, response.context['groups'])
+
+    def test_add_to_nearby_groups(self):
+        self.client.post(reverse('trip:add_to_groups', kwargs={'trip_id': self.trip.id}),
+                         {'near': 'on', 'far': 'on'})
+        self.assertListEqual([self.near_group.id], list(TripGroups.objects.filter(trip=self.trip).values_list(
+            'group_id', flat=True)))
+
+    def test_add_to_groups_api(self):
+        member = mommy.make(Member, username='member', _fill_optional=['email'])
+        Membership.objects.create(member=member, group=self.near_group, role=Membership.MEMBER)
+        response = self.client.post(reverse('trip:add_to_groups_api', kwargs={'trip_id': self.trip.id}),
+                                    json.dumps({'groups': ['near', 'far', 'missing']}),
+                                    content_type='application/json')
+        self.assertDictEqual({'added': ['near'], 'rejected': ['far', 'missing']}, json.loads(response.content))
+        self.assertTrue(TripAccessibility.objects.filter(trip=self.trip, member=member).exists())
+
+    def test_add_to_groups_api_as_passenger(self):
+        Member.objects.create_user(username='passenger', password='12345678')
+        self.client.login(username='passenger', password='12345678')
+        response = self.client.post(reverse('trip:add_to_groups_api', kwargs={'trip_id': self.trip.id}),
+                                    json.dumps({'groups': ['near']}), content_type='application/json')
+        self.assertEqual(403, response.status_code)
+        self.assertFalse(TripGroups.objects.filter(trip=self.trip).exists())
+
+
+class TripSeatsTest(TestCase):
+    def setUp(self):
+        self.passenger = mommy.make(Member, username='passenger', _fill_optional=['email'])
+        self.trip = mommy.make(Trip, status=Trip.WAITING_STATUS, capacity=2)
+
+    def test_companionship_takes_seat(self):
+        companionship = Companionship.objects.create(trip=self.trip, member=self.passenger, source=Point(5, 6),
+                                                     destination=Point(6, 7))
+        self.trip.refresh_from_db()
+        self.assertEqual(1, self.trip.seats_taken)
+        self.assertEqual(1, self.trip.seats_left)
+
+        companionship.delete()
+        self.trip.refresh_from_db()
+        self.assertEqual(0, self.trip.seats_taken)
+
+    def test_trip_save_keeps_seats_taken(self):
+        Companionship.objects.create(trip=self.trip, member=self.passenger, source=Point(5, 6),
+                                     destination=Point(6, 7))
+        self.trip.status = Trip.CLOSED_STATUS
+        self.trip.save()
+        self.trip.refresh_from_db()
+        self.assertEqual(1, self.trip.seats_taken)
+
+    def test_force_insert_deleted_trip(self):
+        trip_id = self.trip.id
+        Trip.objects.filter(id=trip_id).delete()
+        self.trip.save(force_insert=True)
+        self.assertTrue(Trip.objects.filter(id=trip_id).exists())
+
+    def test_repair_seats_taken(self):
+        Companionship.objects.create(trip=self.trip, member=self.passenger, source=Point(5, 6),
+                                     destination=Point(6, 7))
+        Trip.objects.filter(id=self.trip.id).update(seats_taken=2)
+        self.assertEqual(1, Trip.repair_seats_taken())
+        self.trip.refresh_from_db()
+        self.assertEqual(1, self.trip.seats_taken)
+
 
 class ManageTripPageTest(TestCase):
     def setUp(self):
@@ -773,3 +1287,51 @@ class QuickMessageTest(TestCase):
                                     {"message": "test"})
         self.assertEqual(response.status_code, 400)
         self.assertFalse(Mail.objects.filter(receiver=self.passenger, message="test").exists())
+
+
+class TripMapTest(TestCase):
+    def setUp(self):
+        elasticsearch_circuit_breaker.record_success()
+        self.user = Member.objects.create_user(username='test_user', password='12345678')
+        self.group = mommy.make(Group)
+        Membership.objects.create(member=self.user, group=self.group, role=Membership.MEMBER)
+        self.client.login(username='test_user', password='12345678')
+
+    @patch('trip.apis.search_query.trip_map_search')
+    def test_trips_near_point(self, trip_map_search):
+        trip_map_search.return_value = {'hits': {'hits': [{'_source': {
+            'id': 1, 'source': {'lat': 35.7, 'lon': 51.4}, 'destination': {'lat': 35.75, 'lon': 51.3},
+            'start_estimation': '2019-08-01T08:00:00+04:30', 'end_estimation': '2019-08-01T09:00:00+04:30',
+            'seats_left': 2}}]}}
+        response = self.client.get(reverse('trip:map_trips_api'), {'lat': 35.7, 'lng': 51.4, 'distance': 2})
+        self.assertEqual(200, response.status_code)
+        trips = json.loads(response.content)['trips']
+        self.assertEqual(2, trips[0]['seats_left'])
+        self.assertEqual(reverse('trip:trip', kwargs={'pk': 1}), trips[0]['url'])
+        user_id, group_ids, geo_filter, status, time_range, near, limit = trip_map_search.call_args[0]
+        self.assertEqual((self.user.id, [self.group.id], Trip.WAITING_STATUS), (user_id, group_ids, status))
+        self.assertEqual('2km', geo_filter['geo_distance']['distance'])
+        self.assertEqual((35.7, 51.4), near)
+
+    @patch('trip.apis.search_query.trip_map_search')
+    def test_trips_in_box_and_time_range(self, trip_map_search):
+        trip_map_search.return_value = {'hits': {'hits': []}}
+        response = self.client.get(reverse('trip:map_trips_api'), {
+            'north': 35.8, 'west': 51.3, 'south': 35.6, 'east': 51.5,
+            'start_time': '2019-08-01 08:00:00', 'end_time': '2019-08-01 10:00:00'})
+        self.assertEqual(200, response.status_code)
+        geo_filter, status, time_range, near = trip_map_search.call_args[0][2:6]
+        self.assertEqual({'lat': 35.8, 'lon': 51.3}, geo_filter['geo_bounding_box']['source']['top_left'])
+        self.assertTrue(timezone.is_aware(time_range[0]))
+        self.assertIsNone(near)
+
+    def test_invalid_area(self):
+        response = self.client.get(reverse('trip:map_trips_api'), {'lat': 35.7, 'lng': 51.4, 'distance': 500})
+        self.assertEqual(400, response.status_code)
+        response = self.client.get(reverse('trip:map_trips_api'), {'north': 35.8})
+        self.assertEqual(400, response.status_code)
+
+    @patch('trip.apis.search_query.trip_map_search', side_effect=ConnectionError)
+    def test_search_unavailable(self, trip_map_search):
+        response = self.client.get(reverse('trip:map_trips_api'), {'lat': 35.7, 'lng': 51.4})
+        self.assertEqual(503, response.status_code)
@@ -5,7 +5,7 @@ from trip.views import AutomaticJoinRequestManager, SearchTripsManager, get_avai
     get_active_trips_view, TripCreationManger, TripGroupsManager, TripRequestManager, \
     get_owned_trips_view, get_public_trips_view, get_categorized_trips_view, get_group_trips_view, TripDetailView, \
     QuickMessageTripManager
-from .apis import spotify_search, add_to_playlist
+from .apis import spotify_search, add_to_playlist, add_trip_to_groups, get_map_trips
 
 app_name = "trip"
 
@@ -14,6 +14,7 @@ urlpatterns = [
     path("create/", login_required(TripCreationManger.as_view()), name='trip_creation'),
     path("<int:trip_id>/", TripDetailView.as_view(), name='trip'),
     path("<int:trip_id>/group/add/", login_required(TripGroupsManager.as_view()), name='add_to_groups'),
+    path("<int:trip_id>/group/add/api/", add_trip_to_groups, name='add_to_groups_api'),
     path('<int:trip_id>/request/', login_required(TripRequestManager.as_view()), name='trip_request'),
     path('', get_owned_trips_view, name='owned_trips'),
     path('public/', get_public_trips_view, name='public_trips'),
@@ -24,6 +25,7 @@ urlpatterns = [
     path('active/', get_active_trips_view, name='active_trips'),
     path('all/', get_available_trips_view, name='available_trips'),
     path('search/', login_required(SearchTripsManager.as_view()), name='search_trips'),
+    path('map/api/', get_map_trips, name='map_trips_api'),
 
     path('automatic-join/', login_required(AutomaticJoinRequestManager.as_view()), name='automatically_join_trip'),
     path('spotify-search/<int:trip_id>/<query>', spotify_search, name='spotify_search'),
@@ -4,15 +4,17 @@ import os
 import numpy as np
 import requests
 import spotipy
-from django.contrib.gis.geos import Point
+from django.contrib.gis.geos import Point, LineString
 from django.utils import timezone
 from numpy.linalg import norm
 
 from carpooling.settings.base import SPOTIFY_CLIENT_ID, SPOTIFY_USERNAME, SPOTIFY_CLIENT_SECRET, \
-    SPOTIFY_REFRESH_TOKEN
+    SPOTIFY_REFRESH_TOKEN, SCORING_ORIGIN, TRIP_SCORE_IN_METERS
 
 proxy = 'proxy.roo.cloud:3128'
 
+EARTH_RADIUS = 6371008.8
+
 CAR_PROVIDER_QUICK_MESSAGES = ["I have arrived", "Where are you?", "I will be there in five.",
                                "I will be running late.", "It is gonna take more than half hour to get to you."]
 PASSENGER_QUICK_MESSAGES = ["Where are you?", "When are you gonna be here?", "I will be there in five.",
@@ -134,32 +136,129 @@ def extract_destination(post_data):
     return Point(float(post_data['destination_lat']), float(post_data['destination_lng']))
 
 
-def subtract_two_point(point1: Point, point2: Point):
-    return Point(point1.x - point2.x, point1.y - point2.y)
+def extract_route(post_data):
+    """
+    Returns the optional route of a trip, posted as "lat,lng" points separated by semicolons.
+    Raises ValueError when the route is malformed.
+    """
+    route = post_data.get('route', '').strip()
+    if not route:
+        return None
+    points = [Point(*(float(coordinate) for coordinate in point.split(','))) for point in route.split(';')]
+    if any(point.hasz for point in points):
+        raise ValueError('Route points should have two coordinates')
+    return LineString(points)
 
 
-def get_trip_score(trip, source: Point, destination: Point):
-    source_to_trip_source = subtract_two_point(trip.source, source)
-    destination_to_trip_destination = subtract_two_point(trip.destination, destination)
-    trip_source_to_destination = subtract_two_point(trip.destination, trip.source)
-    if np.dot(trip_source_to_destination, subtract_two_point(destination, source)) < 0:
-        return np.inf
+def get_trips_scores(trips, source: Point, destination: Point, in_meters=TRIP_SCORE_IN_METERS):
+    if in_meters:
+        trips_sources = np.array([trip.get_projected_source() for trip in trips], dtype=float).reshape(-1, 2)
+        trips_destinations = np.array([trip.get_projected_destination() for trip in trips], dtype=float).reshape(-1, 2)
+        source, destination = project_to_meters(source.coords), project_to_meters(destination.coords)
     else:
-        if np.dot(source_to_trip_source, trip_source_to_destination) > 0:
-            # distance to source dot
-            to_source_distance = norm(source_to_trip_source)
-        else:
-            # distance to line
-            to_source_distance = norm(np.cross(source_to_trip_source, trip_source_to_destination)) / norm(
-                trip_source_to_destination)
+        trips_sources = np.array([trip.source.coords for trip in trips], dtype=float).reshape(-1, 2)
+        trips_destinations = np.array([trip.destination.coords for trip in trips], dtype=float).reshape(-1, 2)
+        source, destination = source.coords, destination.coords
+    scores = get_trip_scores(trips_sources, trips_destinations, source, destination)
+    for index, trip in enumerate(trips):
+        if trip.route is not None:
+            route = project_to_meters(trip.route.coords) if in_meters else np.array(trip.route.coords, dtype=float)
+            scores[index] = get_route_score(route, source, destination)
+    return scores
+
+
+def get_trip_scores(trips_sources, trips_destinations, source, destination):
+    """
+    Scores every trip in one pass. Trips are given as two (n, 2) arrays of their source and destination coordinates.
+    The score of a trip is the sum of distances from the requested source and destination to the trip segment,
+    and np.inf when the trip goes in the opposite direction.
+    """
+    source, destination = np.array(source, dtype=float), np.array(destination, dtype=float)
+    source_to_trips_sources = trips_sources - source
+    destination_to_trips_destinations = trips_destinations - destination
+    trips_sources_to_destinations = trips_destinations - trips_sources
+    trips_lengths = norm(trips_sources_to_destinations, axis=1)
 
-        if np.dot(destination_to_trip_destination, trip_source_to_destination) < 0:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        to_source_distances = np.where(
+            dot_rows(source_to_trips_sources, trips_sources_to_destinations) > 0,
             # distance to source dot
-            to_destination_distance = norm(destination_to_trip_destination)
-        else:
+            norm(source_to_trips_sources, axis=1),
+            # distance to line
+            np.abs(cross_rows(source_to_trips_sources, trips_sources_to_destinations)) / trips_lengths)
+        to_destination_distances = np.where(
+            dot_rows(destination_to_trips_destinations, trips_sources_to_destinations) < 0,
+            # distance to destination dot
+            norm(destination_to_trips_destinations, axis=1),
             # distance to line
-            to_destination_distance = norm(
-                np.cross(destination_to_trip_destination, trip_source_to_destination)) / norm(
-                trip_source_to_destination)
+            np.abs(cross_rows(destination_to_trips_destinations, trips_sources_to_destinations)) / trips_lengths)
+
+    scores = to_source_distances + to_destination_distances
+    scores[trips_sources_to_destinations.dot(destination - source) < 0] = np.inf
+    return scores
+
+
+def get_route_score(route, source, destination):
+    """
+    Scores a trip following a route given as an (n, 2) array of its vertices. The score is the sum of distances from
+    the requested source and destination to the route, and np.inf when the destination comes before the source
+    along the route.
+    """
+    source_distance, source_location = locate_on_route(route, np.array(source, dtype=float))
+    destination_distance, destination_location = locate_on_route(route, np.array(destination, dtype=float))
+    if destination_location < source_location:
+        return np.inf
+    return source_distance + destination_distance
+
+
+def locate_on_route(route, point):
+    """
+    Returns the distance from point to the route and the length of the route before the closest point to it.
+    """
+    segments_starts, segments = route[:-1], np.diff(route, axis=0)
+    segments_lengths = norm(segments, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fractions = np.nan_to_num(dot_rows(point - segments_starts, segments) / segments_lengths ** 2)
+    fractions = np.clip(fractions, 0, 1)
+    distances = norm(segments_starts + fractions[:, np.newaxis] * segments - point, axis=1)
+    closest = int(np.argmin(distances))
+    return distances[closest], segments_lengths[:closest].sum() + fractions[closest] * segments_lengths[closest]
+
+
+def get_trip_score(trip, source: Point, destination: Point, in_meters=TRIP_SCORE_IN_METERS):
+    return get_trips_scores([trip], source, destination, in_meters)[0]
+
+
+def project_to_meters(coords, origin=SCORING_ORIGIN):
+    """
+    Projects (lat, lng) coordinates to (north, east) meters from origin on a local equirectangular projection,
+    which keeps distances accurate around a single city.
+    """
+    lat, lng = np.radians(np.asarray(coords, dtype=float)).T
+    origin_lat, origin_lng = np.radians(origin)
+    return np.array([EARTH_RADIUS * (lat - origin_lat), EARTH_RADIUS * (lng - origin_lng) * np.cos(origin_lat)]).T
+
+
+def get_heading(direction_x, direction_y):
+    return float(np.degrees(np.arctan2(direction_y, direction_x)))
+
+
+def get_same_direction_heading_ranges(heading):
+    """
+    Returns the (start, end) heading ranges, in degrees, of directions making an angle of at most 90 degrees with
+    heading. Headings are in [-180, 180] so the result is split in two ranges when it wraps around.
+    """
+    start, end = heading - 90, heading + 90
+    if start < -180:
+        return [(-180, end), (start + 360, 180)]
+    if end > 180:
+        return [(start, 180), (-180, end - 360)]
+    return [(start, end)]
+
+
+def dot_rows(first, second):
+    return np.einsum('ij,ij->i', first, second)
+
 
-    return to_source_distance + to_destination_distance
+def cross_rows(first, second):
+    return first[:, 0] * second[:, 1] - first[:, 1] * second[:, 0]
@@ -1,3 +1,4 @@
+import heapq
 import logging
 import os
 from datetime import datetime
@@ -6,6 +7,7 @@ import jwt
 import numpy as np
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.contrib.gis.geos import Point
 from django.db.models import Q
 from django.db.transaction import atomic
 from django.http import HttpResponseBadRequest, HttpResponse
@@ -16,25 +18,27 @@ from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.views.generic import DetailView
 from django.views.generic.base import View
-from expiringdict import ExpiringDict
-from geopy.distance import distance as point_distance
 
 from account.models import Member
-from carpooling.settings.base import DISTANCE_THRESHOLD
+from carpooling.settings.base import DISTANCE_THRESHOLD, TRIP_SEARCH_RADIUS, AUTOMATIC_JOIN_BATCH_ENABLED
 from group.models import Group, Membership
 from root.decorators import check_request_type, only_get_allowed
+from search.trips import reindex_trips
 from trip.forms import AutomaticJoinTripForm, QuickMailForm
+from trip.accessibility import refresh_trip_accessibility
 from trip.forms import TripForm, TripRequestForm
 from trip.models import Trip, TripGroups, Companionship, TripRequest, TripRequestSet, Vote
+from trip.matching import TRIP_SCORE_THRESHOLD
+from trip.nearby_groups_cache import nearby_groups_cache
+from trip.search_cache import trip_search_cache
+from trip.spatial_index import filter_nearby_trips
 from trip.utils import CAR_PROVIDER_QUICK_MESSAGES, \
     PASSENGER_QUICK_MESSAGES
-from trip.utils import extract_source, extract_destination
-from trip.utils import get_trip_score
-from .tasks import notify, spotify_delete_playlist
+from trip.utils import extract_source, extract_destination, extract_route
+from trip.utils import get_trips_scores
+from .tasks import notify, spotify_delete_playlist, schedule_automatic_join_batch
 from .utils import SpotifyAgent
 
-user_groups_cache = ExpiringDict(max_len=100, max_age_seconds=5 * 60)
-
 log = logging.getLogger(__name__)
 
 
@@ -58,12 +62,17 @@ class TripCreationManger(View):
     def create_trip(cls, car_provider: Member, post_data):
         source = extract_source(post_data)
         destination = extract_destination(post_data)
+        try:
+            route = extract_route(post_data)
+        except (TypeError, ValueError):
+            return None
         trip_form = TripForm(data=post_data)
-        if trip_form.is_valid() and TripForm.is_point_valid(source) and TripForm.is_point_valid(destination):
+        if trip_form.is_valid() and TripForm.is_point_valid(source) and TripForm.is_point_valid(destination) and \
+                (route is None or all(TripForm.is_point_valid(Point(point)) for point in route.coords)):
             trip_obj = trip_form.save(commit=False)
             trip_obj.car_provider = car_provider
             trip_obj.status = Trip.WAITING_STATUS
-            trip_obj.source, trip_obj.destination = source, destination
+            trip_obj.source, trip_obj.destination, trip_obj.route = source, destination, route
             spotify_agent = SpotifyAgent()
             trip_obj.playlist_id = spotify_agent.create_playlist(trip_obj.trip_description)
             trip_obj.save()
@@ -81,7 +90,7 @@ class TripRequestManager(View):
                 return HttpResponse('Trip status is not waiting', status=409)
             return cls.show_trip_requests(request, trip)
 
-        elif trip in Trip.get_accessible_trips_for(request.user):
+        elif trip.is_accessible_for(request.user):
             if trip.status != trip.WAITING_STATUS:
                 return HttpResponse('Trip status is not waiting', status=409)
             return cls.show_create_request_form(request)
@@ -90,10 +99,9 @@ class TripRequestManager(View):
 
     @staticmethod
     def show_trip_requests(request, trip, error=None):
-        trip_members_count = Companionship.objects.filter(trip=trip).count()
         return render(request, 'trip_requests.html', {
             'requests': trip.requests.filter(status=TripRequest.PENDING_STATUS),
-            'members_count': trip_members_count,
+            'members_count': trip.seats_taken,
             'capacity': trip.capacity,
             'error': error,
         })
@@ -109,7 +117,7 @@ class TripRequestManager(View):
         if request.user == trip.car_provider or trip.passengers.filter(id=request.user.id).exists():
             return HttpResponse('You are already partaking this trip', status=403)
 
-        if trip not in Trip.get_accessible_trips_for(request.user):
+        if not trip.is_accessible_for(request.user):
             return HttpResponse('You have not access to this trip', status=403)
 
         if trip.status != trip.WAITING_STATUS:
@@ -124,7 +132,7 @@ class TripRequestManager(View):
                 try:
                     self.accept_trip_request(trip, trip_request.id)
                     log.info("Request {} accepted automatically.".format(trip_request.id))
-                except Trip.TripIsFullException():
+                except Trip.TripIsFullException:
                     log.info("Failed to automatically join trip #{} due to capacity limit.".format(trip.id))
             return redirect(reverse('trip:trip', kwargs={'pk': trip_id}))
         log.warning("Failed to create request to trip {} due to form validation errors.".format(trip.id),
@@ -134,7 +142,8 @@ class TripRequestManager(View):
     @staticmethod
     @atomic
     def accept_trip_request(trip, trip_request_id):
-        if trip.capacity <= trip.passengers.count():
+        trip = Trip.lock(trip.id)
+        if trip.is_full():
             raise Trip.TripIsFullException()
         trip_request = get_object_or_404(TripRequest, id=trip_request_id, trip=trip)
         trip_request.status = TripRequest.ACCEPTED_STATUS
@@ -142,6 +151,8 @@ class TripRequestManager(View):
         Companionship.objects.create(member=trip_request.containing_set.applicant, trip=trip,
                                      source=trip_request.source, destination=trip_request.destination)
         trip_request.containing_set.close()
+        trip.seats_taken += 1
+        return trip
 
     @staticmethod
     @atomic
@@ -182,7 +193,7 @@ class TripRequestManager(View):
         action = request.POST.get('action', 'accept')
         if action == 'accept':
             try:
-                cls.accept_trip_request(trip, trip_request_id)
+                trip = cls.accept_trip_request(trip, trip_request_id)
                 log.info("Request #{} accepted successfully.".format(trip_request_id), extra={'user': request.user})
                 return cls.show_trip_requests(request, trip)
             except Trip.TripIsFullException:
@@ -198,7 +209,7 @@ class TripRequestManager(View):
 
 
 class AutomaticJoinRequestManager(View):
-    TRIP_SCORE_THRESHOLD = 0.05
+    TRIP_SCORE_THRESHOLD = TRIP_SCORE_THRESHOLD
 
     @staticmethod
     def get(request):
@@ -210,6 +221,8 @@ class AutomaticJoinRequestManager(View):
                                      trip_score_threshold=cls.TRIP_SCORE_THRESHOLD)
 
         if form.is_valid():
+            if AUTOMATIC_JOIN_BATCH_ENABLED:
+                return cls.queue_automatic_join_request(request, form)
             trip = form.join_a_trip_automatically()
             if trip is not None:
                 log.info('Joined automatically to trip #{}.'.format(trip.id), extra={'user': request.user})
@@ -219,6 +232,13 @@ class AutomaticJoinRequestManager(View):
 
         return HttpResponse('Bad Request', status=400)
 
+    @staticmethod
+    def queue_automatic_join_request(request, form):
+        automatic_join_request = form.queue_automatic_join_request()
+        schedule_automatic_join_batch()
+        log.info('Automatic join request #{} queued.'.format(automatic_join_request.id), extra={'user': request.user})
+        return render(request, 'automatic_join_queued.html', {'automatic_join_request': automatic_join_request})
+
 
 class TripDetailView(DetailView):
     model = Trip
@@ -365,37 +385,44 @@ class TripGroupsManager(View):
     def post(cls, request, trip_id):
         user_nearby_groups = cls.get_nearby_groups(request.user, trip_id)
         trip = Trip.objects.get(id=trip_id)
-        for group in user_nearby_groups:
-            if request.POST.get(group.code) == 'on':
-                TripGroups.objects.create(group=group, trip=trip)
-                log.info('Trip #{} added to group #{}.'.format(trip.id, group.id))
+        cls.add_trip_to_groups(trip, [group for group in user_nearby_groups if request.POST.get(group.code) == 'on'])
         return redirect(reverse("trip:trip", kwargs={'pk': trip_id}))
 
     @staticmethod
-    def get_nearby_groups(user, trip_id):
-        user_nearby_groups = user_groups_cache.get((user.id, trip_id))
-        if user_nearby_groups is not None:
-            return user_groups_cache[(user.id, trip_id)]
-        user_groups = user.group_set.all()
-        trip = get_object_or_404(Trip, id=trip_id)
-        user_nearby_groups = []
-        for group in user_groups:
-            if TripGroupsManager.is_group_near_trip(group, trip):
-                user_nearby_groups.append(group)
-        user_groups_cache[(user.id, trip_id)] = user_nearby_groups
-        return user_nearby_groups
+    def add_trip_to_groups(trip, groups):
+        """
+        Attaches the trip to all the groups in one insert. bulk_create does not send the TripGroups signals, so the
+        accessibility and the search document of the trip are refreshed once for the whole batch.
+        """
+        if not groups:
+            return
+        with atomic():
+            TripGroups.objects.bulk_create([TripGroups(group=group, trip=trip) for group in groups],
+                                           ignore_conflicts=True)
+            refresh_trip_accessibility(trip_ids=[trip.id])
+            reindex_trips([trip.id])
+        log.info('Trip #{} added to groups {}.'.format(trip.id, [group.id for group in groups]))
 
     @staticmethod
-    def is_group_near_trip(group, trip):
-        return group.source is None or (TripGroupsManager.is_in_range(group.source, trip.source) or
-                                        TripGroupsManager.is_in_range(group.source, trip.destination))
+    def get_nearby_groups(user, trip_id):
+        trip = get_object_or_404(Trip, id=trip_id)
+        return nearby_groups_cache.get_nearby_groups(user, trip, TripGroupsManager.find_nearby_groups)
 
     @staticmethod
-    def is_in_range(first_point, second_point, threshold=DISTANCE_THRESHOLD):
-        return point_distance(first_point, second_point).meters <= threshold
+    def find_nearby_groups(user, trip):
+        return Group.filter_near(user.group_set.all(), [trip.source, trip.destination], DISTANCE_THRESHOLD)
 
 
 class SearchTripsManager(View):
+    DEFAULT_PAGE_SIZE = 20
+    MAX_PAGE_SIZE = 100
+    # Searches rank and cache this many trips at most, whatever their accessibility. Users who see fewer of them
+    # than their page needs get a ranking of their visible trips only.
+    RANKED_TRIPS_COUNT = MAX_PAGE_SIZE * 5
+    # Fields read by the scorer
+    SCORED_TRIP_FIELDS = ['id', 'source', 'destination', 'route', 'projected_source_x', 'projected_source_y',
+                          'projected_destination_x', 'projected_destination_y']
+
     @classmethod
     def get(cls, request):
         if cls.is_valid_search_parameter(request.GET):
@@ -405,17 +432,77 @@ class SearchTripsManager(View):
     @classmethod
     def do_search(cls, request):
         data = request.GET
+        try:
+            offset, limit = cls.extract_page(data)
+            time_range = cls.extract_time_range(data)
+        except (KeyError, ValueError):
+            return HttpResponse('Bad Request', status=400)
         source = extract_source(data)
         destination = extract_destination(data)
+        ranked_trip_ids = trip_search_cache.get_ranked_trip_ids(source, destination, time_range, cls.rank_trips)
         trips = Trip.get_accessible_trips_for(request.user)
-        if data['start_time'] != "-1":
-            trips = cls.filter_by_dates(
-                data['start_time'], data['end_time'], trips)
-        trips = sorted(trips, key=lambda trip: (
-            get_trip_score(trip, source=source, destination=destination)))
-        trips = filter(lambda trip: get_trip_score(
-            trip, source, destination) != np.inf, trips)
-        return render(request, "trips_viewer.html", {"trips": trips})
+        if time_range is not None:
+            trips = cls.filter_by_dates(*time_range, trips)
+        count = offset + limit + 1
+        best_trips = cls.select_visible_trips(ranked_trip_ids, trips, count)
+        if len(best_trips) < count and len(ranked_trip_ids) >= cls.RANKED_TRIPS_COUNT:
+            # The shared ranking was cut before enough trips visible to the user, rank the visible ones only
+            ranked_trip_ids = cls.rank_trips(source, destination, None, trips, count)
+            best_trips = cls.select_visible_trips(ranked_trip_ids, trips, count)
+        return render(request, "trips_viewer.html", {
+            "trips": best_trips[offset:offset + limit],
+            "previous_page_url": cls.get_page_url(request, max(offset - limit, 0), limit) if offset > 0 else None,
+            "next_page_url": cls.get_page_url(request, offset + limit, limit) if len(best_trips) > offset + limit
+            else None,
+        })
+
+    @classmethod
+    def rank_trips(cls, source, destination, time_range, trips_query_set=None, count=None):
+        """
+        Returns the ids of the count best scored trips of the query set matching the search, best first. By default,
+        the RANKED_TRIPS_COUNT best ones among all trips whatever their accessibility, which are cached.
+        """
+        if trips_query_set is None:
+            trips_query_set = Trip.objects.all()
+        trips = cls.filter_by_location(source, destination, trips_query_set.only(*cls.SCORED_TRIP_FIELDS))
+        if time_range is not None:
+            trips = cls.filter_by_dates(*time_range, trips)
+        trips = list(trips)
+        scores = get_trips_scores(trips, source, destination)
+        return [trip.id for trip in cls.select_best_trips(trips, scores, count or cls.RANKED_TRIPS_COUNT)]
+
+    @staticmethod
+    def select_visible_trips(ranked_trip_ids, trips_query_set, count):
+        """
+        Keeps the count first ranked trips which are in the query set, in their ranking order.
+        """
+        visible_trip_ids = set(trips_query_set.filter(id__in=ranked_trip_ids).values_list('id', flat=True))
+        trip_ids = [trip_id for trip_id in ranked_trip_ids if trip_id in visible_trip_ids][:count]
+        trips = Trip.objects.in_bulk(trip_ids)
+        return [trips[trip_id] for trip_id in trip_ids if trip_id in trips]
+
+    @classmethod
+    def extract_page(cls, data):
+        offset = int(data.get('offset', 0))
+        limit = int(data.get('limit', cls.DEFAULT_PAGE_SIZE))
+        if offset < 0 or not 0 < limit <= cls.MAX_PAGE_SIZE:
+            raise ValueError()
+        return offset, limit
+
+    @staticmethod
+    def select_best_trips(trips, scores, count):
+        """
+        Keeps the count best scored trips in a bounded heap, dropping trips that go in the opposite direction.
+        Equally scored trips keep their original order.
+        """
+        indexes = (index for index in range(len(trips)) if scores[index] != np.inf)
+        return [trips[index] for index in heapq.nsmallest(count, indexes, key=scores.__getitem__)]
+
+    @staticmethod
+    def get_page_url(request, offset, limit):
+        data = request.GET.copy()
+        data['offset'], data['limit'] = offset, limit
+        return "{}?{}".format(request.path, data.urlencode())
 
     @staticmethod
     def is_valid_search_parameter(post_data):
@@ -425,10 +512,19 @@ class SearchTripsManager(View):
         return True
 
     @staticmethod
-    def filter_by_dates(start_date, end_date, trips_query_set):
-        search_start_time = datetime.strptime(start_date, "%Y-%m-%d %H:%M:%S")
-        search_end_time = datetime.strptime(end_date, "%Y-%m-%d %H:%M:%S")
-        return trips_query_set.filter(start_estimation__gt=search_start_time, end_estimation__lt=search_end_time)
+    def filter_by_location(source, destination, trips_query_set, radius=TRIP_SEARCH_RADIUS):
+        return filter_nearby_trips(trips_query_set, source, destination, radius)
+
+    @staticmethod
+    def extract_time_range(data):
+        if data.get('start_time', '-1') == '-1':
+            return None
+        return datetime.strptime(data['start_time'], "%Y-%m-%d %H:%M:%S"), \
+            datetime.strptime(data['end_time'], "%Y-%m-%d %H:%M:%S")
+
+    @staticmethod
+    def filter_by_dates(start_time, end_time, trips_query_set):
+        return trips_query_set.filter(time_window__contained_by=Trip.get_time_range(start_time, end_time))
 
 
 @login_required